@@ -0,0 +1,93 @@
+""" Measures the turns per second of sharded_server.py with a growing number of workers.
+
+Run from the backend folder with: `python benchmarks/bench_workers.py --workers 1 2 4 8`, this requires the framework
+(installed, or in the ../framework folder). For each number of workers the server is started with a new sessions
+folder, and some client processes open the connections of different users and send data turns as fast as they can.
+The scaling is visible only on a machine with more cores than workers, the clients use the same cores.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import websockets
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+FRAMEWORK = os.path.join(BACKEND, "..", "framework")
+# a data turn that the demo process does not understand, so the interaction never advances
+TURN = json.dumps({"type": "data", "payload": {"intent": "nothing"}})
+
+
+async def user(port, uid, turns):
+    async with websockets.connect(f"ws://localhost:{port}/?uid={uid}") as websocket:
+        await websocket.recv()  # the interaction id
+        await websocket.recv()  # the welcome message
+        for _ in range(turns):
+            await websocket.send(TURN)
+            await websocket.recv()
+
+
+async def users(port, first, count, turns):
+    await asyncio.gather(*(user(port, f"user-{number}", turns) for number in range(first, first + count)))
+
+
+def client(arguments):
+    asyncio.run(users(*arguments))
+
+
+def wait_for_port(port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(("localhost", port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+
+
+def measure(workers, args):
+    with tempfile.TemporaryDirectory() as sessions:
+        environment = dict(os.environ, MMCC_WORKERS=str(workers), MMCC_PORT=str(args.port),
+                           MMCC_SESSIONS_DIR=sessions,
+                           PYTHONPATH=os.pathsep.join(filter(None, [FRAMEWORK, os.environ.get("PYTHONPATH")])))
+        # the handler prints every message, that is not part of the measure
+        server = subprocess.Popen([sys.executable, "sharded_server.py"], cwd=BACKEND, env=environment,
+                                  stdout=subprocess.DEVNULL)
+        try:
+            wait_for_port(args.port)
+            # the workers import the framework after the front process accepts connections
+            time.sleep(1.0)
+            jobs = [(args.port, index * args.users, args.users, args.turns) for index in range(args.clients)]
+            begin = time.perf_counter()
+            with multiprocessing.Pool(args.clients) as pool:
+                pool.map(client, jobs)
+            elapsed = time.perf_counter() - begin
+        finally:
+            server.terminate()
+            server.wait()
+    total = args.clients * args.users * args.turns
+    print(f"{workers:>8} {total:>8} {elapsed:>10.2f} {total / elapsed:>12.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="the numbers of workers to measure")
+    parser.add_argument("--clients", type=int, default=os.cpu_count() or 1, help="the number of client processes")
+    parser.add_argument("--users", type=int, default=50, help="the connections of each client process")
+    parser.add_argument("--turns", type=int, default=40, help="the turns sent on each connection")
+    parser.add_argument("--port", type=int, default=8799, help="the port of the server")
+    args = parser.parse_args()
+    print(f"{'workers':>8} {'turns':>8} {'seconds':>10} {'turns/s':>12}")
+    for workers in args.workers:
+        measure(workers, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+""" Checks that proxy.py sends each user to the same websocket server, and that changing the servers moves few users.
+
+Run from the backend folder with: `python benchmarks/check_proxy.py`, this requires the framework (installed, or in the
+../framework folder). First it measures on the hash ring how many users move when a server is added or removed. Then it
+starts some websocket_server.py processes and the proxy, starts an interaction for each user, and resumes it on a new
+connection; finally it removes a server, reloads the proxy with SIGHUP and resumes the interactions again: only the
+users of the removed server must fail (their server prints the KeyError of the missing interactions).
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+
+import websockets
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+FRAMEWORK = os.path.join(BACKEND, "..", "framework")
+sys.path.insert(0, BACKEND)
+
+from proxy import HashRing  # noqa: E402
+
+TURN = json.dumps({"type": "data", "payload": {"intent": "nothing"}})
+
+
+def check_ring(servers, keys):
+    users = [f"user-{number}" for number in range(keys)]
+    nodes = [f"localhost:{9000 + number}" for number in range(servers)]
+    ring = HashRing(nodes)
+    before = {user: ring.node_of(user) for user in users}
+    load = sorted(list(before.values()).count(node) for node in nodes)
+    print(f"{servers} servers, users for each server: min {load[0]}, max {load[-1]} (ideal {keys // servers})")
+
+    ring.add("localhost:9999")
+    added = {user: ring.node_of(user) for user in users}
+    moved = [user for user in users if added[user] != before[user]]
+    assert all(added[user] == "localhost:9999" for user in moved)
+    print(f"server added: {len(moved) / keys:.1%} of the users moved (ideal {1 / (servers + 1):.1%})")
+
+    ring.remove("localhost:9999")
+    ring.remove(nodes[0])
+    removed = {user: ring.node_of(user) for user in users}
+    moved = [user for user in users if removed[user] != before[user]]
+    assert all(before[user] == nodes[0] for user in moved)
+    print(f"server removed: {len(moved) / keys:.1%} of the users moved (ideal {1 / servers:.1%})")
+
+
+async def start(port, uid):
+    async with websockets.connect(f"ws://localhost:{port}/?uid={uid}") as websocket:
+        interaction = await websocket.recv()
+        await websocket.recv()  # the welcome message
+        await websocket.send(TURN)
+        await websocket.recv()
+        return interaction
+
+
+async def resume(port, uid, interaction):
+    try:
+        async with websockets.connect(
+                f"ws://localhost:{port}/?{urlencode({'uid': uid, 'interaction': interaction})}") as websocket:
+            await websocket.send(TURN)
+            return "error" not in json.loads(await websocket.recv())
+    except websockets.ConnectionClosedError:
+        # the server does not have the interaction
+        return False
+
+
+def wait_for_port(port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(("localhost", port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+async def check_servers(args, directory):
+    environment = dict(os.environ,
+                       PYTHONPATH=os.pathsep.join(filter(None, [FRAMEWORK, os.environ.get("PYTHONPATH")])))
+    backends = [f"localhost:{args.port + 1 + number}" for number in range(args.servers)]
+    backends_file = os.path.join(directory, "backends.txt")
+    with open(backends_file, "w") as file:
+        file.write("\n".join(backends))
+    processes = []
+    try:
+        for number, backend in enumerate(backends):
+            processes.append(subprocess.Popen(
+                [sys.executable, "websocket_server.py"], cwd=BACKEND, stdout=subprocess.DEVNULL,
+                env=dict(environment, MMCC_PORT=backend.rpartition(":")[2],
+                         MMCC_SESSIONS_DIR=os.path.join(directory, f"server-{number}"))))
+        proxy = subprocess.Popen([sys.executable, "proxy.py"], cwd=BACKEND, stdout=subprocess.DEVNULL,
+                                 env=dict(environment, MMCC_PROXY_PORT=str(args.port), MMCC_BACKENDS_FILE=backends_file))
+        processes.append(proxy)
+        for port in [args.port] + [int(backend.rpartition(":")[2]) for backend in backends]:
+            wait_for_port(port)
+
+        users = [f"user-{number}" for number in range(args.users)]
+        interactions = await asyncio.gather(*(start(args.port, user) for user in users))
+        resumed = await asyncio.gather(*(resume(args.port, user, i) for user, i in zip(users, interactions)))
+        print(f"{sum(resumed)}/{len(users)} interactions resumed through the proxy")
+        assert all(resumed)
+
+        ring = HashRing(backends)
+        with open(backends_file, "w") as file:
+            file.write("\n".join(backends[1:]))
+        proxy.send_signal(signal.SIGHUP)
+        await asyncio.sleep(0.5)
+        resumed = await asyncio.gather(*(resume(args.port, user, i) for user, i in zip(users, interactions)))
+        lost = [user for user, ok in zip(users, resumed) if not ok]
+        expected = [user for user in users if ring.node_of(user) == backends[0]]
+        print(f"server removed: {len(lost)}/{len(users)} interactions lost, {len(expected)} were on that server")
+        assert lost == expected
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--servers", type=int, default=3, help="the number of websocket servers")
+    parser.add_argument("--users", type=int, default=60, help="the number of users")
+    parser.add_argument("--keys", type=int, default=100000, help="the number of users placed on the hash ring")
+    parser.add_argument("--port", type=int, default=8790, help="the port of the proxy, the servers use the next ones")
+    args = parser.parse_args()
+    check_ring(args.servers, args.keys)
+    with tempfile.TemporaryDirectory() as directory:
+        asyncio.run(check_servers(args, directory))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,15 @@
 import string
 import random
 import os.path
-from threading import Lock
 from urllib.parse import urlsplit, parse_qsl, urlencode
-from mmcc_framework import Framework
+from mmcc_framework import Framework, KeyedLocks, ResponseLog, SerialExecutor, SessionStore, WriteBehindSaver
 from config.my_callbacks import get_callback, nluAdapter
 from uuid import uuid4
 
-lock = Lock()
+# the kb is written to its file in the background, call saver.close() before shutting down
+saver = WriteBehindSaver()
+# the file of the kb, only one process can write it (see sharded_server.py)
+KB_PATH = os.environ.get("MMCC_KB_PATH", os.path.join("config", "my_kb.json"))
 
 
 def id_generator(
@@ -37,14 +39,27 @@ def add_params(url, params: dict):
 def create_framework():
     # TODO: framework personalized for each user (Tutor)
     # Prepare the state and the framework.
+    # The kb file is written holding its own lock (see FILE_LOCKS), the
+    # sessions that use other files do not wait for it.
     return Framework.from_file(os.path.join("config", "my_process.json"),
-                               os.path.join("config", "my_kb.json"),
+                               KB_PATH,
                                {},
                                get_callback,
                                nluAdapter,
-                               lock
+                               saver=saver
                                )
 
 
+def create_session_store():
+    # the sessions are keyed by (uid, interaction), the least recently used
+    # ones are moved to the disk when there are too many in memory, or when
+    # their estimated size is more than MMCC_MAX_SESSION_BYTES (if it is set)
+    max_bytes = os.environ.get("MMCC_MAX_SESSION_BYTES")
+    return SessionStore(create_framework,
+                        os.environ.get("MMCC_SESSIONS_DIR", "sessions"),
+                        max_sessions=int(os.environ.get("MMCC_MAX_SESSIONS", 10000)),
+                        max_bytes=int(max_bytes) if max_bytes else None)
+
+
 def welcome_message_framework(framework):
 	return framework.handle_text_input('')
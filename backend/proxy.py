@@ -0,0 +1,249 @@
+import asyncio
+import bisect
+import hashlib
+import itertools
+import os
+import signal
+from urllib.parse import urlsplit, parse_qsl
+
+# A proxy that sends all the connections of a user to the same websocket server.
+#
+# Each server holds the sessions of its users, so a user that reconnects to
+# resume an interaction must reach the server where the interaction started.
+# The proxy reads the request of the websocket handshake, chooses the server of
+# the uid with a consistent hash ring, and then copies the bytes in both
+# directions without looking at them. When a server is added or removed only
+# the users of that server move (about 1/N of them), the others keep their
+# server. The list of servers is read from MMCC_BACKENDS (host:port separated by
+# commas), or from the file MMCC_BACKENDS_FILE (one host:port for each line),
+# which is read again when the proxy receives SIGHUP.
+
+PORT = int(os.environ.get("MMCC_PROXY_PORT", 8765))
+BACKENDS = os.environ.get("MMCC_BACKENDS", "localhost:8766")
+BACKENDS_FILE = os.environ.get("MMCC_BACKENDS_FILE")
+# the points of each server on the ring, more points spread the users more evenly
+VIRTUAL_NODES = 160
+# the connections whose request is longer than this, or is not received within
+# HANDSHAKE_TIMEOUT seconds, are closed
+MAX_REQUEST_HEAD = 16384
+HANDSHAKE_TIMEOUT = 10.0
+CONNECT_TIMEOUT = 5.0
+
+
+def ring_hash(key):
+    # a stable hash, python's hash() of strings changes in each process
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing(object):
+    # maps each key to a node, adding or removing a node moves only the keys
+    # that go to (or came from) that node
+
+    def __init__(self, nodes=(), virtual_nodes=VIRTUAL_NODES):
+        self.virtual_nodes = virtual_nodes
+        self._points = []
+        self._owners = []
+        self._nodes = set()
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def nodes(self):
+        return set(self._nodes)
+
+    def add(self, node):
+        if node in self._nodes:
+            return
+        self._nodes.add(node)
+        for replica in range(self.virtual_nodes):
+            point = ring_hash(f"{node}#{replica}")
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove(self, node):
+        if node not in self._nodes:
+            return
+        self._nodes.remove(node)
+        kept = [(point, owner) for point, owner in zip(self._points, self._owners) if owner != node]
+        self._points = [point for point, _ in kept]
+        self._owners = [owner for _, owner in kept]
+
+    def node_of(self, key):
+        # the first point after the hash of the key, going around the ring
+        if not self._points:
+            raise LookupError("the ring has no nodes")
+        index = bisect.bisect(self._points, ring_hash(key)) % len(self._points)
+        return self._owners[index]
+
+
+def parse_backends(text):
+    # "host:port" separated by commas or new lines, the port must be present
+    backends = []
+    for item in text.replace(",", "\n").splitlines():
+        item = item.strip()
+        if item and not item.startswith("#"):
+            host, _, port = item.rpartition(":")
+            backends.append(f"{host or 'localhost'}:{int(port)}")
+    return backends
+
+
+def read_uid(head):
+    # the uid in the request line of the handshake, or None
+    parts = head.split(b"\r\n", 1)[0].split(b" ")
+    if len(parts) != 3:
+        return None
+    uid = dict(parse_qsl(urlsplit(parts[1].decode("latin-1")).query)).get("uid")
+    return None if uid in (None, "None") else uid
+
+
+class Pipe(asyncio.Protocol):
+    # one side of a proxied connection, what it receives is written to the
+    # transport of its peer, and it stops reading while the peer is slow
+
+    def __init__(self):
+        self.transport = None
+        self.peer = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.peer.transport.write(data)
+
+    def eof_received(self):
+        if self.peer is not None and self.peer.transport.can_write_eof():
+            self.peer.transport.write_eof()
+            # keep the other direction open until the peer closes it
+            return True
+        return False
+
+    def connection_lost(self, exc):
+        if self.peer is not None:
+            # close() sends the data that is still buffered
+            self.peer.transport.close()
+
+    def pause_writing(self):
+        if self.peer is not None:
+            self.peer.transport.pause_reading()
+
+    def resume_writing(self):
+        if self.peer is not None:
+            self.peer.transport.resume_reading()
+
+
+class ClientPipe(Pipe):
+    # the side of the client, it keeps the request head until the server of
+    # the user is connected
+
+    def __init__(self, proxy):
+        super().__init__()
+        self.proxy = proxy
+        self.head = bytearray()
+        self.timeout = None
+
+    def connection_made(self, transport):
+        super().connection_made(transport)
+        self.timeout = asyncio.get_running_loop().call_later(HANDSHAKE_TIMEOUT, transport.close)
+
+    def data_received(self, data):
+        if self.peer is not None:
+            self.peer.transport.write(data)
+            return
+        self.head += data
+        if b"\r\n\r\n" in self.head:
+            self.timeout.cancel()
+            self.transport.pause_reading()
+            asyncio.get_running_loop().create_task(self.connect(read_uid(self.head)))
+        elif len(self.head) > MAX_REQUEST_HEAD:
+            self.transport.close()
+
+    def eof_received(self):
+        if self.peer is None:
+            return False
+        return super().eof_received()
+
+    def connection_lost(self, exc):
+        self.timeout.cancel()
+        super().connection_lost(exc)
+
+    async def connect(self, uid):
+        backend = self.proxy.backend_of(uid)
+        host, _, port = backend.rpartition(":")
+        loop = asyncio.get_running_loop()
+        try:
+            _, server = await asyncio.wait_for(loop.create_connection(Pipe, host, port), CONNECT_TIMEOUT)
+        except (OSError, asyncio.TimeoutError) as e:
+            print(f"cannot connect to {backend} for uid {uid}: {e!r}")
+            self.transport.write(b"HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            self.transport.close()
+            return
+        if self.transport.is_closing():
+            server.transport.close()
+            return
+        server.peer = self
+        self.peer = server
+        server.transport.write(self.head)
+        self.head = None
+        self.transport.resume_reading()
+
+
+class Proxy(object):
+    # chooses the server of each connection, the requests without uid (the
+    # ones that ask for a new uid) are spread over all the servers
+
+    def __init__(self, backends):
+        self.ring = HashRing()
+        self._spread = None
+        self.update(backends)
+
+    def update(self, backends):
+        backends = set(backends)
+        if not backends:
+            raise ValueError("there must be at least one backend")
+        for node in self.ring.nodes() - backends:
+            self.ring.remove(node)
+        for node in backends - self.ring.nodes():
+            self.ring.add(node)
+        self._spread = itertools.cycle(sorted(backends))
+
+    def backend_of(self, uid):
+        if uid is None:
+            return next(self._spread)
+        return self.ring.node_of(uid)
+
+
+def load_backends():
+    if BACKENDS_FILE:
+        with open(BACKENDS_FILE) as file:
+            return parse_backends(file.read())
+    return parse_backends(BACKENDS)
+
+
+async def main():
+    proxy = Proxy(load_backends())
+    loop = asyncio.get_running_loop()
+
+    def reload():
+        try:
+            proxy.update(load_backends())
+        except (OSError, ValueError) as e:
+            print(f"backends not changed: {e!r}")
+            return
+        print(f"backends: {sorted(proxy.ring.nodes())}")
+
+    if BACKENDS_FILE:
+        loop.add_signal_handler(signal.SIGHUP, reload)
+    server = await loop.create_server(lambda: ClientPipe(proxy), "", PORT)
+    print(f"listening on {PORT}, backends: {sorted(proxy.ring.nodes())}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -1,3 +1,4 @@
+import os
 from flask import Flask, request, session
 from flask_restful import Resource, Api, reqparse
 from functions import *
@@ -6,7 +7,15 @@ from functions import *
 app = Flask(__name__)
 api = Api(app)
 
-my_framework = dict()
+my_framework = create_session_store()
+
+# the requests of the same session are handled one at a time, the ones of
+# different sessions in parallel
+session_locks = KeyedLocks()
+
+# the last response of each session, to answer again the requests that are
+# retried after they were handled (see Event)
+last_responses = ResponseLog(int(os.environ.get("MMCC_MAX_LAST_RESPONSES", 10000)))
 
 # create REST backup API
 # https://towardsdatascience.com/the-right-way-to-build-an-api-with-python-cd08ab285f8f
@@ -38,15 +47,16 @@ class Init(Resource):
         # session.save(uid)
         session['uid'] = uid
         print(session)
-        if uid not in my_framework:
-            my_framework[uid] = dict()
         # generate a new interaction
         i = session['interaction'] = id_generator()
         # initialize framework
         # TODO: the process will be sent from the client (?)
-        my_framework[uid][i] = create_framework()
-        welcome_message = welcome_message_framework(my_framework[uid][i])
-        print(my_framework)
+        my_framework.put((uid, i), create_framework())
+        with my_framework.using((uid, i)) as framework:
+            welcome_message = welcome_message_framework(framework)
+            welcome_message['version'] = framework.version
+        last_responses.remember((uid, i), welcome_message)
+        print(my_framework.stats())
         return welcome_message, 200
 
 
@@ -59,6 +69,13 @@ class Event(Resource):
     #     return {'response': 'ok'}, 200
 
     def post(self):
+        # the request can contain the version of the interaction that the
+        # client has seen, i.e. the version of the last response it received.
+        # If the interaction has changed since then, the request is not
+        # handled: if it is the retry of the last request, it receives the
+        # same response again, otherwise it receives a 409 error with the
+        # current version. A version that is not an integer receives a 400
+        # error. The requests without version are always handled.
         if 'uid' in session:
             uid = session.get('uid')
             i = session.get('interaction')
@@ -68,13 +85,18 @@ class Event(Resource):
         # https://stackoverflow.com/questions/30491841/python-flask-restful-post-not-taking-json-arguments
         recv = request.get_json(force=True)
         print(recv)
+        key = (uid, i)
+        expected = recv.get('version')
         if recv['type'] == 'utterance':
-            send = my_framework[uid][i].handle_text_input(recv['utterance'])
-            return send  # no need to convert to string on rest
-                         # (vs Websockets)
+            def handle(framework):
+                return framework.handle_text_input(recv['utterance'])
         else:
-            send = my_framework[uid][i].handle_data_input(recv['payload'])
-            return send
+            def handle(framework):
+                return framework.handle_data_input(recv['payload'])
+        # the session is not moved to the disk while the request is handled
+        with session_locks.hold(key), my_framework.using(key) as framework:
+            # no need to convert to string on rest (vs Websockets)
+            return last_responses.handle(key, framework, expected, handle)
 
 
 api.add_resource(Event, '/event')
@@ -83,4 +105,7 @@ api.add_resource(Event, '/event')
 if __name__ == '__main__':
     app.secret_key = 'super secret key'
     app.config['SESSION_TYPE'] = 'filesystem'
-    app.run()  # run our Flask app for the REST API on port 5000
+    try:
+        app.run()  # run our Flask app for the REST API on port 5000
+    finally:
+        saver.close()  # write the kb changes that are still pending
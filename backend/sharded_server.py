@@ -0,0 +1,198 @@
+import asyncio
+import multiprocessing
+import os
+import selectors
+import shutil
+import signal
+import socket
+import time
+import zlib
+from urllib.parse import urlsplit, parse_qsl
+
+# Runs the websocket server in MMCC_WORKERS processes, to use more than one core.
+#
+# A front process accepts the connections and reads (without consuming it) the
+# first line of the websocket handshake, which contains the uid. Then it passes
+# the socket to the worker of that uid, so all the connections of a user reach
+# the process that holds the sessions of that user. Each worker runs the
+# handler of websocket_server.py and keeps its sessions, and its own copy of
+# the kb, in its own folder.
+# The number of workers must not change while sessions are saved on the disk,
+# otherwise the uids would be assigned to different workers.
+
+PORT = int(os.environ.get("MMCC_PORT", 8765))
+WORKERS = int(os.environ.get("MMCC_WORKERS", os.cpu_count() or 1))
+SESSIONS_DIR = os.environ.get("MMCC_SESSIONS_DIR", "sessions")
+# the kb copied by each worker when it starts for the first time
+KB_PATH = os.environ.get("MMCC_KB_PATH", os.path.join("config", "my_kb.json"))
+# the connections that do not send the request line within this time are closed
+HANDSHAKE_TIMEOUT = 10.0
+MAX_REQUEST_LINE = 8192
+# the seconds after which a connection whose request line is not complete is
+# checked again
+RECHECK_INTERVAL = 0.05
+
+
+def worker_of(uid, workers):
+    # a stable hash, python's hash() of strings changes in each process
+    return zlib.crc32(uid.encode("utf-8")) % workers
+
+
+def read_uid(data):
+    # returns the uid in the request line of the handshake, None if there is
+    # no uid, or False if the line is not complete yet
+    end = data.find(b"\r\n")
+    if end < 0:
+        return None if len(data) >= MAX_REQUEST_LINE else False
+    parts = data[:end].split(b" ")
+    if len(parts) != 3:
+        return None
+    params = dict(parse_qsl(urlsplit(parts[1].decode("latin-1")).query))
+    uid = params.get("uid")
+    return None if uid in (None, "None") else uid
+
+
+def run_worker(index, channel):
+    # the sessions and the kb saver are created here, after the fork
+    worker_dir = os.path.join(SESSIONS_DIR, f"worker-{index}")
+    os.environ["MMCC_SESSIONS_DIR"] = worker_dir
+    # each worker writes its own copy of the kb: the workers cannot share a
+    # file, each one would load again the kb written by the others and lose
+    # the changes of its running sessions
+    kb_path = os.path.join(worker_dir, "my_kb.json")
+    if not os.path.exists(kb_path):
+        os.makedirs(worker_dir, exist_ok=True)
+        shutil.copyfile(KB_PATH, kb_path)
+    os.environ["MMCC_KB_PATH"] = kb_path
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    import websockets
+    import websocket_server
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    # the server listens on a private port that nobody uses, the connections
+    # arrive from the front process
+    private = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    private.bind(("127.0.0.1", 0))
+    private.listen()
+    ws_server = loop.run_until_complete(websockets.serve(websocket_server.handler, sock=private))
+
+    def factory():
+        # the protocol that serves a socket accepted by the front process, it
+        # is registered in ws_server, so closing ws_server closes it too
+        return websockets.WebSocketServerProtocol(websocket_server.handler, ws_server)
+
+    def receive():
+        try:
+            message, fds, _, _ = socket.recv_fds(channel, 1, 1)
+        except BlockingIOError:
+            return
+        if not message:
+            # the front process is gone
+            loop.stop()
+            return
+        for fd in fds:
+            connection = socket.socket(fileno=fd)
+            connection.setblocking(False)
+            loop.create_task(loop.connect_accepted_socket(factory, connection))
+
+    channel.setblocking(False)
+    loop.add_reader(channel.fileno(), receive)
+    loop.create_task(websocket_server.reaper())
+    print(f"worker {index} ({os.getpid()}) ready")
+    try:
+        loop.run_forever()
+    finally:
+        ws_server.close()
+        # write the kb changes that are still pending
+        websocket_server.saver.close()
+
+
+def accept_forever(listener, channels):
+    # accepts the connections, waits for their request line without blocking
+    # the other ones, and passes each socket to its worker
+    selector = selectors.DefaultSelector()
+    listener.setblocking(False)
+    selector.register(listener, selectors.EVENT_READ)
+    deadlines = {}
+    # the connections whose request line is not complete, they are checked
+    # again later: the data is only peeked, so they would be always readable
+    rechecks = {}
+    next_worker = 0
+    while True:
+        timeout = 1.0
+        if rechecks:
+            timeout = min(timeout, max(0.0, min(rechecks.values()) - time.monotonic()))
+        for key, _ in selector.select(timeout=timeout):
+            if key.fileobj is listener:
+                try:
+                    connection, _ = listener.accept()
+                except BlockingIOError:
+                    continue
+                selector.register(connection, selectors.EVENT_READ)
+                deadlines[connection] = time.monotonic() + HANDSHAKE_TIMEOUT
+                continue
+
+            connection = key.fileobj
+            selector.unregister(connection)
+            try:
+                data = connection.recv(MAX_REQUEST_LINE, socket.MSG_PEEK)
+            except OSError:
+                data = b""
+            uid = read_uid(data) if data else None
+            if uid is False:
+                rechecks[connection] = time.monotonic() + RECHECK_INTERVAL
+                continue
+            del deadlines[connection]
+            if not data:
+                connection.close()
+                continue
+            if uid is None:
+                # the requests without uid do not use any session
+                worker = next_worker
+                next_worker = (next_worker + 1) % len(channels)
+            else:
+                worker = worker_of(uid, len(channels))
+            socket.send_fds(channels[worker], [b"c"], [connection.fileno()])
+            connection.close()
+
+        now = time.monotonic()
+        for connection in [c for c, recheck in rechecks.items() if recheck <= now]:
+            del rechecks[connection]
+            selector.register(connection, selectors.EVENT_READ)
+        for connection in [c for c, deadline in deadlines.items() if deadline < now]:
+            if connection in rechecks:
+                del rechecks[connection]
+            else:
+                selector.unregister(connection)
+            del deadlines[connection]
+            connection.close()
+
+
+if __name__ == '__main__':
+    context = multiprocessing.get_context("fork")
+    channels = []
+    workers = []
+    for index in range(WORKERS):
+        # SOCK_SEQPACKET keeps each socket in its own message
+        front, back = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        process = context.Process(target=run_worker, args=(index, back), daemon=True)
+        process.start()
+        back.close()
+        channels.append(front)
+        workers.append(process)
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("", PORT))
+    listener.listen(1024)
+    print(f"listening on {PORT} with {WORKERS} workers")
+    signal.signal(signal.SIGTERM, lambda *_: exit(0))
+    try:
+        accept_forever(listener, channels)
+    finally:
+        # the workers stop when their channel is closed
+        for channel in channels:
+            channel.close()
+        for process in workers:
+            process.join(timeout=10)
@@ -30,10 +30,56 @@ async def hello(websocket, path):
     # altrimenti chiamo handle data input
     # salvo il risultato e lo invio alla socket
 
-my_framework = dict()
+my_framework = create_session_store()
 
 connected = set()
 
+# number of open connections for each (uid, interaction), these sessions
+# are never removed by the reaper
+active_sessions = dict()
+
+# runs the turns of each session in order, also when more connections use
+# the same session, while the turns of different sessions run concurrently
+turns = SerialExecutor()
+
+# the turns of a connection that can wait to be handled before its next
+# message is read
+MAX_PIPELINE = 8
+
+# seconds between two runs of the reaper, and seconds after which an unused
+# session is removed (if its process is completed or not)
+REAP_INTERVAL = float(os.environ.get("MMCC_REAP_INTERVAL", 60))
+IDLE_TTL = float(os.environ.get("MMCC_IDLE_TTL", 24 * 60 * 60))
+COMPLETED_TTL = float(os.environ.get("MMCC_COMPLETED_TTL", 10 * 60))
+PORT = int(os.environ.get("MMCC_PORT", 8765))
+
+
+async def reaper():
+    # periodically remove the sessions that are not used anymore, the store
+    # works on the disk so it runs in a thread to not block the event loop
+    loop = asyncio.get_event_loop()
+    while True:
+        await asyncio.sleep(REAP_INTERVAL)
+        reclaimed = await loop.run_in_executor(
+            None, my_framework.reap, IDLE_TTL, COMPLETED_TTL, set(active_sessions))
+        if reclaimed:
+            print(f"reaped {reclaimed} sessions: {my_framework.stats()}")
+
+
+async def handle_turn(websocket, key, message):
+    # the turns of a session run one at a time, in order, see turns
+    print(message)
+    print()  # for better visual distinction between messages
+    recv = json.loads(message)
+    # the session is not moved to the disk while its turn is running, the
+    # files of the sessions are read and written in a thread
+    async with my_framework.using_async(key) as framework:
+        if recv['type'] == 'utterance':
+            send = await framework.handle_text_input_async(recv['utterance'])
+        else:
+            send = await framework.handle_data_input_async(recv['payload'])
+    await websocket.send(json.dumps(send))
+
 
 async def handler(websocket: websockets.WebSocketServerProtocol, path):
     # Register
@@ -69,38 +115,44 @@ async def handler(websocket: websockets.WebSocketServerProtocol, path):
         print(error)
         await websocket.send(json.dumps(error))
         return
-    elif uid not in my_framework:
-        my_framework[uid] = dict()
 
     if i == 'None' or i is None:
         # this is when the client starts the interaction
         i = ws_key
         # create framework
-        my_framework[uid][i] = create_framework()
+        await my_framework.put_async((uid, i), create_framework())
         # send the interaction id (the websocket key) to client
         await websocket.send(i)
         # init framework
-        welcome_message = welcome_message_framework(my_framework[uid][i])
+        async with my_framework.using_async((uid, i)) as framework:
+            welcome_message = welcome_message_framework(framework)
         await websocket.send(json.dumps(welcome_message))
-    print(my_framework)
+    print(my_framework.stats())
+    key = (uid, i)
+    active_sessions[key] = active_sessions.get(key, 0) + 1
     try:
-        async for message in websocket:
-            print(message)
-            print()  # for better visual distinction between messages
-            recv = json.loads(message)
-            if recv['type'] == 'utterance':
-                send = my_framework[uid][i].handle_text_input(recv['utterance'])
-                await websocket.send(json.dumps(send))
-            else:
-                send = my_framework[uid][i].handle_data_input(recv['payload'])
-                await websocket.send(json.dumps(send))
+        # the next message is read while the previous ones are handled, a turn
+        # that fails closes the connection without waiting for other messages
+        await turns.pipeline(key, websocket, handle_turn, websocket, key, max_pending=MAX_PIPELINE)
     finally:
         connected.remove(websocket)
+        active_sessions[key] -= 1
+        if active_sessions[key] == 0:
+            del active_sessions[key]
+            # nobody can continue a completed interaction, remove it now
+            loop = asyncio.get_event_loop()
+            if await loop.run_in_executor(None, my_framework.release, key):
+                print(f"released session {key}")
 
 
 if __name__ == '__main__':
     # start_server = websockets.serve(hello, "localhost", 8765)
-    start_server = websockets.serve(handler, "", 8765)
+    start_server = websockets.serve(handler, "", PORT)
 
     asyncio.get_event_loop().run_until_complete(start_server)
-    asyncio.get_event_loop().run_forever()
+    asyncio.get_event_loop().create_task(reaper())
+    try:
+        asyncio.get_event_loop().run_forever()
+    finally:
+        # write the kb changes that are still pending
+        saver.close()
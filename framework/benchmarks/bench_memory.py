@@ -0,0 +1,80 @@
+""" Measures the memory used by live Framework sessions and the memory allocated by each handle_data_input call.
+
+Run from the framework folder with: `python -m benchmarks.bench_memory`.
+The sessions share the same Process and SharedKb, as the ones created by Framework.from_file, so the reported memory is
+the one needed by each session on top of the shared data.
+"""
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+
+from mmcc_framework import Activity, ActivityType, Framework, NoNluAdapter, Process, Response, SharedKb
+
+
+def callback_getter(_):
+    return lambda data, kb, ctx: Response(kb, ctx, True, choice=data.get("choice"), payload={"ok": True})
+
+
+def resident_bytes() -> int:
+    """ Returns the resident memory of this process, or 0 if it can not be read. """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, nargs="+", default=[10_000, 100_000],
+                        help="the numbers of live sessions to measure")
+    parser.add_argument("--calls", type=int, default=10_000, help="the number of calls used to measure a turn")
+    args = parser.parse_args()
+
+    process = Process([Activity("start", "gateway", ActivityType.START),
+                       Activity("gateway", "end", ActivityType.PARALLEL, ["A", "B"]),
+                       Activity("A", None, ActivityType.TASK),
+                       Activity("B", None, ActivityType.TASK),
+                       Activity("end", None, ActivityType.END)], "start")
+    kb = SharedKb({"items": [f"item {i}" for i in range(10_000)], "gateway": "Choose A or B"})
+    nlu = NoNluAdapter([])
+
+    def create() -> Framework:
+        return Framework(process, kb.view(), {}, callback_getter, nlu, lambda k: None)
+
+    create()  # Run the callback check once, as it happens for the first session.
+    print(f"{'sessions':>9} {'traced (MB)':>12} {'resident (MB)':>14} {'bytes/session':>14}")
+    for count in args.sessions:
+        gc.collect()
+        tracemalloc.start()
+        before = resident_bytes()
+        sessions = [create() for _ in range(count)]
+        for session in sessions:
+            session.handle_data_input({})
+        traced = tracemalloc.get_traced_memory()[0]
+        resident = resident_bytes() - before
+        tracemalloc.stop()
+        print(f"{count:>9} {traced / 2 ** 20:>12.1f} {resident / 2 ** 20:>14.1f} {traced / count:>14.0f}")
+        del sessions
+
+    # Alternate between the gateway and a task, so that each call moves to another activity.
+    session = create()
+    session.handle_data_input({})
+    inputs = [{"choice": "A"}, {}] * (args.calls // 2)
+    gc.collect()
+    gc.disable()
+    tracemalloc.start()
+    blocks = sys.getallocatedblocks()
+    results = [session.handle_data_input(data) for data in inputs]
+    retained_blocks = sys.getallocatedblocks() - blocks
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    gc.enable()
+    print(f"handle_data_input: {retained_blocks / len(results):.1f} blocks and {retained / len(results):.0f} bytes "
+          f"retained per call (the returned dictionaries are kept), {peak / len(results):.0f} bytes peak per call")
+
+
+if __name__ == "__main__":
+    main()
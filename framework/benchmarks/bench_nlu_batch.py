@@ -0,0 +1,81 @@
+""" Measures the throughput of NluAdapter.parse_batch compared to calling parse for each utterance.
+
+Run from the framework folder with: `python -m benchmarks.bench_nlu_batch`.
+RasaNlu is measured against a local server that answers like rasa after --latency milliseconds, the utterances repeat
+like in a conversation log, so that CachingNluAdapter can be measured too.
+"""
+import argparse
+import json
+import random
+import socket
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+from mmcc_framework import CachingNluAdapter, NoNluAdapter, RasaNlu
+
+
+class RasaStub(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+
+    def setup(self) -> None:
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_POST(self):
+        text = json.loads(self.rfile.read(int(self.headers["Content-Length"])))["text"]
+        time.sleep(self.latency)
+        body = json.dumps({"intent": {"name": text.split()[0]}, "entities": []}).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+def measure(parse, utterances: list) -> float:
+    """ Returns the utterances parsed per second. """
+    begin = time.perf_counter()
+    parse(utterances)
+    return len(utterances) / (time.perf_counter() - begin)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--utterances", type=int, default=2000, help="the number of utterances parsed")
+    parser.add_argument("--distinct", type=int, default=300, help="the number of different utterances")
+    parser.add_argument("--latency", type=float, default=2.0, help="the milliseconds rasa takes for each utterance")
+    parser.add_argument("--connections", type=int, default=8, help="the max_connections of RasaNlu")
+    args = parser.parse_args()
+
+    random.seed(0)
+    utterances = [f"intent{random.randrange(args.distinct)} some words" for _ in range(args.utterances)]
+    RasaStub.latency = args.latency / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RasaStub)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    rasa = RasaNlu("127.0.0.1", server.server_address[1], max_connections=args.connections)
+    no_nlu = NoNluAdapter(["name", "occupation", "age"])
+
+    results = [
+        ("RasaNlu", "parse", measure(lambda u: [rasa.parse(utterance) for utterance in u], utterances)),
+        ("RasaNlu", "parse_batch", measure(rasa.parse_batch, utterances)),
+        ("CachingNluAdapter", "parse_batch", measure(CachingNluAdapter(rasa).parse_batch, utterances)),
+        ("NoNluAdapter", "parse", measure(lambda u: [no_nlu.parse(utterance) for utterance in u], utterances * 100)),
+        ("NoNluAdapter", "parse_batch", measure(no_nlu.parse_batch, utterances * 100)),
+    ]
+    rasa.close()
+    server.shutdown()
+
+    print(f"{args.utterances} utterances ({args.distinct} different), rasa latency {args.latency} ms, "
+          f"{args.connections} connections")
+    print(f"{'adapter':>18} {'method':>12} {'utterances/s':>14}")
+    for adapter, method, throughput in results:
+        print(f"{adapter:>18} {method:>12} {throughput:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+""" Compares the accuracy and the throughput of the local nlu adapters on the rasa test stories.
+
+Run from the framework folder with: `python -m benchmarks.bench_nlu_classifier`, this requires NumPy and PyYAML.
+The adapters are trained with the rasa nlu file, and evaluated on the user messages of the test stories. Pass --rasa to
+include a running rasa server, for example `--rasa localhost:5005`.
+"""
+import argparse
+import os
+import time
+
+import yaml
+
+from mmcc_framework import RasaNlu, RuleNlu
+from mmcc_framework.tfidf_nlu import TfidfNlu
+
+DEMO = os.path.join(os.path.dirname(__file__), "..", "..", "demo", "rasa")
+
+
+def read_stories(path: str) -> list:
+    """ Returns the pairs of user message and expected intent of the test stories. """
+    with open(path, encoding="utf-8") as file:
+        stories = yaml.safe_load(file)["stories"]
+    return [(step["user"].strip(), step["intent"])
+            for story in stories for step in story["steps"] if "user" in step and "intent" in step]
+
+
+def evaluate(name: str, adapter, pairs: list, repeat: int) -> None:
+    utterances = [utterance for utterance, _ in pairs]
+    results = [adapter.parse(utterance)["intent"] for utterance in utterances]
+    correct = sum(result == intent for result, (_, intent) in zip(results, pairs))
+
+    begin = time.perf_counter()
+    for _ in range(repeat):
+        for utterance in utterances:
+            adapter.parse(utterance)
+    single = repeat * len(utterances) / (time.perf_counter() - begin)
+    begin = time.perf_counter()
+    for _ in range(repeat):
+        adapter.parse_batch(utterances)
+    batch = repeat * len(utterances) / (time.perf_counter() - begin)
+    print(f"{name:>16} {correct:>4}/{len(pairs):<4} {single:>14.0f} {batch:>14.0f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--nlu", default=os.path.join(DEMO, "data", "nlu.yml"), help="the rasa nlu training file")
+    parser.add_argument("--stories", default=os.path.join(DEMO, "tests", "test_stories.yml"),
+                        help="the rasa test stories")
+    parser.add_argument("--model", help="a model saved with TfidfNlu.save, used instead of training one")
+    parser.add_argument("--rasa", help="the host:port of a running rasa server to compare")
+    parser.add_argument("--repeat", type=int, default=200, help="the number of times the stories are parsed")
+    args = parser.parse_args()
+
+    pairs = read_stories(args.stories)
+    begin = time.perf_counter()
+    tfidf = TfidfNlu.load(args.model) if args.model else TfidfNlu.train_rasa_file(args.nlu)
+    print(f"TfidfNlu ready in {(time.perf_counter() - begin) * 1000:.1f} ms, "
+          f"{len(pairs)} test messages ({len({intent for _, intent in pairs})} intents)")
+    print(f"{'adapter':>16} {'correct':>9} {'parse (1/s)':>14} {'batch (1/s)':>14}")
+    evaluate("TfidfNlu", tfidf, pairs, args.repeat)
+    evaluate("RuleNlu", RuleNlu.from_rasa_file(args.nlu), pairs, args.repeat)
+    evaluate("RuleNlu+TfidfNlu", RuleNlu.from_rasa_file(args.nlu, fallback=tfidf), pairs, args.repeat)
+    if args.rasa:
+        host, _, port = args.rasa.partition(":")
+        rasa = RasaNlu(host, int(port or 5005))
+        evaluate("RasaNlu", rasa, pairs, 1)
+        rasa.close()
+
+
+if __name__ == "__main__":
+    main()
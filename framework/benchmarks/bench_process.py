@@ -0,0 +1,62 @@
+""" Measures the time needed to create, check and analyze synthetic processes with many activities.
+
+Run from the framework folder with: `python -m benchmarks.bench_process`.
+The time per activity should stay roughly constant as the size of the process grows.
+"""
+import argparse
+import time
+from typing import Any, Dict, List
+
+from mmcc_framework import Process
+
+
+def synthetic_process(gateways: int, branches: int = 4, tasks: int = 2) -> Dict[str, Any]:
+    """ Returns the dictionary of a process that is a chain of gateways, each with some branches of tasks.
+
+    :param gateways: the number of gateways in the chain
+    :param branches: the number of choices of each gateway
+    :param tasks: the number of tasks in each branch
+    :return: a dictionary that can be passed to Process.from_dict
+    """
+    kinds = ["parallel", "xor", "or"]
+    activities: List[Dict[str, Any]] = [{"my_id": "start", "next_id": "g0", "my_type": "start"}]
+    for g in range(gateways):
+        next_id = f"g{g + 1}" if g + 1 < gateways else "end"
+        activities.append({"my_id": f"g{g}", "next_id": next_id, "my_type": kinds[g % len(kinds)],
+                           "choices": [f"g{g}b{b}t0" for b in range(branches)]})
+        for b in range(branches):
+            for t in range(tasks):
+                activities.append({"my_id": f"g{g}b{b}t{t}",
+                                   "next_id": f"g{g}b{b}t{t + 1}" if t + 1 < tasks else None,
+                                   "my_type": "task"})
+    activities.append({"my_id": "end", "next_id": None, "my_type": "end"})
+    return {"activities": activities, "first_activity_id": "start"}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 20_000, 50_000, 100_000],
+                        help="the approximate number of activities of the processes")
+    parser.add_argument("--repeat", type=int, default=3, help="how many times each measure is repeated")
+    args = parser.parse_args()
+
+    print(f"{'activities':>10} {'create (ms)':>12} {'analyze (ms)':>13} {'us/activity':>12}")
+    for size in args.sizes:
+        description = synthetic_process(max(1, size // 9))
+        count = len(description["activities"])
+
+        create = analyze = float("inf")
+        for _ in range(args.repeat):
+            begin = time.perf_counter()
+            process = Process.from_dict(description)
+            middle = time.perf_counter()
+            report = process.analyze_reachability()
+            finish = time.perf_counter()
+            assert report.is_clean()
+            create = min(create, middle - begin)
+            analyze = min(analyze, finish - middle)
+        print(f"{count:>10} {create * 1e3:>12.1f} {analyze * 1e3:>13.1f} {(create + analyze) / count * 1e6:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
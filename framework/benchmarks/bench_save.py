@@ -0,0 +1,68 @@
+""" Measures the latency of the turn that reaches an END activity, with and without a WriteBehindSaver.
+
+Run from the framework folder with: `python -m benchmarks.bench_save`.
+Without the saver the turn includes writing the whole kb to its file, with the saver it only commits the changes.
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from mmcc_framework import Framework, NoNluAdapter, Response, SharedKb, WriteBehindSaver, FileRegistry
+
+
+def callback_getter(_):
+    def callback(data, kb, ctx):
+        kb["last_address"] = data["address"]
+        return Response(kb, ctx, True)
+
+    return callback
+
+
+def measure(process_path: str, kb_path: str, turns: int, saver: WriteBehindSaver = None) -> list:
+    """ Returns the latency in seconds of each turn that reaches the END activity. """
+    registry = FileRegistry(SharedKb)
+    latencies = []
+    for i in range(turns):
+        framework = Framework.from_file(process_path, kb_path, {}, callback_getter, NoNluAdapter([]),
+                                        kb_registry=registry, saver=saver)
+        begin = time.perf_counter()
+        framework.handle_data_input({"address": f"Street {i}"})
+        latencies.append(time.perf_counter() - begin)
+    if saver is not None:
+        saver.flush()
+    return latencies
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=100_000, help="the number of items in the kb catalog")
+    parser.add_argument("--turns", type=int, default=200, help="the number of processes completed")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        process_path = os.path.join(folder, "my_process.json")
+        kb_path = os.path.join(folder, "my_kb.json")
+        with open(process_path, "w") as file:
+            json.dump({"activities": [{"my_id": "start", "next_id": "end", "my_type": "start"},
+                                      {"my_id": "end", "next_id": None, "my_type": "end"}],
+                       "first_activity_id": "start"}, file)
+        with open(kb_path, "w") as file:
+            json.dump({"items": [f"item {i}" for i in range(args.items)], "last_address": ""}, file)
+
+        saver = WriteBehindSaver()
+        results = {"synchronous": measure(process_path, kb_path, args.turns),
+                   "write-behind": measure(process_path, kb_path, args.turns, saver)}
+        print(f"kb with {args.items} items, {args.turns} completed processes")
+        print(f"{'mode':>12} {'mean (ms)':>10} {'p99 (ms)':>10} {'writes':>7}")
+        for mode, latencies in results.items():
+            p99 = sorted(latencies)[int(len(latencies) * 0.99) - 1]
+            writes = saver.written if mode == "write-behind" else len(latencies)
+            print(f"{mode:>12} {statistics.mean(latencies) * 1e3:>10.3f} {p99 * 1e3:>10.3f} {writes:>7}")
+        saver.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+""" Measures the sessions created per second by many threads, with one lock for each kb file or one lock for all.
+
+Run from the framework folder with: `python -m benchmarks.bench_session_creation`.
+Each session is created with Framework.from_file and immediately completes its process, which writes its kb file. With
+--files 1 all the sessions share a kb file, otherwise each user has its own kb file and the users are spread over the
+threads. With a single lock the writes of different files wait for each other, with a lock for each file (like FILE_LOCKS)
+they do not; the contention is reported by KeyedLocks.stats(). The writes run in parallel only with more cores.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from mmcc_framework import FileRegistry, Framework, KeyedLocks, NoNluAdapter, Response, SharedKb
+
+
+def callback_getter(_):
+    def callback(data, kb, ctx):
+        kb["last_session"] = data["session"]
+        return Response(kb, ctx, True)
+
+    return callback
+
+
+def measure(process_path: str, kb_paths: list, threads: int, sessions: int, single: bool) -> tuple:
+    """ Returns the sessions per second, and the stats of the locks used. """
+    registry = FileRegistry(SharedKb)
+    locks = KeyedLocks()
+
+    def create(number):
+        kb_path = kb_paths[number % len(kb_paths)]
+        framework = Framework.from_file(process_path, kb_path, {}, callback_getter, NoNluAdapter([]),
+                                        locks.lock("all" if single else kb_path), kb_registry=registry)
+        framework.handle_data_input({"session": number})
+
+    begin = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(create, range(sessions)))
+    return sessions / (time.perf_counter() - begin), locks.stats()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threads", type=int, default=16, help="the number of threads that create the sessions")
+    parser.add_argument("--sessions", type=int, default=2000, help="the number of sessions created")
+    parser.add_argument("--files", type=int, nargs="+", default=[1, 16, 256], help="the numbers of kb files")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        process_path = os.path.join(folder, "my_process.json")
+        with open(process_path, "w") as file:
+            json.dump({"activities": [{"my_id": "start", "next_id": "end", "my_type": "start"},
+                                      {"my_id": "end", "next_id": None, "my_type": "end"}],
+                       "first_activity_id": "start"}, file)
+        print(f"{args.sessions} sessions created by {args.threads} threads")
+        print(f"{'files':>6} {'locks':>9} {'sessions/s':>11} {'contended':>10} {'wait (s)':>9}")
+        for files in args.files:
+            kb_paths = []
+            for number in range(files):
+                kb_paths.append(os.path.join(folder, f"kb_{files}_{number}.json"))
+                with open(kb_paths[-1], "w") as file:
+                    json.dump({"last_session": None, "items": [f"item {i}" for i in range(100)]}, file)
+            for single in [True, False]:
+                rate, stats = measure(process_path, kb_paths, args.threads, args.sessions, single)
+                print(f"{files:>6} {'single' if single else 'per file':>9} {rate:>11.0f} {stats['contended']:>10} "
+                      f"{stats['wait_time']:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,11 @@
 from mmcc_framework.framework import CTX_COMPLETED, Framework, Process, Response, Activity, ActivityType
+from mmcc_framework.framework import ReachabilityReport, PROCESS_REGISTRY, KB_REGISTRY, FILE_LOCKS
 from mmcc_framework.framework import CallbackException, DescriptionException
-from mmcc_framework.nlu_adapters import NoNluAdapter, RasaNlu
+from mmcc_framework.entities import FuzzyEntityMatcher, KbEntityExtractor
+from mmcc_framework.kb import SharedKb, KbView
+from mmcc_framework.locks import KeyedLocks, SerialExecutor
+from mmcc_framework.nlu_adapters import NoNluAdapter, RasaNlu, CachingNluAdapter, NluChain, NluTier
+from mmcc_framework.persistence import KbJournal, WriteBehindSaver
+from mmcc_framework.registry import FileRegistry
+from mmcc_framework.rule_nlu import RuleNlu
+from mmcc_framework.sessions import ResponseLog, SessionStore
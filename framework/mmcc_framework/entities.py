@@ -0,0 +1,441 @@
+from collections import deque
+from threading import Lock
+from typing import Any, Callable, Dict, Hashable, List, Mapping, NamedTuple, Tuple, Union
+
+from mmcc_framework.nlu_adapters import NluAdapter
+
+KbSource = Union[Mapping[str, Any], Callable[[], Mapping[str, Any]]]
+
+
+class Mention(NamedTuple):
+    """ A value of the kb found in an utterance.
+
+    :ivar start: the position of the first character of the mention in the utterance
+    :ivar end: the position after the last character of the mention in the utterance
+    :ivar entity: the name of the entity
+    :ivar value: the value as it is in the kb
+    """
+    start: int
+    end: int
+    entity: str
+    value: Any
+
+
+class AhoCorasick(object):
+    """ An Aho-Corasick automaton that finds all the occurrences of many patterns in one pass over a text.
+
+    :ivar _goto: the transitions of each state, the state 0 is the root
+    :ivar _fail: the state of the longest proper suffix of each state that is also a state
+    :ivar _output: the patterns that end in each state, including the ones of its suffixes
+    :ivar _patterns: the text and the payload of each pattern
+    """
+
+    def __init__(self, patterns: List[Tuple[str, Any]]) -> None:
+        """ Builds the automaton, the time is linear in the total length of the patterns.
+
+        :param patterns: the pairs of text and payload to find, the empty texts are ignored
+        """
+        self._patterns = [(text, payload) for text, payload in patterns if text]
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [()]
+        for index, (text, _) in enumerate(self._patterns):
+            state = 0
+            for char in text:
+                following = self._goto[state].get(char)
+                if following is None:
+                    following = len(self._goto)
+                    self._goto[state][char] = following
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(())
+                state = following
+            self._output[state] += (index,)
+
+        # The failure links are computed breadth first, so the ones of the shorter prefixes are already known.
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, following in self._goto[state].items():
+                queue.append(following)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[following] = target
+                self._output[following] += self._output[self._fail[following]]
+
+    def __len__(self) -> int:
+        return len(self._patterns)
+
+    def find_all(self, text: str) -> List[Tuple[int, int, Any]]:
+        """ Returns all the occurrences of the patterns in the text, also the overlapping ones.
+
+        :param text: the text where the patterns are searched
+        :return: the start, the end and the payload of each occurrence, ordered by end
+        """
+        goto, fail, output, patterns = self._goto, self._fail, self._output, self._patterns
+        found = []
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for index in output[state]:
+                pattern, payload = patterns[index]
+                found.append((position + 1 - len(pattern), position + 1, payload))
+        return found
+
+
+def edit_distance(first: str, second: str) -> int:
+    """ Returns the Levenshtein distance of two strings: the number of insertions, deletions and substitutions.
+
+    The columns of the dynamic programming matrix are computed as bit vectors (Myers' algorithm), so the time is
+    linear in the length of the longest string when the shortest one has few characters.
+    """
+    if len(first) < len(second):
+        first, second = second, first
+    size = len(second)
+    if size == 0:
+        return len(first)
+    masks = {}
+    for position, char in enumerate(second):
+        masks[char] = masks.get(char, 0) | 1 << position
+    full = (1 << size) - 1
+    last = 1 << (size - 1)
+    # The bits of positive and negative are the vertical differences of +1 and -1 in the current column.
+    positive, negative, distance = full, 0, size
+    for char in first:
+        equal = masks.get(char, 0)
+        vertical = equal | negative
+        horizontal = (((equal & positive) + positive) ^ positive) | equal
+        up = negative | ~(horizontal | positive)
+        down = positive & horizontal
+        if up & last:
+            distance += 1
+        elif down & last:
+            distance -= 1
+        up = (up << 1) | 1
+        down <<= 1
+        positive = (down | ~(vertical | up)) & full
+        negative = up & vertical & full
+    return distance
+
+
+class BkTree(object):
+    """ A Burkhard-Keller tree, that finds the strings within an edit distance without comparing all of them.
+
+    Each child of a node is at a different distance from it, and the triangle inequality allows to visit only the
+    children whose distance is close to the one of the searched string.
+
+    :ivar _root: the root node as a list [word, payloads, children by distance], or None if the tree is empty
+    :ivar _size: the number of different words in the tree
+    """
+
+    def __init__(self, words: List[Tuple[str, Any]] = ()) -> None:
+        """ Builds the tree with the provided words.
+
+        :param words: the pairs of word and payload, a word can have more than one payload
+        """
+        self._root = None
+        self._size = 0
+        for word, payload in words:
+            self.add(word, payload)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, word: str, payload: Any) -> None:
+        """ Adds a word to the tree, with its payload. """
+        if self._root is None:
+            self._root = [word, [payload], {}]
+            self._size = 1
+            return
+        node = self._root
+        while True:
+            distance = edit_distance(word, node[0])
+            if distance == 0:
+                node[1].append(payload)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [word, [payload], {}]
+                self._size += 1
+                return
+            node = child
+
+    def search(self, word: str, max_distance: int) -> List[Tuple[int, str, List[Any]]]:
+        """ Returns the words within max_distance from the provided one.
+
+        :param word: the word to search
+        :param max_distance: the maximum edit distance of the results
+        :return: the distance, the word and the payloads of each result, from the closest
+        """
+        found = []
+        pending = [self._root] if self._root is not None else []
+        while pending:
+            node = pending.pop()
+            distance = edit_distance(word, node[0])
+            if distance <= max_distance:
+                found.append((distance, node[0], node[1]))
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    pending.append(child)
+        found.sort(key=lambda result: result[:2])
+        return found
+
+
+class KbEntityExtractor(NluAdapter):
+    """ This adapter decorates another adapter, and adds to its results the values of the kb found in the utterance.
+
+    The lists of values are read from the kb, for example the keys "items", "colors" and "sizes", and each list is
+    associated with the name of an entity, for example "preference". The values are found ignoring the case, and only
+    as whole words; when they overlap, the longest one that starts first is used. If the result of the adapter does not
+    contain an entity, the first value found for that entity is added, exactly as it is in the kb.
+    The values are indexed in an Aho-Corasick automaton, so finding them takes one pass over the utterance however long
+    the lists are. The automaton is built again only when the kb changes one of the lists: the lists must be replaced
+    and not modified, as explained in SharedKb.
+
+    Example:
+        `my_adapter = KbEntityExtractor(RasaNlu(), lambda: KB_REGISTRY.get("my_kb.json"),
+        {"items": "preference", "colors": "preference", "sizes": "preference"})`
+
+    :ivar adapter: the adapter that parses the utterances
+    :ivar keys: the name of the entity of each list in the kb
+    :ivar _index: the automaton of the values in the kb
+    """
+
+    def __init__(self, adapter: NluAdapter, kb: KbSource, keys: Dict[str, str]) -> None:
+        """ Initializes this adapter, the automaton is built with the first utterance.
+
+        :param adapter: the adapter that parses the utterances
+        :param kb: the kb with the lists of values, or a function that returns it, for example a SharedKb or a dict
+        :param keys: the name of the entity of each list in the kb
+        """
+        self.adapter = adapter
+        self.keys = dict(keys)
+        self._index = _KbIndex(kb, self.keys, lambda values: AhoCorasick([(str(value).lower(), (entity, value))
+                                                                            for entity, value in values]))
+
+    def parse(self, utterance: str) -> Dict[str, Any]:
+        """ Parses the utterance with adapter, and adds the entities found in the kb that are missing.
+
+        :param utterance: the text input from the user
+        :return: the result of adapter, with the entities that are missing
+        """
+        return self._add_mentions(utterance, self.adapter.parse(utterance))
+
+    async def parse_async(self, utterance: str) -> Dict[str, Any]:
+        """ Like parse, awaiting the parse_async of adapter. """
+        return self._add_mentions(utterance, await self.adapter.parse_async(utterance))
+
+    def parse_batch(self, utterances: List[str]) -> List[Dict[str, Any]]:
+        """ Like parse for each utterance, using the parse_batch of adapter. """
+        return [self._add_mentions(utterance, result)
+                for utterance, result in zip(utterances, self.adapter.parse_batch(utterances))]
+
+    def find(self, utterance: str) -> List[Mention]:
+        """ Returns the values of the kb found in the utterance, the ones that overlap a longer one are excluded.
+
+        :param utterance: the text where the values are searched
+        :return: the mentions ordered by position
+        """
+        text = utterance.lower()
+        if len(text) != len(utterance):
+            # Some characters change length in lower case, the positions would not match.
+            text = "".join(char if len(char.lower()) != 1 else char.lower() for char in utterance)
+        candidates = [(start, end, payload) for start, end, payload in self._automaton().find_all(text)
+                      if _is_boundary(text, start - 1) and _is_boundary(text, end)]
+        # The leftmost longest candidates are kept.
+        candidates.sort(key=lambda candidate: (candidate[0], -candidate[1]))
+        mentions = []
+        covered = 0
+        for start, end, (entity, value) in candidates:
+            if start >= covered:
+                mentions.append(Mention(start, end, entity, value))
+                covered = end
+        return mentions
+
+    def _add_mentions(self, utterance, result):
+        missing = set(self.keys.values()).difference(result)
+        if not missing:
+            return result
+        result = dict(result)
+        for mention in self.find(utterance):
+            if mention.entity in missing:
+                result[mention.entity] = mention.value
+                missing.discard(mention.entity)
+        return result
+
+    def _automaton(self) -> AhoCorasick:
+        return self._index.get()
+
+
+class _KbIndex(object):
+    """ An index of the lists of values of a kb, that is built again only when the kb replaces one of the lists.
+
+    :ivar _kb: the kb, or a function that returns it
+    :ivar _keys: the name of the entity of each list in the kb
+    :ivar _build: the function that builds the index from the pairs of entity and value
+    :ivar _index: the last index built
+    :ivar _indexed: the kb, its version and the lists used to build the last index
+    :ivar _lock: the lock used to build the index
+    """
+
+    def __init__(self, kb: KbSource, keys: Mapping[str, str], build: Callable[[List[Tuple[str, Any]]], Any]) -> None:
+        self._kb = kb
+        self._keys = keys
+        self._build = build
+        self._index = None
+        self._indexed = None
+        self._lock = Lock()
+
+    def get(self) -> Any:
+        """ Returns the index of the current values of the kb. """
+        kb = self._kb() if callable(self._kb) else self._kb
+        stamp = _stamp(kb, self._keys)
+        with self._lock:
+            if self._indexed is None or not _same_stamp(self._indexed, stamp):
+                if self._indexed is None or not _same_lists(self._indexed, stamp):
+                    self._index = self._build([(entity, value) for key, entity in self._keys.items()
+                                               for value in _values(kb, key)])
+                self._indexed = stamp
+            return self._index
+
+
+def _is_boundary(text: str, position: int) -> bool:
+    # A mention must not be preceded or followed by a letter, a digit or an apostrophe.
+    return position < 0 or position >= len(text) or not (text[position].isalnum() or text[position] == "'")
+
+
+def _stamp(kb: Mapping[str, Any], keys: Mapping[str, Hashable]) -> Tuple[Any, Any, Tuple]:
+    # The kb, its version if it has one, and the lists of values.
+    return kb, getattr(kb, "version", None), tuple(_values(kb, key) for key in keys)
+
+
+def _values(kb: Mapping[str, Any], key: str) -> Any:
+    # The list of values of the key, also for a SharedKb that is not a Mapping.
+    return kb[key] if key in kb else ()
+
+
+def _same_stamp(old, new) -> bool:
+    # The same version of the same kb.
+    return old[0] is new[0] and old[1] is not None and old[1] == new[1]
+
+
+def _same_lists(old, new) -> bool:
+    # The lists of values were not replaced, even if the kb changed.
+    return len(old[2]) == len(new[2]) and all(first is second for first, second in zip(old[2], new[2]))
+
+
+class FuzzyEntityMatcher(NluAdapter):
+    """ This adapter decorates another adapter, and replaces the misspelled entities in its results with the closest
+    value of the kb.
+
+    The lists of values are read from the kb and associated with the name of an entity, like in KbEntityExtractor. When
+    the result of the adapter contains one of the entities and its value is not in the lists, it is replaced with the
+    only value of the lists within max_distance edits, for example "swetshirt" becomes "sweatshirt". The values that
+    are shorter than min_length are not replaced, and at most half of the characters of a value can be edited. If two
+    values are equally close, the value is not replaced. The case is ignored, the values of the kb are returned as they
+    are in the kb.
+    The values of each entity are indexed in a BkTree, that is built again only when the kb replaces one of the lists.
+
+    Example:
+        `my_adapter = FuzzyEntityMatcher(RasaNlu(), lambda: KB_REGISTRY.get("my_kb.json"),
+        {"items": "preference", "colors": "preference", "sizes": "preference"})`
+
+    :ivar adapter: the adapter that parses the utterances
+    :ivar keys: the name of the entity of each list in the kb
+    :ivar max_distance: the maximum number of edits of a replaced value
+    :ivar min_length: the minimum length of a replaced value
+    :ivar corrected: the number of values replaced
+    :ivar _index: for each entity, the values by their lower case and the BkTree of the values
+    """
+
+    def __init__(self, adapter: NluAdapter, kb: KbSource, keys: Dict[str, str], max_distance: int = 2,
+                 min_length: int = 4) -> None:
+        """ Initializes this adapter, the trees are built with the first utterance.
+
+        :param adapter: the adapter that parses the utterances
+        :param kb: the kb with the lists of values, or a function that returns it, for example a SharedKb or a dict
+        :param keys: the name of the entity of each list in the kb
+        :param max_distance: the maximum number of edits of a replaced value
+        :param min_length: the minimum length of a replaced value
+        """
+        self.adapter = adapter
+        self.keys = dict(keys)
+        self.max_distance = max_distance
+        self.min_length = min_length
+        self.corrected = 0
+        self._index = _KbIndex(kb, self.keys, _build_trees)
+
+    def parse(self, utterance: str) -> Dict[str, Any]:
+        """ Parses the utterance with adapter, and replaces the misspelled entities.
+
+        :param utterance: the text input from the user
+        :return: the result of adapter, with the misspelled entities replaced
+        """
+        return self.correct(self.adapter.parse(utterance))
+
+    async def parse_async(self, utterance: str) -> Dict[str, Any]:
+        """ Like parse, awaiting the parse_async of adapter. """
+        return self.correct(await self.adapter.parse_async(utterance))
+
+    def parse_batch(self, utterances: List[str]) -> List[Dict[str, Any]]:
+        """ Like parse for each utterance, using the parse_batch of adapter. """
+        return [self.correct(result) for result in self.adapter.parse_batch(utterances)]
+
+    def correct(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """ Returns a copy of the result of an adapter, with the misspelled entities replaced.
+
+        :param result: the result of an adapter
+        :return: the same result if nothing is replaced, otherwise a copy with the replaced values
+        """
+        index = None
+        corrected = result
+        for entity in set(self.keys.values()):
+            value = result.get(entity)
+            if not isinstance(value, str):
+                continue
+            if index is None:
+                index = self._index.get()
+            if entity not in index:
+                continue
+            replacement = self.closest(value, entity, index)
+            if replacement is not None and replacement != value:
+                if corrected is result:
+                    corrected = dict(result)
+                corrected[entity] = replacement
+                self.corrected += 1
+        return corrected
+
+    def closest(self, value: str, entity: str, index: Dict[str, Tuple[Dict[str, Any], BkTree]] = None) -> Any:
+        """ Returns the value of the kb that is the same or the only closest one to the provided one, or None.
+
+        :param value: the value to search
+        :param entity: the name of the entity of the value
+        :param index: the index of the kb to use, by default the one of the current kb
+        :return: the value as it is in the kb, or None if there is no close value, or more than one
+        """
+        exact, tree = (index or self._index.get()).get(entity, ({}, None))
+        key = value.lower()
+        if key in exact:
+            return exact[key]
+        if tree is None or len(key) < self.min_length:
+            return None
+        found = tree.search(key, min(self.max_distance, len(key) // 2))
+        if not found or (len(found) > 1 and found[0][0] == found[1][0]) or len(set(found[0][2])) > 1:
+            return None
+        return found[0][2][0]
+
+
+def _build_trees(values: List[Tuple[str, Any]]) -> Dict[str, Tuple[Dict[str, Any], BkTree]]:
+    # The values of each entity by their lower case, and their tree.
+    index = {}
+    for entity, value in values:
+        exact, tree = index.setdefault(entity, ({}, BkTree()))
+        key = str(value).lower()
+        if key not in exact:
+            exact[key] = value
+            tree.add(key, value)
+    return index
@@ -1,14 +1,34 @@
+import asyncio
+import copy
+import hashlib
+import inspect
 import json
-from collections import deque
+import os
+import struct
+import zlib
 from enum import Enum
 from threading import Lock
 from typing import Union, Optional, List, Dict, Any, Callable
+from weakref import WeakKeyDictionary, WeakSet
 
+from mmcc_framework.kb import KbView, SharedKb
+from mmcc_framework.locks import KeyedLocks
 from mmcc_framework.nlu_adapters import NluAdapter
+from mmcc_framework.persistence import KbJournal, WriteBehindSaver, atomic_write
+from mmcc_framework.registry import FileRegistry
 
 CTX_COMPLETED = "_done_"
 """ Context key whose value is a list of activity id for the pending gateways that allow skipping. """
 
+_SNAPSHOT_MAGIC = b"MMCC"
+""" The bytes at the beginning of each snapshot, see Framework.snapshot(). """
+
+_SNAPSHOT_VERSION = 1
+""" The version of the snapshot encoding produced by Framework.snapshot(). """
+
+_SNAPSHOT_HEADER = struct.Struct("!4sB32s")
+""" The header of a snapshot: magic bytes, version and digest of the process. """
+
 
 class Framework(object):
     """ A sort of state machine, takes a process description and handles inputs, keeping track of the current activity.
@@ -21,9 +41,14 @@ class Framework(object):
     :ivar _nlu: provides a translation from text to data, to handle in the same way text and data input (multimodal)
     :ivar _on_save: a function called when it is time to save the kb
     :ivar _stack: a pile of Activity id that is used to handle the gateways
-    :ivar _done: a list that is used to determine if a gateway is completed
+    :ivar _done: a dictionary with a bitmask for each gateway, of the choices taken (see Process.choice_bit)
+    :ivar _completed: the ids of the completed gateways, in order, published in the context as CTX_COMPLETED
+    :ivar _version: the number of inputs handled, see version
     """
 
+    __slots__ = ("_process", "_kb", "_ctx", "_current", "_callback_getter", "_nlu", "_on_save", "_stack", "_done",
+                 "_completed", "_version")
+
     def __init__(self,
                  process: Union["Process", Dict[str, Any], Callable[[], Union["Process", Dict[str, Any]]]],
                  kb: Union[Dict[str, Any], Callable[[], Dict[str, Any]]],
@@ -57,8 +82,10 @@ class Framework(object):
         self._callback_getter = callback_getter
         self._nlu = nlu
         self._on_save = on_save
-        self._stack = deque()
+        self._stack = []
         self._done = {}
+        self._completed = {}
+        self._version = 0
         self._check()
 
     @classmethod
@@ -69,38 +96,160 @@ class Framework(object):
                   callback_getter: Callable[
                       [str], Callable[[Dict[str, Any], Dict[str, Any], Dict[str, Any]], "Response"]],
                   nlu: NluAdapter,
-                  lock: Lock = Lock()) -> "Framework":
+                  lock: Lock = None,
+                  process_registry: "FileRegistry[Process]" = None,
+                  kb_registry: "FileRegistry[SharedKb]" = None,
+                  saver: WriteBehindSaver = None,
+                  journal: KbJournal = None) -> "Framework":
         """ Loads the configuration of a framework from the files provided.
 
         The process file must contain a Process description that will be handled by Process.fromDict().
+        The process is parsed only once and shared by all the instances that use the same file, see FileRegistry.
         The kb and context files must contain a dictionary, the context can also be provided directly.
-        The kb will be saved back to its file when the process is completed.
-        If the possibility exists that the files will be handled by more than one Framework instance at the time, it is
-        necessary to provide a unique lock shared by all the instances. This will allow the framework to correctly
-        handle the concurrency.
+        The kb is loaded only once in a SharedKb, and each instance receives a KbView of it: this way the instances read
+        the same values and keep a copy only of the values they write. The kb will be saved back to its file when the
+        process is completed.
+        The instances that save the same kb file hold the same lock while writing it: by default the lock of the path of
+        the file in FILE_LOCKS, so that the instances that use different files never wait for each other. A lock can be
+        provided to share it with other code that writes the file.
+        If a WriteBehindSaver is provided, the kb is written to its file in the background: completing a process only
+        commits the changes to the shared kb, and many completions that happen close in time cause a single write.
+        If a KbJournal is provided, the kb is taken from it and each completion only appends the changed keys to the
+        journal; in this case the kb parameter must be the path of the journal kb, and the lock and saver are not used.
 
         :param process: the path to a file containing the process description
         :param kb: the path to a file containing the kb
         :param initial_context: the context or the path to a file containing the context
         :param callback_getter: a function that returns the callback of an activity given its id
         :param nlu: provides a translation from text to data, to handle in the same way text and data input
-        :param lock: a unique lock shared by all the instances that can use the files
+        :param lock: the lock held while writing the kb file, by default the one of its path in FILE_LOCKS
+        :param process_registry: the registry that caches the processes, by default PROCESS_REGISTRY
+        :param kb_registry: the registry that caches the kbs, by default KB_REGISTRY
+        :param saver: an optional WriteBehindSaver used to write the kb in the background
+        :param journal: an optional KbJournal used to load and save the kb
+        :raises ValueError: if a journal is provided and its path is not the kb path
         """
-        with lock:
-            if not isinstance(initial_context, dict):
-                with open(initial_context) as ctx_file:
-                    my_ctx = json.load(ctx_file)
-            else:
-                my_ctx = initial_context
+        my_process = (process_registry if process_registry is not None else PROCESS_REGISTRY).get(process)
+        if not isinstance(initial_context, dict):
+            my_ctx = copy.deepcopy(_CONTEXT_REGISTRY.get(initial_context))
+        else:
+            my_ctx = initial_context
+
+        if journal is not None:
+            if os.path.abspath(journal.path) != os.path.abspath(kb):
+                raise ValueError(f"The journal kb {journal.path} is not the provided kb {kb}.")
+            return cls(my_process, journal.kb.view(), my_ctx, callback_getter, nlu, journal.record)
+
+        kb_registry = kb_registry if kb_registry is not None else KB_REGISTRY
+        my_kb = kb_registry.get(kb)
+        if lock is None:
+            lock = FILE_LOCKS.lock(os.path.abspath(kb))
+        return cls(my_process,
+                   my_kb.view(),
+                   my_ctx,
+                   callback_getter,
+                   nlu,
+                   lambda kb_c: _on_shared_save(kb_c, my_kb, kb, lock, kb_registry, saver))
+
+    def is_completed(self) -> bool:
+        """ Returns true if the process reached an END activity. """
+        return self._current.type == ActivityType.END
+
+    @property
+    def version(self) -> int:
+        """ The number of inputs handled by this instance, it changes after each input whose callback returns.
+
+        A client can send the version it expects with each input, to detect the inputs that were already handled (for
+        example when a request is retried) or that were handled by another client in the meanwhile. The version is
+        included in the snapshot.
+        """
+        return self._version
+
+    def snapshot(self) -> bytes:
+        """ Returns the state of this instance encoded as bytes, that can be passed to restore().
 
-            with open(process) as process_file, open(kb) as kb_file:
-                my_framework = cls(json.load(process_file),
-                                   json.load(kb_file),
-                                   my_ctx,
-                                   callback_getter,
-                                   nlu,
-                                   lambda kb_c: _on_file_save(kb_c, kb, lock))
-        return my_framework
+        The snapshot contains the current activity, the gateways state, the context and the kb; the process is referenced
+        by its digest. If the kb is a KbView only the changes that are not committed are included, since the shared
+        values are restored from the SharedKb. The context and the kb must contain only values that can be converted to
+        json.
+
+        :return: a compact binary encoding of the state of this instance
+        """
+        body = zlib.compress(self._encoded_state())
+        return _SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, _SNAPSHOT_VERSION, bytes.fromhex(self._process.digest)) + body
+
+    def state_size(self) -> int:
+        """ Returns the length of the state of this instance encoded as json, without compression.
+
+        This grows with the context and the kb changes of the instance, so it can be used to estimate the memory used by
+        an instance; the process and the SharedKb are not included, since they are shared.
+        """
+        return len(self._encoded_state())
+
+    def _encoded_state(self) -> bytes:
+        """ Returns the state included in the snapshot, encoded as json. """
+        if isinstance(self._kb, KbView):
+            changes, deleted = self._kb.changes()
+            kb = {"changes": changes, "deleted": sorted(deleted)}
+        else:
+            kb = {"all": dict(self._kb)}
+        state = {"current": self._current.id,
+                 "stack": list(self._stack),
+                 "done": {g: self._process.choices_in(self._process.get(g), mask) for g, mask in self._done.items()},
+                 "ctx": self._ctx,
+                 "kb": kb,
+                 "version": self._version}
+        return json.dumps(state, separators=(",", ":")).encode("utf-8")
+
+    def restore(self, snapshot: bytes) -> None:
+        """ Replaces the state of this instance with the one in the snapshot, see snapshot().
+
+        This instance must use the same process of the one that produced the snapshot. The kb changes in the snapshot
+        are applied to the current kb of this instance: if it is a KbView, they are applied to a new view of the same
+        SharedKb.
+
+        Example:
+            my_snapshot = my_framework.snapshot()
+            ...
+            my_framework = Framework.from_file(...)  # Create an instance with the same configuration.
+            my_framework.restore(my_snapshot)
+
+        :param snapshot: the bytes returned by snapshot()
+        :raises ValueError: if the bytes are not a snapshot, or the version of the snapshot is not supported
+        :raises DescriptionException: if the snapshot was produced with a different process
+        """
+        try:
+            magic, version, digest = _SNAPSHOT_HEADER.unpack_from(snapshot)
+        except struct.error as err:
+            raise ValueError("The provided bytes are not a snapshot.") from err
+        if magic != _SNAPSHOT_MAGIC:
+            raise ValueError("The provided bytes are not a snapshot.")
+        if version != _SNAPSHOT_VERSION:
+            raise ValueError(f"The snapshot version {version} is not supported.")
+        if digest.hex() != self._process.digest:
+            raise DescriptionException(digest.hex(), "The snapshot was produced with a different process.")
+        state = json.loads(zlib.decompress(snapshot[_SNAPSHOT_HEADER.size:]))
+
+        if "all" in state["kb"]:
+            kb = state["kb"]["all"]
+        elif isinstance(self._kb, KbView):
+            kb = self._kb._shared.view(state["kb"]["changes"], state["kb"]["deleted"])
+        else:
+            kb = dict(self._kb)
+            for key in state["kb"]["deleted"]:
+                kb.pop(key, None)
+            kb.update(state["kb"]["changes"])
+
+        self._current = self._process.get(state["current"])
+        self._stack = list(state["stack"])
+        self._done = {}
+        for g, choices in state["done"].items():
+            gateway = self._process.get(g)
+            self._done[g] = sum(self._process.choice_bit(gateway, c) for c in choices)
+        self._ctx = state["ctx"]
+        self._completed = dict.fromkeys(self._ctx.get(CTX_COMPLETED, []))
+        self._kb = kb
+        self._version = state.get("version", 0)
 
     def handle_text_input(self, text: str) -> Dict[str, Any]:
         """ Takes textual input from the user, uses the nlu to parse it, and handles the input as data.
@@ -123,19 +272,62 @@ class Framework(object):
         """
         # If the activity is an END, return the default utterance if it exists.
         if self._current.type == ActivityType.END:
+            self._version += 1
             return Response({}, {}, True).add_utterance(self._kb, self._current.id).to_dict()
 
+        # Run the callback and move on to the next activity if needed.
+        response = self._get_response(data)
+        self._version += 1
+        return self._handle_response(response)
+
+    async def handle_text_input_async(self, text: str) -> Dict[str, Any]:
+        """ Like handle_text_input, but awaits the nlu with NluAdapter.parse_async, see handle_data_input_async.
+
+        :param text: the textual input from the user, to be parsed
+        :return: a dictionary containing an utterance and a payload
+        """
+        return await self.handle_data_input_async(await self._nlu.parse_async(text.rstrip()))
+
+    async def handle_data_input_async(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """ Like handle_data_input, but does not block the event loop while the callback runs.
+
+        The callbacks can be coroutine functions, that are awaited, or plain functions, that are run in the default
+        executor of the event loop. The kb is saved in the event loop, when using this method it is better to save it in
+        the background with a WriteBehindSaver or a KbJournal (see from_file).
+        Do not call this method again on the same instance before the previous call returns, a SerialExecutor can be
+        used to run the turns of each session in order.
+
+        :param data: the data representing the input from the user, formatted accordingly to the chosen NluAdapter
+        :return: a dictionary containing an utterance and a payload
+        """
+        # If the activity is an END, return the default utterance if it exists.
+        if self._current.type == ActivityType.END:
+            self._version += 1
+            return Response({}, {}, True).add_utterance(self._kb, self._current.id).to_dict()
+
+        callback = self._callback_getter(self._current.id)
+        if inspect.iscoroutinefunction(callback):
+            response = await callback(data, self._kb, self._ctx)
+        else:
+            response = await asyncio.get_running_loop().run_in_executor(None, callback, data, self._kb, self._ctx)
+            if inspect.isawaitable(response):
+                response = await response
+        self._set_kb(response.kb)
+        self._ctx = response.ctx
+        self._version += 1
+        return self._handle_response(response)
+
+    def _handle_response(self, response):
+        # Move on to the next activity according to the response of the callback, and return its dictionary.
         # If the activity is a XOR, get the choice from the callback.
         if self._current.type == ActivityType.XOR:
-            response = self._get_response(data)
-
             # If the choice is valid, push next on the stack and continue with the chosen activity.
             if response.complete:
+                chosen = self._get_choice(response)
+
                 # Push next id on the stack, can be None.
                 self._stack.append(self._current.next_id)
-
-                # Current will not be None, because XOR must return a valid next id.
-                self._current = next(x for x in self._process.activities if x.id == response.choice)
+                self._current = chosen
 
                 # Add default utterance if it exists.
                 response.add_utterance(self._kb, self._current.id)
@@ -147,46 +339,37 @@ class Framework(object):
 
         # PARALLEL and OR have similar behaviour and they are handled together.
         if self._current.type == ActivityType.PARALLEL or self._current.type == ActivityType.OR:
-            # Obtain the chosen task from the callback.
-            response = self._get_response(data)
+            # The chosen task is obtained from the callback.
             if response.complete:
                 # The returned task is valid, and can be None to go to the next.
                 if response.choice is None:
                     # Clear the info on the current gateway, if some exist.
-                    self._done.pop(self._current.id, "")
-                    if self._current.id in self._ctx[CTX_COMPLETED]:
-                        self._ctx[CTX_COMPLETED].remove(self._current.id)
+                    self._done.pop(self._current.id, None)
+                    self._set_completed(self._current.id, False)
 
                     # Go to next task.
                     self._go_next(response)
                 else:
+                    chosen = self._get_choice(response)
+
                     # Put the gateway on the stack.
                     self._stack.append(self._current.id)
 
-                    # Add an entry for this gateway to done and add the choice to it.
-                    if self._current.id not in self._done:
-                        self._done[self._current.id] = []
-                    if response.choice not in self._done[self._current.id]:
-                        self._done[self._current.id].append(response.choice)
+                    # Add the bit of the choice to the bitmask of this gateway.
+                    done = self._done.get(self._current.id, 0) | self._process.choice_bit(self._current,
+                                                                                         response.choice)
+                    self._done[self._current.id] = done
 
                     # Handle separately PARALLEL and OR for updating CTX_COMPLETED.
                     if self._current.type == ActivityType.PARALLEL:
                         # A PARALLEL is completed when all the sub-tasks have been chosen at least once.
-                        if all(i in self._done[self._current.id] for i in self._current.choices):
-                            # Completed: add to the list.
-                            if self._current.id not in self._ctx[CTX_COMPLETED]:
-                                self._ctx[CTX_COMPLETED].append(self._current.id)
-                        else:
-                            # Not completed: remove from the list.
-                            if self._current.id in self._ctx[CTX_COMPLETED]:
-                                self._ctx[CTX_COMPLETED].remove(self._current.id)
+                        self._set_completed(self._current.id, done == self._process.choices_mask(self._current))
                     else:
                         # An OR is completed after the first valid choice.
-                        if self._current.id not in self._ctx[CTX_COMPLETED]:
-                            self._ctx[CTX_COMPLETED].append(self._current.id)
+                        self._set_completed(self._current.id, True)
 
                     # Set the choice and optional default utterance, the choice can not be None.
-                    self._current = next(x for x in self._process.activities if x.id == response.choice)
+                    self._current = chosen
                     response.add_utterance(self._kb, self._current.id)
 
                     # If the task is END, save the KB.
@@ -194,10 +377,7 @@ class Framework(object):
                         self._on_save(self._kb)
             return response.to_dict()
 
-        # If the activity is TASK or START, the evaluate callback is called.
-        response = self._get_response(data)
-
-        # If the activity is completed go to the next.
+        # If the activity is TASK or START, and it is completed, go to the next.
         if response.complete:
             self._go_next(response)
         return response.to_dict()
@@ -205,19 +385,49 @@ class Framework(object):
     def _get_response(self, data):
         # Run the callback, update the context and the kb, and return the response.
         response = self._callback_getter(self._current.id)(data, self._kb, self._ctx)
-        self._kb = response.kb
+        if inspect.isawaitable(response):
+            if inspect.iscoroutine(response):
+                response.close()
+            raise CallbackException(self._current.id, "The callback is a coroutine, use handle_data_input_async.")
+        self._set_kb(response.kb)
         self._ctx = response.ctx
         return response
 
+    def _set_kb(self, kb):
+        # A callback can return a new mapping instead of the KbView it received: its differences are written to the
+        # view, so that the kb is still shared and the commit changes only the keys written by this instance.
+        if isinstance(self._kb, KbView) and kb is not self._kb:
+            self._kb.assign(kb)
+        else:
+            self._kb = kb
+
+    def _set_completed(self, gateway_id, completed):
+        # Add or remove a gateway from the completed ones, and publish the list in the context if it changes.
+        if completed == (gateway_id in self._completed):
+            return
+        if completed:
+            self._completed[gateway_id] = None
+        else:
+            del self._completed[gateway_id]
+        self._ctx[CTX_COMPLETED] = list(self._completed)
+
+    def _get_choice(self, response):
+        # Return the activity chosen by the callback, that must be one of the choices of the current activity.
+        chosen = self._process.choice_of(self._current, response.choice)
+        if chosen is None:
+            raise CallbackException(response.choice,
+                                    f"The callback of {self._current.id} returned a choice that is not valid.")
+        return chosen
+
     def _go_next(self, response):
         # Go to the next task (maybe from the stack) and add the default utterance if it exists.
-        if self._current.next_id is None:
+        following = self._process.next_of(self._current)
+        if following is None:
             popped = self._stack.pop()
             while popped is None:
                 popped = self._stack.pop()
-            self._current = next(x for x in self._process.activities if x.id == popped)
-        else:
-            self._current = next(x for x in self._process.activities if x.id == self._current.next_id)
+            following = self._process.get(popped)
+        self._current = following
         response.add_utterance(self._kb, self._current.id)
 
         # If the task is END, save the KB.
@@ -225,7 +435,16 @@ class Framework(object):
             self._on_save(self._kb)
 
     def _check(self):
-        """ Checks that all the activities have a callback. """
+        """ Checks that all the activities have a callback.
+
+        The check is done only once for each pair of process and callback getter, the following instances that use the
+        same pair skip it.
+        """
+        with _checked_lock:
+            checked = _checked_getters.get(self._process)
+            if checked is not None and _is_in(self._callback_getter, checked):
+                return
+
         callback = ""
         for a in self._process.activities:
             try:
@@ -236,23 +455,72 @@ class Framework(object):
             if not callable(callback):
                 raise CallbackException(a.id, "The function to get a callback returned something that is not callable.")
 
+        with _checked_lock:
+            try:
+                _checked_getters.setdefault(self._process, WeakSet()).add(self._callback_getter)
+            except TypeError:
+                # The callback getter can not be weakly referenced, it will be checked every time.
+                pass
+
+
+_checked_getters: "WeakKeyDictionary[Process, WeakSet]" = WeakKeyDictionary()
+""" The callback getters that passed the check with each process, see Framework._check. """
+
+_checked_lock = Lock()
+""" The lock used to access _checked_getters. """
+
 
-def _on_file_save(contents: Dict[str, Any], path: str, lock: Lock) -> None:
-    """ The callback used to save a json formatted dictionary to a file.
+def _is_in(item: Any, items: WeakSet) -> bool:
+    """ Returns true if the item is in the set, false also if the item can not be weakly referenced. """
+    try:
+        return item in items
+    except TypeError:
+        return False
 
-    If the file is shared, provide a lock that is unique for all the instances, and this method will handle concurrent
-    access to the file.
 
-    :param contents: the dictionary to save
+def _on_shared_save(contents: Dict[str, Any],
+                    shared: SharedKb,
+                    path: str,
+                    lock: Lock,
+                    registry: "FileRegistry[SharedKb]",
+                    saver: Optional[WriteBehindSaver] = None) -> None:
+    """ The callback used to commit the kb of an instance to its SharedKb, and save the SharedKb to a file.
+
+    The file is written atomically, by the saver if one is provided. The registry is informed before and after the file
+    is written, so that it never loads again the kb from the file, also if a new instance is created while writing.
+
+    :param contents: the kb of the instance, usually a KbView of the shared kb
+    :param shared: the SharedKb that receives the changes
     :param path: the path of the destination file
     :param lock: a lock shared by all instances that have access to the file
+    :param registry: the registry that contains the shared kb
+    :param saver: an optional WriteBehindSaver that writes the file in the background
     """
+    shared.commit(contents)
+    if saver is not None:
+        saver.save(path, lambda: _expected_kb(shared, path, registry), lock, lambda data: registry.update(path, data))
+        return
     with lock:
-        with open(path, "w") as kb_file:
-            json.dump(contents, kb_file, indent=2)
+        data = _expected_kb(shared, path, registry)
+        atomic_write(path, data)
+        registry.update(path, data)
+
+
+def _expected_kb(shared: SharedKb, path: str, registry: "FileRegistry[SharedKb]") -> bytes:
+    """ Serializes the shared kb, and records in the registry that it is going to be written to the file. """
+    data = _serialize_kb(shared)
+    registry.expect(path, data)
+    return data
+
+
+def _serialize_kb(shared: SharedKb) -> bytes:
+    """ Returns the content of the file of a SharedKb. """
+    return json.dumps(shared.to_dict(), indent=2).encode("utf-8")
 
 
 class Response(object):
+    __slots__ = ("kb", "ctx", "complete", "utterance", "payload", "choice")
+
     def __init__(self,
                  kb: Dict[str, Any],
                  ctx: Dict[str, Any],
@@ -307,10 +575,21 @@ class Response(object):
 class Process(object):
     """ The description of a process, with a list of activities and the first activity.
 
+    When created, the process is also compiled: the activities are indexed by id and the next activity and the choices
+    of each activity are resolved in advance, so that moving from an activity to another takes constant time.
+    A process can be shared by many Framework instances (see FileRegistry), so it must not be modified once created.
+
     :ivar activities: a list of Activity objects representing this process
     :ivar first: the first Activity of the process
+    :ivar _index: a dictionary that maps the id of each activity to the activity
+    :ivar _next: a dictionary that maps the id of each activity to its next Activity (can be None)
+    :ivar _choices: a dictionary that maps the id of each gateway to a dictionary of its choices, by id
+    :ivar _bits: a dictionary that maps the id of each gateway to a dictionary with the bit of each choice, by id
+    :ivar _digest: the hash of this process, computed when first needed
     """
 
+    __slots__ = ("activities", "first", "_index", "_next", "_choices", "_bits", "_digest", "__weakref__")
+
     def __init__(self, activities: List[Union["Activity", Dict[str, Any]]], first_activity_id: str) -> None:
         """ Creates a new process description with the provided activities and first activity id.
 
@@ -327,11 +606,13 @@ class Process(object):
         self.activities = []
         for a in activities:
             self.activities.append(a if isinstance(a, Activity) else Activity.from_dict(a))
-        try:
-            self.first = next(x for x in self.activities if x.id == first_activity_id)
-        except StopIteration as err:
-            raise DescriptionException(first_activity_id, "Found no activity with the provided id.") from err
+        self._index = {a.id: a for a in self.activities}
+        if first_activity_id not in self._index:
+            raise DescriptionException(first_activity_id, "Found no activity with the provided id.")
+        self.first = self._index[first_activity_id]
+        self._digest = None
         self._check()
+        self._compile()
 
     @classmethod
     def from_dict(cls, dictionary: Dict[str, Any]) -> "Process":
@@ -355,27 +636,196 @@ class Process(object):
         except TypeError as err:
             raise DescriptionException(dictionary, "Did not find a required parameter in the process.") from err
 
+    def to_dict(self) -> Dict[str, Any]:
+        """ Returns a dictionary representing this Process, that can be used with Process.from_dict(). """
+        return {"activities": [a.to_dict() for a in self.activities], "first_activity_id": self.first.id}
+
+    @property
+    def digest(self) -> str:
+        """ The hash of this process, two processes with the same activities and first activity have the same hash. """
+        if self._digest is None:
+            data = json.dumps(self.to_dict(), sort_keys=True, separators=(",", ":"))
+            self._digest = hashlib.sha256(data.encode("utf-8")).hexdigest()
+        return self._digest
+
+    def get(self, activity_id: str) -> "Activity":
+        """ Returns the activity of this process with the provided id.
+
+        :param activity_id: the id of the activity
+        :return: the Activity with the provided id
+        :raises DescriptionException: if no activity has the provided id
+        """
+        try:
+            return self._index[activity_id]
+        except KeyError as err:
+            raise DescriptionException(activity_id, "Found no activity with the provided id.") from err
+
+    def next_of(self, activity: "Activity") -> Optional["Activity"]:
+        """ Returns the Activity that comes after the provided one, or None if its next id is None. """
+        return self._next[activity.id]
+
+    def choice_of(self, activity: "Activity", choice: Optional[str]) -> Optional["Activity"]:
+        """ Returns the Activity corresponding to a choice of the provided activity.
+
+        :param activity: an activity of this process, with type in ActivityType.get_require_choice()
+        :param choice: the id of one of the choices of the activity
+        :return: the chosen Activity, or None if the choice is not one of the choices of the activity
+        """
+        choices = self._choices.get(activity.id)
+        return choices.get(choice) if choices is not None else None
+
+    def choice_bit(self, activity: "Activity", choice: str) -> int:
+        """ Returns the bit that represents a choice of a gateway in a bitmask, see choices_mask().
+
+        :param activity: an activity of this process, with type in ActivityType.get_require_choice()
+        :param choice: the id of one of the choices of the activity
+        :return: an integer with only the bit of the choice set
+        """
+        return self._bits[activity.id][choice]
+
+    def choices_mask(self, activity: "Activity") -> int:
+        """ Returns the bitmask with the bits of all the choices of a gateway set.
+
+        A bitmask can be used to track the choices taken in a gateway: when all of them are taken the bitmask is equal to
+        the one returned by this method.
+
+        :param activity: an activity of this process, with type in ActivityType.get_require_choice()
+        :return: an integer with the bits of all the choices set
+        """
+        return (1 << len(activity.choices)) - 1
+
+    def choices_in(self, activity: "Activity", mask: int) -> List[str]:
+        """ Returns the ids of the choices of a gateway whose bits are set in the bitmask, in the same order. """
+        return [c for i, c in enumerate(activity.choices) if mask >> i & 1]
+
+    def _compile(self) -> None:
+        """ Resolves the next activity and the choices of each activity, must be called after the check.
+
+        Each choice of a gateway also receives the index of its bit, that is its position in the choices.
+        """
+        self._next = {}
+        self._choices = {}
+        self._bits = {}
+        for a in self.activities:
+            self._next[a.id] = self._index[a.next_id] if a.next_id is not None else None
+            if a.choices is not None:
+                self._choices[a.id] = {c: self._index[c] for c in a.choices}
+                self._bits[a.id] = {c: 1 << i for i, c in enumerate(a.choices)}
+
+    def analyze_reachability(self) -> "ReachabilityReport":
+        """ Analyzes the paths of this process, to find the activities that can never be executed and the gateways that
+        do not lead to an END activity.
+
+        An activity that has None as its next id leads back to the gateway that contains it, as the Framework does.
+        This runs in linear time in the number of activities and choices.
+
+        :return: a ReachabilityReport with the orphan activities and the gateways that do not lead to an END
+        """
+        successors = self._successors()
+
+        # Visit the activities starting from the first one, the ones that are not visited are orphans.
+        reached = {self.first.id}
+        pending = [self.first.id]
+        while pending:
+            for s in successors[pending.pop()]:
+                if s not in reached:
+                    reached.add(s)
+                    pending.append(s)
+
+        # Visit backwards the activities starting from the END ones, to find those that lead to an END.
+        predecessors = {a.id: [] for a in self.activities}
+        for a_id, following in successors.items():
+            for s in following:
+                predecessors[s].append(a_id)
+        leads_to_end = {a.id for a in self.activities if a.type == ActivityType.END}
+        pending = list(leads_to_end)
+        while pending:
+            for p in predecessors[pending.pop()]:
+                if p not in leads_to_end:
+                    leads_to_end.add(p)
+                    pending.append(p)
+
+        require_choice = ActivityType.get_require_choice()
+        return ReachabilityReport([a.id for a in self.activities if a.id not in reached],
+                                  [a.id for a in self.activities if a.type in require_choice
+                                   and a.id not in leads_to_end])
+
+    def _successors(self) -> Dict[str, List[str]]:
+        """ Returns a dictionary that maps the id of each activity to the ids of the activities that can follow it. """
+        require_choice = ActivityType.get_require_choice()
+
+        # Find the gateway that contains each activity, following the next ids from the choices.
+        owner = {}
+        for g in self.activities:
+            if g.type in require_choice:
+                for c in g.choices:
+                    a = self._index[c]
+                    while a is not None and a.id not in owner:
+                        owner[a.id] = g
+                        a = self._next[a.id]
+
+        # When an activity with None as next is completed, the Framework goes back to the gateway that contains it; a
+        # XOR moves on to its own next instead, or goes back to the gateway that contains the XOR, and so on.
+        resumed = {}
+
+        def resume(a: "Activity") -> Optional[str]:
+            chain = []
+            g = owner.get(a.id)
+            while g is not None and g.type == ActivityType.XOR and g.next_id is None and g.id not in resumed:
+                chain.append(g.id)
+                g = owner.get(g.id)
+            if g is None:
+                result = None
+            elif g.id in resumed:
+                result = resumed[g.id]
+            elif g.type == ActivityType.XOR:
+                result = g.next_id
+            else:
+                result = g.id
+            for x in chain:
+                resumed[x] = result
+            return result
+
+        successors = {}
+        for a in self.activities:
+            following = []
+            if a.type != ActivityType.END:
+                if a.type in require_choice:
+                    following.extend(a.choices)
+                if a.type != ActivityType.XOR:
+                    target = a.next_id if a.next_id is not None else resume(a)
+                    if target is not None:
+                        following.append(target)
+            successors[a.id] = following
+        return successors
+
     def _check(self) -> None:
         """ Performs some checks on the description, both syntactic and semantic (for example id are unique...).
 
+        The activities are counted by id in advance, so that the check runs in linear time.
+
         :raises DescriptionException: if the check is not passed
         """
+        # Count how many activities have each id.
+        found = {}
+        for a in self.activities:
+            found[a.id] = found.get(a.id, 0) + 1
 
-        # Assume the first activity id is not found.
-        found_first = 0
+        # Raise an exception if the first id does not have exactly one corresponding activity.
+        if found.get(self.first.id, 0) == 0:
+            raise DescriptionException(self.first.id, "First activity id has no corresponding activity.")
+        if found[self.first.id] > 1:
+            raise DescriptionException(self.first.id, "First activity id has multiple corresponding activities.")
 
+        require_choice = ActivityType.get_require_choice()
         for a in self.activities:
             # Check that next id is note equal to id.
             if a.next_id == a.id:
                 raise DescriptionException(a.id, "Found an activity that is the next of itself.")
 
-            # Count how many activities have first id as their id.
-            if self.first.id == a.id:
-                found_first += 1
-
             # If this is a OR, XOR or PARALLEL, check that choices exist unique.
-            choices = {}
-            if a.type in ActivityType.get_require_choice():
+            if a.type in require_choice:
+                choices = set()
                 # Choices list is provided because of previous checks in Activity constructor.
                 for c in a.choices:
                     if c is None:
@@ -384,35 +834,37 @@ class Process(object):
                         raise DescriptionException(a.id, "Found an activity with itself in its choices.")
                     if c in choices:
                         raise DescriptionException(a.id, "Found an activity that contains duplicate choices.")
-                    choices[c] = 0
-
-            # Also count how many other activities have this next id as their id.
-            found_next = 0
-            for b in self.activities:
-                if b.id == a.next_id:
-                    found_next += 1
-
-                # And count how many activities correspond to a choice.
-                if b.id in choices:
-                    choices[b.id] += 1
-
-            # Raise an exception if a choice does not have a corresponding activity or has more than one.
-            for c, v in choices.items():
-                if v == 0:
-                    raise DescriptionException(a.id, f"The following does not have a corresponding activity: {c}.")
-                if v > 1:
-                    raise DescriptionException(a.id, f"The following have multiple corresponding activities: {c}.")
-
-            # Raise exceptions if next id or first id do not have exactly one corresponding activity.
+                    choices.add(c)
+
+                    # Raise an exception if a choice does not have a corresponding activity or has more than one.
+                    if found.get(c, 0) == 0:
+                        raise DescriptionException(a.id, f"The following does not have a corresponding activity: {c}.")
+                    if found[c] > 1:
+                        raise DescriptionException(a.id, f"The following have multiple corresponding activities: {c}.")
+
+            # Raise exceptions if next id does not have exactly one corresponding activity.
             if a.next_id is not None:
-                if found_next == 0:
+                if found.get(a.next_id, 0) == 0:
                     raise DescriptionException(a.id, "The provided next id does not have a corresponding activity.")
-                if found_next > 1:
+                if found[a.next_id] > 1:
                     raise DescriptionException(a.next_id, "Found a next id that has multiple corresponding activities.")
-        if found_first == 0:
-            raise DescriptionException(self.first.id, "First activity id has no corresponding activity.")
-        if found_first > 1:
-            raise DescriptionException(self.first.id, "First activity id has multiple corresponding activities.")
+
+
+class ReachabilityReport(object):
+    """ The result of the reachability analysis of a Process, see Process.analyze_reachability().
+
+    :ivar orphans: the ids of the activities that can not be reached from the first activity
+    :ivar dead_gateways: the ids of the gateways (OR, XOR and PARALLEL) that have no path to an END activity
+    """
+
+    def __init__(self, orphans: List[str], dead_gateways: List[str]) -> None:
+        """ Creates a report with the provided orphan activities and gateways with no path to an END. """
+        self.orphans = orphans
+        self.dead_gateways = dead_gateways
+
+    def is_clean(self) -> bool:
+        """ Returns true if the analysis found no orphan activities and no gateways without a path to an END. """
+        return not self.orphans and not self.dead_gateways
 
 
 class Activity(object):
@@ -424,6 +876,8 @@ class Activity(object):
     :ivar choices: a list of id that this activity offers as choices (can be None)
     """
 
+    __slots__ = ("id", "next_id", "type", "choices")
+
     def __init__(self,
                  my_id: str,
                  next_id: Optional[str],
@@ -475,6 +929,13 @@ class Activity(object):
         except TypeError as err:
             raise DescriptionException(dictionary, "Did not find a required parameter in this activity.") from err
 
+    def to_dict(self) -> Dict[str, Any]:
+        """ Returns a dictionary representing this Activity, that can be used with Activity.from_dict(). """
+        dictionary = {"my_id": self.id, "next_id": self.next_id, "my_type": self.type.value}
+        if self.choices is not None:
+            dictionary["choices"] = list(self.choices)
+        return dictionary
+
     def __eq__(self, o: object) -> bool:
         """ Returns true if two activities have the same attributes. """
         return isinstance(o, Activity) and \
@@ -554,3 +1015,16 @@ class CallbackException(Exception):
     def __str__(self) -> str:
         """ Presents the message and the cause of this exception. """
         return f"{super().__str__()} The parameter of the function was: {self.cause}"
+
+
+PROCESS_REGISTRY: FileRegistry[Process] = FileRegistry(Process.from_dict)
+""" The registry used by default by Framework.from_file to share the processes between the instances. """
+
+KB_REGISTRY: FileRegistry[SharedKb] = FileRegistry(SharedKb)
+""" The registry used by default by Framework.from_file to share the kbs between the instances. """
+
+_CONTEXT_REGISTRY: FileRegistry[Dict[str, Any]] = FileRegistry(dict)
+""" The registry used by Framework.from_file for the context files, the contexts are copied for each instance. """
+
+FILE_LOCKS = KeyedLocks()
+""" The locks used by default by Framework.from_file to write the kb files, one for each absolute path. """
@@ -0,0 +1,160 @@
+from threading import Lock
+from typing import Any, Dict, Iterable, Iterator, Mapping, MutableMapping, Optional, Set, Tuple
+
+
+class SharedKb(object):
+    """ A knowledge base that is kept in memory once and shared by many Framework instances.
+
+    The instances do not use the shared kb directly, each one uses a KbView obtained with view(): reading from a view
+    returns the shared values, while writing to a view stores the value only in the view. When a process is completed
+    the changes of a view are applied to the shared kb with commit(), and become visible to all the other views.
+    This way the memory used by each instance depends only on the keys it writes, and not on the size of the kb.
+
+    The values in the kb are shared: a callback that wants to change a list or a dictionary in the kb must assign a new
+    value to the key (for example `kb["items"] = kb["items"] + ["new item"]`) instead of modifying the existing one.
+
+    Example:
+        my_kb = SharedKb({"items": ["cap"], "last_address": ""})
+        my_view = my_kb.view()
+        my_view["last_address"] = "Main street"  # The shared kb is not modified.
+        my_kb.commit(my_view)  # Now the shared kb contains the new address.
+
+    :ivar version: a number that is incremented every time the shared kb is modified
+    :ivar _data: the shared values
+    :ivar _lock: the lock used when modifying the shared values
+    """
+
+    def __init__(self, data: Dict[str, Any]) -> None:
+        """ Creates a shared kb with the provided values, the dictionary is not copied.
+
+        :param data: the values of the kb
+        """
+        self.version = 0
+        self._data = data
+        self._lock = Lock()
+
+    def view(self, changes: Dict[str, Any] = None, deleted: Iterable[str] = ()) -> "KbView":
+        """ Returns a new view of this kb, optionally with some changes that are not committed yet.
+
+        :param changes: the values written in the view, see KbView.changes()
+        :param deleted: the keys deleted in the view, see KbView.changes()
+        :return: a KbView that reads from this kb
+        """
+        return KbView(self, changes, deleted)
+
+    def commit(self, kb: Mapping[str, Any]) -> Tuple[Dict[str, Any], Set[str]]:
+        """ Applies to this kb the changes of the provided view, then clears the changes of the view.
+
+        If the provided kb is not a view of this kb, its differences from the values of this kb are applied: the keys
+        with a different value are written, and the keys that are not in the provided kb are deleted.
+
+        :param kb: a KbView of this kb, or a mapping with the new values
+        :return: the values written and the keys deleted
+        """
+        with self._lock:
+            self.version += 1
+            if isinstance(kb, KbView) and kb._shared is self:
+                changes, deleted = kb.changes()
+                kb._clear()
+            else:
+                changes, deleted = _diff(self._data, kb)
+            for key in deleted:
+                self._data.pop(key, None)
+            self._data.update(changes)
+            return changes, deleted
+
+    def to_dict(self) -> Dict[str, Any]:
+        """ Returns a copy of the values of this kb. """
+        with self._lock:
+            return dict(self._data)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._data
+
+    def __getitem__(self, key: str) -> Any:
+        return self._data[key]
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class KbView(MutableMapping):
+    """ A view of a SharedKb that can be used as the kb of a Framework, see SharedKb.
+
+    :ivar _shared: the SharedKb from which the values are read
+    :ivar _changes: the values written in this view
+    :ivar _deleted: the keys of the shared kb deleted in this view
+    """
+
+    __slots__ = ("_shared", "_changes", "_deleted")
+
+    def __init__(self, shared: SharedKb, changes: Optional[Dict[str, Any]] = None, deleted: Iterable[str] = ()) -> None:
+        """ Creates a view of the provided kb, see SharedKb.view(). """
+        self._shared = shared
+        self._changes = dict(changes) if changes is not None else {}
+        self._deleted: Set[str] = set(deleted)
+
+    def changes(self) -> Tuple[Dict[str, Any], Set[str]]:
+        """ Returns the values written in this view and the keys deleted from it, that are not committed yet. """
+        return dict(self._changes), set(self._deleted)
+
+    def assign(self, values: Mapping[str, Any]) -> None:
+        """ Makes this view contain the provided values, changing only the keys whose value is different.
+
+        This is used when a callback returns a new mapping instead of the view it received: the keys that it does not
+        contain are deleted from the view, the others are written if their value changed.
+
+        :param values: the new values of the view
+        """
+        changes, deleted = _diff(self, values)
+        for key in deleted:
+            del self[key]
+        self.update(changes)
+
+    def _clear(self) -> None:
+        """ Forgets the changes of this view, called by SharedKb.commit(). """
+        self._changes.clear()
+        self._deleted.clear()
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._changes:
+            return self._changes[key]
+        if key in self._deleted:
+            raise KeyError(key)
+        return self._shared[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self._changes[key] = value
+        self._deleted.discard(key)
+
+    def __delitem__(self, key: str) -> None:
+        if key not in self:
+            raise KeyError(key)
+        self._changes.pop(key, None)
+        if key in self._shared:
+            self._deleted.add(key)
+
+    def __contains__(self, key: object) -> bool:
+        if key in self._changes:
+            return True
+        return key not in self._deleted and key in self._shared
+
+    def __iter__(self) -> Iterator[str]:
+        for key in list(self._shared._data):
+            if key not in self._deleted and key not in self._changes:
+                yield key
+        yield from list(self._changes)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f"KbView({dict(self)})"
+
+
+def _diff(current: Mapping[str, Any], new: Mapping[str, Any]) -> Tuple[Dict[str, Any], Set[str]]:
+    """ Returns the values of new that are not in current or are different, and the keys of current not in new. """
+    changes = {key: value for key, value in new.items()
+               if key not in current or (current[key] is not value and current[key] != value)}
+    deleted = {key for key in current if key not in new}
+    return changes, deleted
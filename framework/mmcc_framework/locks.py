@@ -0,0 +1,317 @@
+import asyncio
+import inspect
+import time
+from collections import deque
+from contextlib import contextmanager
+from threading import Lock
+from typing import Any, AsyncIterable, Awaitable, Callable, Deque, Dict, Hashable, Iterator, Optional, Set, Tuple
+
+
+class KeyedLocks(object):
+    """ A lock for each key, for example to let only one thread at a time use the Framework of a session or write a file.
+
+    The threads that hold the locks of different keys never wait for each other. The lock of a key exists only while
+    some thread holds it or waits for it, so the number of keys is not limited. The locks count how many times a thread
+    had to wait, and for how long, to measure the contention.
+
+    Example:
+        my_locks = KeyedLocks()
+        with my_locks.hold((uid, interaction)):
+            my_store.get((uid, interaction)).handle_text_input("Hello")
+        my_saver.save(path, producer, my_locks.lock(path))  # An object that can be used like a Lock.
+
+    :ivar acquisitions: the number of times a lock was acquired
+    :ivar contended: the number of times a lock was held by another thread, and the caller waited
+    :ivar wait_time: the total number of seconds waited for the locks
+    :ivar max_wait: the longest number of seconds waited for a lock
+    :ivar _locks: the lock of each key that is in use, with the number of threads that hold it or wait for it
+    :ivar _lock: the lock used to access _locks and the counters
+    """
+
+    def __init__(self) -> None:
+        """ Creates the locks, without any key. """
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self._locks: Dict[Hashable, _LockEntry] = {}
+        self._lock = Lock()
+
+    def acquire(self, key: Hashable) -> None:
+        """ Acquires the lock of the key, waiting while another thread holds it. Call release with the same key after.
+
+        :param key: the key of the lock, for example a tuple with the user id and the interaction id
+        """
+        with self._lock:
+            key_lock = self._locks.get(key)
+            if key_lock is None:
+                key_lock = self._locks[key] = _LockEntry()
+            key_lock.users += 1
+        if key_lock.lock.acquire(blocking=False):
+            with self._lock:
+                self.acquisitions += 1
+            return
+        begin = time.perf_counter()
+        key_lock.lock.acquire()
+        waited = time.perf_counter() - begin
+        with self._lock:
+            self.acquisitions += 1
+            self.contended += 1
+            self.wait_time += waited
+            self.max_wait = max(self.max_wait, waited)
+
+    def release(self, key: Hashable) -> None:
+        """ Releases the lock of the key, that must be held by the caller.
+
+        :param key: the key of the lock
+        """
+        with self._lock:
+            key_lock = self._locks[key]
+            key_lock.lock.release()
+            key_lock.users -= 1
+            if key_lock.users == 0:
+                del self._locks[key]
+
+    @contextmanager
+    def hold(self, key: Hashable) -> Iterator[None]:
+        """ Holds the lock of the key in a with statement, waiting while another thread holds it.
+
+        :param key: the key of the lock, for example a tuple with the user id and the interaction id
+        """
+        self.acquire(key)
+        try:
+            yield
+        finally:
+            self.release(key)
+
+    def lock(self, key: Hashable) -> "KeyLock":
+        """ Returns an object that can be used like a Lock, that acquires the lock of the key.
+
+        :param key: the key of the lock, for example the absolute path of a file
+        :return: an object with the acquire and release methods, that can be used in a with statement
+        """
+        return KeyLock(self, key)
+
+    def stats(self) -> Dict[str, Any]:
+        """ Returns a dictionary with the counters of the contention and the number of keys in use. """
+        with self._lock:
+            return {"acquisitions": self.acquisitions,
+                    "contended": self.contended,
+                    "contention_rate": self.contended / self.acquisitions if self.acquisitions else 0.0,
+                    "wait_time": self.wait_time,
+                    "max_wait": self.max_wait,
+                    "keys": len(self._locks)}
+
+    def __len__(self) -> int:
+        """ Returns the number of keys whose lock is held or awaited. """
+        with self._lock:
+            return len(self._locks)
+
+
+class KeyLock(object):
+    """ The lock of a key of KeyedLocks, that can be used where a Lock is expected, see KeyedLocks.lock.
+
+    :ivar locks: the KeyedLocks that contains the lock
+    :ivar key: the key of the lock
+    """
+
+    __slots__ = ("locks", "key")
+
+    def __init__(self, locks: KeyedLocks, key: Hashable) -> None:
+        self.locks = locks
+        self.key = key
+
+    def acquire(self) -> bool:
+        """ Acquires the lock, waiting while another thread holds it, and returns true like Lock.acquire. """
+        self.locks.acquire(self.key)
+        return True
+
+    def release(self) -> None:
+        """ Releases the lock, that must be held by the caller. """
+        self.locks.release(self.key)
+
+    def __enter__(self) -> bool:
+        return self.acquire()
+
+    def __exit__(self, *args) -> None:
+        self.release()
+
+
+class _LockEntry(object):
+    """ The lock of a key of KeyedLocks, while it is in use.
+
+    :ivar lock: the lock
+    :ivar users: the number of threads that hold the lock or wait for it
+    """
+
+    __slots__ = ("lock", "users")
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.users = 0
+
+
+class SerialExecutor(object):
+    """ Runs the coroutines submitted with the same key one at a time, in order, in the running event loop.
+
+    The coroutines of different keys run concurrently. This is used to run the turns of each session in order, while
+    the turns of the other sessions proceed and the next messages are read: the submitted function is called only when
+    the previous ones of the same key are completed, so it can use the Framework of the session without other locks.
+    The queue of a key exists only while it has some functions to run, so the number of keys is not limited.
+
+    Example:
+        my_executor = SerialExecutor()
+        async for message in websocket:
+            my_executor.submit(key, handle_turn, websocket, message)  # Returns immediately.
+
+    :ivar submitted: the number of functions submitted
+    :ivar completed: the number of functions that returned
+    :ivar failed: the number of functions that raised an exception
+    :ivar max_queued: the maximum number of functions of the same key waiting to run
+    :ivar _queues: the functions that wait to run for each key that has a running function
+    :ivar _tasks: the tasks that run the queues, the event loop keeps only weak references to them
+    """
+
+    def __init__(self) -> None:
+        """ Creates an executor, without any key. """
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.max_queued = 0
+        self._queues: Dict[Hashable, Deque[Tuple[Callable[..., Awaitable[Any]], tuple, asyncio.Future]]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def submit(self, key: Hashable, function: Callable[..., Awaitable[Any]], *args: Any) -> asyncio.Future:
+        """ Calls the function with the arguments and awaits its result, after the ones submitted before with the key.
+
+        Must be called in the event loop, the functions of all the keys run in that loop.
+
+        :param key: the key of the queue, for example a tuple with the user id and the interaction id
+        :param function: a coroutine function, or a function that returns an awaitable
+        :param args: the arguments of the function
+        :return: a future with the result or the exception of the function, cancelling it removes the function from the
+                 queue if it is not running yet
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.submitted += 1
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = deque()
+            task = loop.create_task(self._drain(key, queue))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        queue.append((function, args, future))
+        self.max_queued = max(self.max_queued, len(queue))
+        return future
+
+    async def run(self, key: Hashable, function: Callable[..., Awaitable[Any]], *args: Any) -> Any:
+        """ Like submit, but waits for the result of the function and returns it. """
+        return await self.submit(key, function, *args)
+
+    async def pipeline(self,
+                       key: Hashable,
+                       messages: AsyncIterable[Any],
+                       function: Callable[..., Awaitable[Any]],
+                       *args: Any,
+                       max_pending: int = 8) -> None:
+        """ Submits the function for each message of the iterable, reading the next messages while the previous run.
+
+        The function is called with the arguments followed by the message. This returns when the iterable ends and all
+        the functions returned; as soon as a function raises an exception, the reading stops, the functions that are
+        not running yet are cancelled, and the exception is raised, also if no other message arrives.
+
+        Example:
+            await my_executor.pipeline(key, websocket, handle_turn, websocket)  # handle_turn(websocket, message)
+
+        :param key: the key of the queue, for example a tuple with the user id and the interaction id
+        :param messages: an asynchronous iterable of messages, for example a websocket
+        :param function: a coroutine function, or a function that returns an awaitable
+        :param args: the first arguments of the function
+        :param max_pending: the number of submitted functions after which the reading waits for the first to return
+        """
+        iterator = messages.__aiter__()
+        pending: Deque[asyncio.Future] = deque()
+        receiving = None
+        try:
+            while True:
+                if receiving is None and len(pending) < max_pending:
+                    receiving = asyncio.ensure_future(iterator.__anext__())
+                waiting = ([receiving] if receiving is not None else []) + ([pending[0]] if pending else [])
+                await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+                while pending and pending[0].done():
+                    # Raises the exception of the function, if any.
+                    pending.popleft().result()
+                if receiving is not None and receiving.done():
+                    try:
+                        message = receiving.result()
+                    except StopAsyncIteration:
+                        receiving = None
+                        break
+                    receiving = None
+                    pending.append(self.submit(key, function, *args, message))
+            while pending:
+                await pending.popleft()
+        finally:
+            if receiving is not None:
+                receiving.cancel()
+            for future in pending:
+                # The errors of the functions that are not awaited anymore are not interesting.
+                if future.done() and not future.cancelled():
+                    future.exception()
+                future.cancel()
+
+    def pending(self, key: Hashable) -> int:
+        """ Returns the number of functions of the key that are waiting to run, or running. """
+        queue = self._queues.get(key)
+        return 0 if queue is None else len(queue)
+
+    def stats(self) -> Dict[str, int]:
+        """ Returns a dictionary with the counters of this executor and the number of keys that have some functions. """
+        return {"submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "max_queued": self.max_queued,
+                "active_keys": len(self._queues)}
+
+    async def _drain(self, key: Hashable, queue: Deque) -> None:
+        """ Runs the functions of a key in order, until its queue is empty. """
+        try:
+            while queue:
+                function, args, future = queue[0]
+                if not future.cancelled():
+                    try:
+                        result, err = await _call(function, args)
+                    except asyncio.CancelledError:
+                        future.cancel()
+                        raise
+                    if err is not None:
+                        self.failed += 1
+                        if not future.cancelled():
+                            future.set_exception(err)
+                    else:
+                        self.completed += 1
+                        if not future.cancelled():
+                            future.set_result(result)
+                queue.popleft()
+        finally:
+            del self._queues[key]
+            for _, _, future in queue:
+                future.cancel()
+
+
+async def _call(function: Callable[..., Any], args: tuple) -> Tuple[Any, Optional[Exception]]:
+    """ Calls the function and awaits its result, returns the result and None, or None and the exception it raised.
+
+    The exception is caught here and not in SerialExecutor._drain, so its traceback does not contain the frame of the
+    drain, that is still running when the traceback is cleared (for example by unittest).
+    """
+    try:
+        result = function(*args)
+        if inspect.isawaitable(result):
+            result = await result
+    except asyncio.CancelledError:
+        raise
+    except Exception as err:
+        return None, err
+    return result, None
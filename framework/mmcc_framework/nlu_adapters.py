@@ -1,7 +1,14 @@
+import asyncio
+import copy
 import json
+import time
 from abc import ABC, abstractmethod
-from http.client import HTTPConnection
-from typing import Dict, Any, List
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from http.client import HTTPConnection, HTTPException
+from queue import Empty, LifoQueue
+from threading import BoundedSemaphore, Lock
+from typing import Dict, Any, Callable, List, Optional, Union
 
 
 class NluAdapter(ABC):
@@ -12,6 +19,24 @@ class NluAdapter(ABC):
         """ Transforms the provided text input into the equivalent data input. """
         raise NotImplementedError()
 
+    async def parse_async(self, utterance: str) -> Dict[str, Any]:
+        """ Like parse, but can be awaited without blocking the event loop.
+
+        By default this runs parse in the default executor of the event loop, the adapters that can parse without
+        blocking should override it.
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, self.parse, utterance)
+
+    def parse_batch(self, utterances: List[str]) -> List[Dict[str, Any]]:
+        """ Transforms many text inputs, for example to replay a conversation log or to evaluate the nlu.
+
+        By default this calls parse for each utterance, the adapters that can do better should override it.
+
+        :param utterances: the text inputs to transform
+        :return: the data inputs, in the same order of the utterances
+        """
+        return [self.parse(utterance) for utterance in utterances]
+
 
 class NoNluAdapter(NluAdapter):
     """ This adapter does not use a NLU engine, and simply takes the input and puts it into a dictionary.
@@ -46,6 +71,15 @@ class NoNluAdapter(NluAdapter):
         """
         return dict.fromkeys(self.keys, utterance)
 
+    def parse_batch(self, utterances: List[str]) -> List[Dict[str, Any]]:
+        """ Same as parse for each utterance, without calling it every time. """
+        keys = self.keys
+        return [dict.fromkeys(keys, utterance) for utterance in utterances]
+
+    async def parse_async(self, utterance: str) -> Dict[str, Any]:
+        """ Same as parse, this adapter does not block. """
+        return self.parse(utterance)
+
 
 class RasaNlu(NluAdapter):
     """ This adapter uses Rasa, to use this adapter it is necessary to first setup and train the interpreter.
@@ -61,7 +95,7 @@ class RasaNlu(NluAdapter):
 
     Example:
         Suppose that the nlu is trained with, among the others, the intent "insert_name" with a entity "name".
-        Initialize the adapter: `my_adapter = RasaNlu()`
+        Initialize the adapter: `my_adapter = RasaNlu()`, or `RasaNlu("rasa", 5005)` if rasa runs on another host
 
         Suppose that it is time to insert the name. If it is necessary to insert it as text use:
         `my_framework.handle_text_input("Mark")`. The callback corresponding to the current activity will receive
@@ -71,9 +105,33 @@ class RasaNlu(NluAdapter):
         `my_framework.handle_data_input(RasaNlu.dict("insert_name", {"name": "Mark"}))`, which will pass to the callback
         the same structure as above.
 
-    :ivar interpreter: the instance of the rasa interpreter used by this adapter
+    The connections to rasa are kept alive and reused, at most max_connections are open at the same time: when they are
+    all busy parse waits for one to be free. A connection that was closed by the server is replaced, and the request is
+    sent again once.
+
+    :ivar host: the host where rasa is running
+    :ivar port: the port where rasa is listening
+    :ivar timeout: the seconds to wait for a connection, or for a response, before raising a TimeoutError
+    :ivar max_connections: the maximum number of connections that are open at the same time
     """
 
+    def __init__(self, host: str = "localhost", port: int = 5005, timeout: float = 10.0,
+                 max_connections: int = 8) -> None:
+        """ Initializes this adapter, no connection is opened until the first parse.
+
+        :param host: the host where rasa is running
+        :param port: the port where rasa is listening
+        :param timeout: the seconds to wait for a connection, or for a response, before raising a TimeoutError
+        :param max_connections: the maximum number of connections that are open at the same time
+        """
+        if max_connections < 1:
+            raise ValueError("max_connections must be at least 1")
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._pool = _ConnectionPool(host, port, timeout, max_connections)
+
     def parse(self, utterance: str) -> Dict[str, Any]:
         """ Runs the interpreter to parse the given utterance and returns a dictionary containing the parsed data.
 
@@ -81,15 +139,25 @@ class RasaNlu(NluAdapter):
 
         :param utterance: the text input from the user
         :return: a dictionary containing the detected intent and corresponding entities if any exists.
+        :raise HTTPException: if rasa does not answer with a success status
         """
-        connection = HTTPConnection("localhost:5005") # TODO modify here to use without docker
-        connection.request("POST", "/model/parse", json.dumps({"text": utterance}))
-        response = json.loads(connection.getresponse().read())
+        response = json.loads(self._pool.post("/model/parse", json.dumps({"text": utterance}).encode("utf-8")))
         if response["intent"]["name"] is None:
             return {"intent": ""}
         return self.dict(response["intent"]["name"],
                          {item['entity']: item["value"] for item in response["entities"]})
 
+    def parse_batch(self, utterances: List[str]) -> List[Dict[str, Any]]:
+        """ Like parse for each utterance, but sends up to max_connections requests at the same time.
+
+        :param utterances: the text inputs to transform
+        :return: the data inputs, in the same order of the utterances
+        """
+        if len(utterances) < 2:
+            return [self.parse(utterance) for utterance in utterances]
+        with ThreadPoolExecutor(min(self.max_connections, len(utterances))) as executor:
+            return list(executor.map(self.parse, utterances))
+
     @staticmethod
     def dict(intent: str, values: Dict[str, Any] = None) -> Dict[str, Any]:
         """ Helper method that can be used to produce a dictionary equivalent to the one of the parse method.
@@ -102,3 +170,462 @@ class RasaNlu(NluAdapter):
         if values is None:
             values = {}
         return {"intent": intent, **values}
+
+    def close(self) -> None:
+        """ Closes the idle connections, the adapter can still be used and opens new ones if needed. """
+        self._pool.close()
+
+    def stats(self) -> Dict[str, int]:
+        """ Returns the number of requests sent and of connections opened since this adapter was created. """
+        return {"requests": self._pool.requests, "connections": self._pool.connections}
+
+
+def normalize_utterance(utterance: str) -> str:
+    """ The default normalization of CachingNluAdapter: removes the repeated spaces and ignores the case. """
+    return " ".join(utterance.split()).casefold()
+
+
+class CachingNluAdapter(NluAdapter):
+    """ This adapter decorates another adapter, and remembers the results of parse to avoid parsing the same text again.
+
+    The results are stored using as key the normalized utterance and the model_version, so that changing model_version
+    (for example after training rasa again) ignores the previous results. At most max_size results are remembered, the
+    least recently used are forgotten first; if ttl is provided, the results older than ttl seconds are parsed again.
+    The callbacks receive a copy of the result, so they can modify it. The errors raised by the adapter are not
+    remembered.
+    Use a normalization that gives the same text only for utterances that are parsed in the same way: the default one
+    ignores the case, so it should not be used with an adapter like NoNluAdapter, which returns the text as it is.
+
+    Example:
+        `my_adapter = CachingNluAdapter(RasaNlu(), max_size=10000, ttl=3600, model_version="nlu-20201228-183937")`
+
+    :ivar adapter: the adapter that parses the utterances that are not remembered
+    :ivar model_version: the version of the model used by adapter, it is part of the key of the results
+    :ivar hits: the number of utterances whose result was remembered
+    :ivar misses: the number of utterances parsed by adapter
+    :ivar evictions: the number of results forgotten because there were more than max_size
+    :ivar expirations: the number of results forgotten because they were older than ttl
+    :ivar _normalize: the function that gives the text used as key
+    :ivar _max_size: the maximum number of results remembered
+    :ivar _ttl: the seconds after which a result is parsed again, or None
+    :ivar _results: the pairs of time and result, from the least to the most recently used
+    :ivar _lock: the lock used to access the results
+    """
+
+    def __init__(self,
+                 adapter: NluAdapter,
+                 max_size: int = 1024,
+                 ttl: Optional[float] = None,
+                 model_version: str = "",
+                 normalize: Callable[[str], str] = normalize_utterance) -> None:
+        """ Initializes this adapter, nothing is remembered at the beginning.
+
+        :param adapter: the adapter that parses the utterances that are not remembered
+        :param max_size: the maximum number of results remembered
+        :param ttl: the seconds after which a result is parsed again, or None to keep the results until they are evicted
+        :param model_version: the version of the model used by adapter, it is part of the key of the results
+        :param normalize: the function that gives the text used as key, by default normalize_utterance
+        """
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        self.adapter = adapter
+        self.model_version = model_version
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._normalize = normalize
+        self._max_size = max_size
+        self._ttl = ttl
+        self._results = OrderedDict()
+        self._lock = Lock()
+
+    def parse(self, utterance: str) -> Dict[str, Any]:
+        """ Returns a copy of the remembered result for the utterance, or parses it with adapter and remembers it.
+
+        :param utterance: the text input from the user
+        :return: the same dictionary returned by adapter
+        """
+        key = self._key(utterance)
+        result = self._lookup(key)
+        if result is None:
+            result = self.adapter.parse(utterance)
+            self._store(key, result)
+        return copy.deepcopy(result)
+
+    def parse_batch(self, utterances: List[str]) -> List[Dict[str, Any]]:
+        """ Like parse for each utterance, the utterances that are not remembered are parsed together with the
+        parse_batch of adapter, and each of them only once.
+
+        :param utterances: the text inputs to transform
+        :return: the data inputs, in the same order of the utterances
+        """
+        keys = [self._key(utterance) for utterance in utterances]
+        found = {}
+        missing = {}
+        for key, utterance in zip(keys, utterances):
+            if key in found or key in missing:
+                with self._lock:
+                    self.hits += 1
+                continue
+            result = self._lookup(key)
+            if result is None:
+                missing[key] = utterance
+            else:
+                found[key] = result
+        if missing:
+            for key, result in zip(missing, self.adapter.parse_batch(list(missing.values()))):
+                self._store(key, result)
+                found[key] = result
+        return [copy.deepcopy(found[key]) for key in keys]
+
+    async def parse_async(self, utterance: str) -> Dict[str, Any]:
+        """ Like parse, the remembered results are returned without awaiting adapter. """
+        key = self._key(utterance)
+        result = self._lookup(key)
+        if result is None:
+            result = await self.adapter.parse_async(utterance)
+            self._store(key, result)
+        return copy.deepcopy(result)
+
+    def clear(self) -> None:
+        """ Forgets all the results. """
+        with self._lock:
+            self._results.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """ Returns the counters of this adapter, the number of results remembered and the rate of hits. """
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "expirations": self.expirations,
+                    "size": len(self._results),
+                    "hit_rate": self.hits / total if total else 0.0}
+
+    def _key(self, utterance):
+        return self.model_version, self._normalize(utterance)
+
+    def _lookup(self, key):
+        # Returns the remembered result, or None counting a miss.
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is not None and self._ttl is not None and time.monotonic() - entry[0] > self._ttl:
+                del self._results[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._results.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def _store(self, key, result):
+        # The adapter may still modify its result, a copy is remembered.
+        entry = (time.monotonic(), copy.deepcopy(result))
+        with self._lock:
+            self._results[key] = entry
+            self._results.move_to_end(key)
+            while len(self._results) > self._max_size:
+                self._results.popitem(last=False)
+                self.evictions += 1
+
+
+class NluTier(object):
+    """ An adapter used by a NluChain, with its timeout and the state of its circuit breaker.
+
+    After max_failures consecutive failures (errors or timeouts) the circuit breaker opens, and the adapter is not used
+    for cool_down seconds. After that one utterance is sent to the adapter: if it succeeds the breaker closes, otherwise
+    it stays open for another cool_down.
+
+    :ivar adapter: the adapter of this tier
+    :ivar name: the name of this tier in the metrics of the chain
+    :ivar timeout: the seconds the chain waits for the adapter, or None to wait until it returns
+    :ivar max_failures: the number of consecutive failures that open the circuit breaker
+    :ivar cool_down: the seconds the adapter is not used when the circuit breaker opens
+    :ivar failures: the number of consecutive failures
+    :ivar open_until: the time.monotonic() until which the adapter is not used
+    :ivar probing: whether an utterance is testing the adapter after the cool down
+    """
+
+    def __init__(self,
+                 adapter: NluAdapter,
+                 timeout: Optional[float] = None,
+                 max_failures: int = 3,
+                 cool_down: float = 30.0,
+                 name: Optional[str] = None) -> None:
+        """ Initializes this tier with the circuit breaker closed.
+
+        :param adapter: the adapter of this tier
+        :param timeout: the seconds the chain waits for the adapter, or None to wait until it returns
+        :param max_failures: the number of consecutive failures that open the circuit breaker
+        :param cool_down: the seconds the adapter is not used when the circuit breaker opens
+        :param name: the name of this tier in the metrics of the chain, by default the name of the adapter class
+        """
+        if max_failures < 1:
+            raise ValueError("max_failures must be at least 1")
+        self.adapter = adapter
+        self.name = name if name is not None else type(adapter).__name__
+        self.timeout = timeout
+        self.max_failures = max_failures
+        self.cool_down = cool_down
+        self.failures = 0
+        self.open_until = 0.0
+        self.probing = False
+
+    def is_open(self) -> bool:
+        """ Returns True if the circuit breaker is open and the cool down is not over. """
+        return self.failures >= self.max_failures and time.monotonic() < self.open_until
+
+
+class NluChain(NluAdapter):
+    """ This adapter tries other adapters in order, and returns the first result that is not `{"intent": ""}`.
+
+    For example a RuleNlu, then a RasaNlu, then a NoNluAdapter: when rasa is slow or down the chain still answers. An
+    adapter that raises an error or does not answer within the timeout of its tier is skipped, and the circuit breaker
+    of the tier stops using it for a while if it keeps failing, see NluTier. The whole chain can have a budget of seconds
+    for each utterance: when it is over, the remaining tiers are not tried. If no tier answers, the result is
+    `{"intent": ""}`. The tiers with a timeout, or used with a budget, run in a pool of threads, an adapter that does not
+    answer in time keeps its thread until it returns.
+
+    Example:
+        `my_adapter = NluChain([RuleNlu.from_rasa_file("rasa/data/nlu.yml"), NluTier(RasaNlu(), timeout=0.5),
+        NoNluAdapter(["intent"])], budget=1.0)`
+
+    :ivar tiers: the tiers, in the order they are tried
+    :ivar budget: the maximum seconds spent on each utterance, or None
+    :ivar answered: the number of utterances answered by each tier
+    :ivar failures: the number of errors of each tier
+    :ivar timeouts: the number of timeouts of each tier
+    :ivar skipped: the number of utterances not sent to each tier because its circuit breaker was open
+    :ivar unanswered: the number of utterances that no tier answered
+    :ivar _max_workers: the maximum number of threads of the pool
+    :ivar _executor: the pool of threads, created when needed
+    :ivar _lock: the lock used to update the tiers and the metrics
+    """
+
+    def __init__(self, tiers: List[Union[NluTier, NluAdapter]], budget: Optional[float] = None,
+                 max_workers: int = 8) -> None:
+        """ Initializes this chain, an adapter in tiers is used as a tier without timeout.
+
+        :param tiers: the tiers, or the adapters, in the order they are tried
+        :param budget: the maximum seconds spent on each utterance, or None
+        :param max_workers: the maximum number of threads used to run the tiers with a timeout
+        """
+        self.tiers = [tier if isinstance(tier, NluTier) else NluTier(tier) for tier in tiers]
+        if len({tier.name for tier in self.tiers}) != len(self.tiers):
+            raise ValueError("The names of the tiers must be different, use the name argument of NluTier")
+        self.budget = budget
+        self.answered = dict.fromkeys((tier.name for tier in self.tiers), 0)
+        self.failures = dict.fromkeys(self.answered, 0)
+        self.timeouts = dict.fromkeys(self.answered, 0)
+        self.skipped = dict.fromkeys(self.answered, 0)
+        self.unanswered = 0
+        self._max_workers = max_workers
+        self._executor = None
+        self._lock = Lock()
+
+    def parse(self, utterance: str) -> Dict[str, Any]:
+        """ Returns the first result of the tiers that is not `{"intent": ""}`.
+
+        :param utterance: the text input from the user
+        :return: the result of the first tier that answers, or `{"intent": ""}`
+        """
+        deadline = None if self.budget is None else time.monotonic() + self.budget
+        for tier in self.tiers:
+            timeout = self._timeout(tier, deadline)
+            if timeout is not None and timeout <= 0:
+                break
+            if not self._allow(tier):
+                continue
+            try:
+                if timeout is None:
+                    result = tier.adapter.parse(utterance)
+                else:
+                    future = self._pool().submit(tier.adapter.parse, utterance)
+                    try:
+                        result = future.result(timeout)
+                    except FutureTimeoutError:
+                        future.cancel()
+                        raise
+            except (FutureTimeoutError, TimeoutError):
+                self._failed(tier, self.timeouts)
+                continue
+            except Exception:
+                self._failed(tier, self.failures)
+                continue
+            except BaseException:
+                self._interrupted(tier)
+                raise
+            if self._succeeded(tier, result):
+                return result
+        with self._lock:
+            self.unanswered += 1
+        return {"intent": ""}
+
+    async def parse_async(self, utterance: str) -> Dict[str, Any]:
+        """ Like parse, awaiting the parse_async of the tiers. """
+        deadline = None if self.budget is None else time.monotonic() + self.budget
+        for tier in self.tiers:
+            timeout = self._timeout(tier, deadline)
+            if timeout is not None and timeout <= 0:
+                break
+            if not self._allow(tier):
+                continue
+            try:
+                result = await asyncio.wait_for(tier.adapter.parse_async(utterance), timeout)
+            except (asyncio.TimeoutError, TimeoutError):
+                self._failed(tier, self.timeouts)
+                continue
+            except Exception:
+                self._failed(tier, self.failures)
+                continue
+            except BaseException:
+                # For example the task was cancelled, the tier did not fail.
+                self._interrupted(tier)
+                raise
+            if self._succeeded(tier, result):
+                return result
+        with self._lock:
+            self.unanswered += 1
+        return {"intent": ""}
+
+    def stats(self) -> Dict[str, Any]:
+        """ Returns the metrics of each tier, the number of unanswered utterances and the tiers that are not used. """
+        with self._lock:
+            return {"answered": dict(self.answered),
+                    "failures": dict(self.failures),
+                    "timeouts": dict(self.timeouts),
+                    "skipped": dict(self.skipped),
+                    "unanswered": self.unanswered,
+                    "open": [tier.name for tier in self.tiers if tier.is_open()]}
+
+    def close(self) -> None:
+        """ Stops the pool of threads, without waiting for the adapters that did not answer. """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def _timeout(self, tier, deadline):
+        # The seconds to wait for the tier, or None.
+        if deadline is None:
+            return tier.timeout
+        remaining = deadline - time.monotonic()
+        return remaining if tier.timeout is None else min(tier.timeout, remaining)
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self._max_workers, thread_name_prefix="NluChain")
+            return self._executor
+
+    def _allow(self, tier):
+        # Returns False if the circuit breaker of the tier is open, True if the tier can be used.
+        with self._lock:
+            if tier.failures < tier.max_failures:
+                return True
+            if tier.probing or time.monotonic() < tier.open_until:
+                self.skipped[tier.name] += 1
+                return False
+            tier.probing = True
+            return True
+
+    def _failed(self, tier, counters):
+        with self._lock:
+            counters[tier.name] += 1
+            tier.failures += 1
+            tier.probing = False
+            if tier.failures >= tier.max_failures:
+                tier.open_until = time.monotonic() + tier.cool_down
+
+    def _interrupted(self, tier):
+        with self._lock:
+            tier.probing = False
+
+    def _succeeded(self, tier, result):
+        # Closes the circuit breaker, and returns True if the result is an answer.
+        answer = result != {"intent": ""}
+        with self._lock:
+            tier.failures = 0
+            tier.probing = False
+            if answer:
+                self.answered[tier.name] += 1
+        return answer
+
+
+class _ConnectionPool(object):
+    """ A bounded pool of keep-alive connections to the same server, that can be used from many threads. """
+
+    def __init__(self, host: str, port: int, timeout: float, size: int) -> None:
+        self._host = host
+        self._port = port
+        self._timeout = timeout
+        self._idle = LifoQueue()
+        self._slots = BoundedSemaphore(size)
+        self._stats_lock = Lock()
+        self.requests = 0
+        self.connections = 0
+
+    def post(self, url: str, body: bytes) -> bytes:
+        """ Sends a POST request with a json body and returns the body of the response. """
+        if not self._slots.acquire(timeout=self._timeout):
+            raise TimeoutError(f"No connection to {self._host}:{self._port} was free after {self._timeout}s")
+        try:
+            try:
+                connection, reused = self._idle.get_nowait(), True
+            except Empty:
+                connection, reused = self._connect(), False
+            try:
+                status, data, keep = self._send(connection, url, body)
+            except (HTTPException, ConnectionError):
+                connection.close()
+                # The server may have closed an idle connection, a new one is tried once.
+                if not reused:
+                    raise
+                retry = True
+            except BaseException:
+                connection.close()
+                raise
+            else:
+                retry = False
+            if retry:
+                connection = self._connect()
+                try:
+                    status, data, keep = self._send(connection, url, body)
+                except BaseException:
+                    connection.close()
+                    raise
+            if keep:
+                self._idle.put(connection)
+            else:
+                connection.close()
+        finally:
+            self._slots.release()
+        if status != 200:
+            raise HTTPException(f"{self._host}:{self._port}{url} answered with status {status}: {data[:200]!r}")
+        return data
+
+    def close(self) -> None:
+        """ Closes all the idle connections. """
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except Empty:
+                return
+
+    def _connect(self) -> HTTPConnection:
+        with self._stats_lock:
+            self.connections += 1
+        return HTTPConnection(self._host, self._port, timeout=self._timeout)
+
+    def _send(self, connection, url, body):
+        with self._stats_lock:
+            self.requests += 1
+        connection.request("POST", url, body, {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        # The response must be read completely before the connection can be reused.
+        data = response.read()
+        return response.status, data, not response.will_close
@@ -0,0 +1,323 @@
+import atexit
+import json
+import os
+import tempfile
+import time
+from threading import Condition, Lock, Thread
+from typing import Any, Callable, Dict, List, Mapping, Optional
+
+from mmcc_framework.kb import SharedKb
+
+
+def atomic_write(path: str, data: bytes) -> None:
+    """ Writes the data to the file at the provided path, so that the file contains either the old or the new data.
+
+    The data is written to a temporary file in the same folder, that then replaces the destination file.
+
+    :param path: the path of the destination file
+    :param data: the content to write
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    descriptor, temp_path = tempfile.mkstemp(dir=folder, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as temp_file:
+            temp_file.write(data)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+class WriteBehindSaver(object):
+    """ Saves files in a background thread, so that the caller of save does not wait for the file to be written.
+
+    The content of a file is produced in the background thread too, only when it is time to write it. When many saves of
+    the same file are requested before it is written, they are coalesced in a single write of the latest content.
+    Each file is written atomically, see atomic_write.
+
+    Remember to call flush() or close() before the program terminates, by default close() is also called at exit.
+
+    Example:
+        my_saver = WriteBehindSaver()
+        my_saver.save("my_kb.json", lambda: json.dumps(my_kb).encode())  # Returns immediately.
+        my_saver.flush()  # Waits until the file is written.
+
+    :ivar requested: the number of saves requested
+    :ivar written: the number of files written, smaller than requested when some saves are coalesced
+    :ivar _delay: the seconds waited before writing, to coalesce the saves that arrive in the meanwhile
+    :ivar _pending: a dictionary that maps the path of each file to save to its _SaveJob
+    :ivar _writing: whether the background thread is writing some files
+    :ivar _errors: the errors raised by the writes since the last flush
+    :ivar _closed: whether close() was called
+    :ivar _condition: used to synchronize with the background thread
+    :ivar _thread: the background thread, started by the first save
+    """
+
+    def __init__(self, delay: float = 0.05, close_at_exit: bool = True) -> None:
+        """ Creates a saver, the background thread is started when the first save is requested.
+
+        :param delay: the seconds waited before writing, to coalesce the saves that arrive in the meanwhile
+        :param close_at_exit: whether to flush and stop this saver when the interpreter exits
+        """
+        self.requested = 0
+        self.written = 0
+        self._delay = delay
+        self._pending: Dict[str, _SaveJob] = {}
+        self._writing = False
+        self._errors: List[BaseException] = []
+        self._closed = False
+        self._condition = Condition()
+        self._thread: Optional[Thread] = None
+        if close_at_exit:
+            atexit.register(self.close)
+
+    def save(self,
+             path: str,
+             producer: Callable[[], bytes],
+             lock: Lock = None,
+             on_written: Callable[[bytes], None] = None) -> None:
+        """ Requests to write to the file the content returned by the producer, and returns without waiting.
+
+        If a save of the same file is already pending, it is replaced by this one.
+
+        :param path: the path of the destination file
+        :param producer: a function that returns the content of the file, called in the background thread
+        :param lock: an optional lock that is held while producing and writing the content
+        :param on_written: an optional function called with the content after the file is written
+        :raises RuntimeError: if this saver was closed
+        """
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("The saver was closed.")
+            self._pending[os.path.abspath(path)] = _SaveJob(producer, lock, on_written)
+            self.requested += 1
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name="WriteBehindSaver", daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+
+    def flush(self, timeout: float = None) -> bool:
+        """ Waits until all the requested saves are written.
+
+        :param timeout: the maximum number of seconds to wait, or None to wait without limits
+        :return: true if all the saves were written, false if the timeout expired
+        :raises Exception: the first error raised by a write since the last flush, if any
+        """
+        with self._condition:
+            done = self._condition.wait_for(lambda: not self._pending and not self._writing, timeout)
+            errors, self._errors = self._errors, []
+        if errors:
+            raise errors[0]
+        return done
+
+    def close(self, timeout: float = None) -> bool:
+        """ Writes all the requested saves and stops the background thread, after this no save can be requested.
+
+        :param timeout: the maximum number of seconds to wait, or None to wait without limits
+        :return: true if all the saves were written, false if the timeout expired
+        :raises Exception: the first error raised by a write since the last flush, if any
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        done = self.flush(timeout)
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return done
+
+    def _run(self) -> None:
+        """ The loop of the background thread, that writes the pending saves. """
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending or self._closed)
+                if not self._pending:
+                    return
+                # Give some time to the other saves to arrive and be coalesced.
+                deadline = time.monotonic() + self._delay
+                while not self._closed and time.monotonic() < deadline:
+                    self._condition.wait(deadline - time.monotonic())
+                jobs, self._pending = self._pending, {}
+                self._writing = True
+
+            errors = []
+            for path, job in jobs.items():
+                try:
+                    job.run(path)
+                except Exception as err:
+                    errors.append(err)
+
+            with self._condition:
+                self.written += len(jobs)
+                self._errors.extend(errors)
+                self._writing = False
+                self._condition.notify_all()
+
+
+class _SaveJob(object):
+    """ A save requested to a WriteBehindSaver, see WriteBehindSaver.save().
+
+    :ivar producer: a function that returns the content of the file
+    :ivar lock: an optional lock that is held while producing and writing the content
+    :ivar on_written: an optional function called with the content after the file is written
+    """
+
+    def __init__(self,
+                 producer: Callable[[], bytes],
+                 lock: Optional[Lock],
+                 on_written: Optional[Callable[[bytes], None]]) -> None:
+        self.producer = producer
+        self.lock = lock
+        self.on_written = on_written
+
+    def run(self, path: str) -> None:
+        """ Produces the content and writes it to the file at the provided path. """
+        if self.lock is not None:
+            with self.lock:
+                self._write(path)
+        else:
+            self._write(path)
+
+    def _write(self, path: str) -> None:
+        data = self.producer()
+        atomic_write(path, data)
+        if self.on_written is not None:
+            self.on_written(data)
+
+
+class KbJournal(object):
+    """ Persists a SharedKb by appending the changes of each completed process to a journal file.
+
+    The kb file contains a snapshot of the kb, while the journal file (the kb path followed by ".journal") contains one
+    json line for each commit, with the keys written and deleted. Saving a commit costs only as much as the changed
+    values. When the journal contains compact_every records, a new snapshot is written in the background by a
+    WriteBehindSaver and the records it contains are removed from the journal.
+    When the journal is created, it loads the snapshot and replays the records of the journal.
+
+    Example:
+        my_journal = KbJournal("my_kb.json")
+        my_framework = Framework.from_file("my_process.json", "my_kb.json", {}, callback_getter, nlu,
+                                           journal=my_journal)
+        ...
+        my_journal.close()  # Writes a snapshot and empties the journal.
+
+    :ivar path: the path of the kb file that contains the snapshot
+    :ivar journal_path: the path of the journal file
+    :ivar kb: the SharedKb loaded from the files, that receives the commits
+    :ivar records: the number of records in the journal
+    :ivar _compact_every: the number of records in the journal that cause a compaction
+    :ivar _sync: whether each record is flushed to the disk before returning
+    :ivar _saver: the WriteBehindSaver that writes the snapshots
+    :ivar _file: the journal file, open for appending
+    :ivar _compacting: the size of the journal included in the snapshot being written, or None
+    :ivar _lock: the lock used to keep the journal in the same order as the commits
+    """
+
+    def __init__(self, path: str, compact_every: int = 1000, sync: bool = False, saver: WriteBehindSaver = None) -> None:
+        """ Loads the kb from the snapshot and the journal, and opens the journal for appending.
+
+        :param path: the path of the kb file that contains the snapshot
+        :param compact_every: the number of records in the journal that cause a compaction
+        :param sync: whether each record is flushed to the disk before returning
+        :param saver: the WriteBehindSaver that writes the snapshots, by default a new one is created
+        """
+        self.path = path
+        self.journal_path = path + ".journal"
+        self._compact_every = compact_every
+        self._sync = sync
+        self._saver = saver if saver is not None else WriteBehindSaver(delay=0)
+        self._compacting: Optional[int] = None
+        self._lock = Lock()
+
+        with open(path, "rb") as snapshot_file:
+            data = json.load(snapshot_file)
+        self.records = self._replay(data)
+        self.kb = SharedKb(data)
+        self._file = open(self.journal_path, "ab")
+
+    def record(self, contents: Mapping[str, Any]) -> None:
+        """ Commits the kb of an instance to the shared kb and appends the changes to the journal.
+
+        :param contents: the kb of the instance, usually a KbView of the shared kb
+        """
+        with self._lock:
+            changes, deleted = self.kb.commit(contents)
+            record = {"set": changes, "del": sorted(deleted)}
+            self._file.write(json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n")
+            self._file.flush()
+            if self._sync:
+                os.fsync(self._file.fileno())
+            self.records += 1
+            if self.records >= self._compact_every and self._compacting is None:
+                self._compacting = -1
+                self._saver.save(self.path, self._produce_snapshot, on_written=self._truncate)
+
+    def compact(self) -> None:
+        """ Writes a snapshot of the kb and removes from the journal the records it contains, waiting for the end. """
+        with self._lock:
+            self._compacting = -1
+        self._saver.save(self.path, self._produce_snapshot, on_written=self._truncate)
+        self._saver.flush()
+
+    def close(self) -> None:
+        """ Compacts the journal, then closes it and the saver. No record can be appended after this. """
+        self.compact()
+        self._saver.close()
+        with self._lock:
+            self._file.close()
+
+    def _produce_snapshot(self) -> bytes:
+        """ Returns the content of the snapshot, and remembers the size of the journal at the moment. """
+        with self._lock:
+            self._compacting = self._file.tell()
+            return json.dumps(self.kb.to_dict(), indent=2).encode("utf-8")
+
+    def _truncate(self, _: bytes) -> None:
+        """ Removes from the journal the records that are included in the snapshot just written. """
+        with self._lock:
+            self._file.close()
+            with open(self.journal_path, "rb") as journal_file:
+                journal_file.seek(self._compacting)
+                tail = journal_file.read()
+            atomic_write(self.journal_path, tail)
+            self._file = open(self.journal_path, "ab")
+            self.records = tail.count(b"\n")
+            self._compacting = None
+
+    def _replay(self, data: Dict[str, Any]) -> int:
+        """ Applies to the data the records in the journal, and removes an incomplete last record if it exists.
+
+        :param data: the values loaded from the snapshot, modified in place
+        :return: the number of records in the journal
+        """
+        try:
+            with open(self.journal_path, "rb") as journal_file:
+                journal = journal_file.read()
+        except FileNotFoundError:
+            return 0
+
+        records = 0
+        complete = 0
+        for line in journal.split(b"\n")[:-1]:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if "all" in record:
+                data.clear()
+                data.update(record["all"])
+            else:
+                for key in record["del"]:
+                    data.pop(key, None)
+                data.update(record["set"])
+            records += 1
+            complete += len(line) + 1
+
+        if complete < len(journal):
+            # The last record was not written completely, remove it so that the next records are readable.
+            atomic_write(self.journal_path, journal[:complete])
+        return records
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import time
+from typing import Any, Callable, Dict, Generic, Optional, TypeVar
+
+from mmcc_framework.locks import KeyedLocks
+
+T = TypeVar("T")
+
+
+class FileRegistry(Generic[T]):
+    """ A thread safe cache of objects built from json files, that allows to share them between Framework instances.
+
+    Each file is read and parsed only once, then the same object is returned to every caller. The object is rebuilt
+    only when the content of the file changes: the file is checked at most once every check_interval seconds, using its
+    modification time and size, and in case these changed the content hash is compared with the previous one.
+    The objects returned by this registry are shared and must not be modified.
+
+    Example:
+        my_registry = FileRegistry(Process.from_dict)
+        my_process = my_registry.get("my_process.json")  # Reads and parses the file.
+        my_process = my_registry.get("my_process.json")  # Returns the same object, without reading the file.
+
+    :ivar _factory: a function that builds the object from the parsed json
+    :ivar _check_interval: the number of seconds during which a file is not checked for changes
+    :ivar _entries: a dictionary that maps the absolute path of each file to its _RegistryEntry
+    :ivar _locks: the lock of each file, held when the file is read, so that the files are read in parallel
+    """
+
+    def __init__(self, factory: Callable[[Any], T], check_interval: float = 1.0) -> None:
+        """ Creates an empty registry that builds the objects with the provided factory.
+
+        :param factory: a function that takes the parsed content of a json file and returns the object to cache
+        :param check_interval: the number of seconds during which a file is not checked for changes
+        """
+        self._factory = factory
+        self._check_interval = check_interval
+        self._entries: Dict[str, _RegistryEntry] = {}
+        self._locks = KeyedLocks()
+
+    def get(self, path: str) -> T:
+        """ Returns the object built from the file at the provided path, reading the file only if it changed.
+
+        :param path: the path of a json file
+        :return: the object built from the file, shared with all the other callers
+        :raises OSError: if the file can not be read
+        """
+        key = os.path.abspath(path)
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry.checked < self._check_interval:
+            return entry.value
+
+        with self._locks.hold(key):
+            entry = self._entries.get(key)
+            now = time.monotonic()
+            if entry is not None and now - entry.checked < self._check_interval:
+                return entry.value
+
+            stamp = _stamp(key)
+            if entry is not None and entry.stamp == stamp:
+                entry.checked = now
+                return entry.value
+
+            with open(key, "rb") as file:
+                data = file.read()
+            digest = hashlib.sha256(data).hexdigest()
+            if entry is not None and (entry.digest == digest or digest in entry.expected):
+                # The file was not changed, or was written by the owner of the object, see expect.
+                entry.digest = digest
+                entry.stamp = stamp
+                entry.checked = now
+                return entry.value
+
+            value = self._factory(json.loads(data))
+            self._entries[key] = _RegistryEntry(value, digest, stamp, now)
+            return value
+
+    def expect(self, path: str, data: bytes) -> None:
+        """ Records that the file is going to be written with the provided content by the owner of its object.
+
+        Call this before writing the file, and update after: if the file is checked in the meanwhile, the object in the
+        registry is kept, instead of being rebuilt from the new content. Does nothing if the file is not in the registry.
+
+        :param path: the path of the file that is going to be written
+        :param data: the content that is going to be written
+        """
+        key = os.path.abspath(path)
+        with self._locks.hold(key):
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.expected.add(hashlib.sha256(data).hexdigest())
+
+    def update(self, path: str, data: bytes) -> None:
+        """ Records that the file was written with the provided content by the owner of its object.
+
+        The object in the registry is kept and is considered up to date with the new content, so that it is not rebuilt
+        the next time the file is checked. Does nothing if the file is not in the registry.
+
+        :param path: the path of the file that was written
+        :param data: the content written to the file
+        """
+        key = os.path.abspath(path)
+        with self._locks.hold(key):
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.digest = hashlib.sha256(data).hexdigest()
+                entry.expected.discard(entry.digest)
+                entry.stamp = _stamp(key)
+                entry.checked = time.monotonic()
+
+    def digest(self, path: str) -> Optional[str]:
+        """ Returns the content hash of the file at the provided path when it was last read, or None if it never was.
+        """
+        entry = self._entries.get(os.path.abspath(path))
+        return entry.digest if entry is not None else None
+
+    def invalidate(self, path: str = None) -> None:
+        """ Removes a file from this registry, or all the files if no path is provided.
+
+        :param path: the path of the file to remove, or None to remove all
+        """
+        if path is None:
+            self._entries.clear()
+        else:
+            key = os.path.abspath(path)
+            with self._locks.hold(key):
+                self._entries.pop(key, None)
+
+
+class _RegistryEntry(object):
+    """ An object in a FileRegistry, with the information used to detect changes in its file.
+
+    :ivar value: the object built from the file
+    :ivar digest: the hash of the content of the file
+    :ivar stamp: the modification time and size of the file
+    :ivar checked: the time of the last check on the file
+    :ivar expected: the hashes of the contents that the owner of the object is writing to the file, see expect
+    """
+
+    def __init__(self, value: Any, digest: str, stamp: tuple, checked: float) -> None:
+        self.value = value
+        self.digest = digest
+        self.stamp = stamp
+        self.checked = checked
+        self.expected = set()
+
+
+def _stamp(path: str) -> tuple:
+    """ Returns the modification time and size of the file at the provided path. """
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
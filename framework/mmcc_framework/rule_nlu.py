@@ -0,0 +1,268 @@
+import json
+import re
+from threading import Lock
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from mmcc_framework.nlu_adapters import NluAdapter, RasaNlu
+
+# The annotation of an entity in the rasa training examples: [text](entity), [text](entity:value) or [text]{...}.
+_ANNOTATION = re.compile(r"\[(?P<text>[^\]]+)\](?:\((?P<short>[^)]+)\)|(?P<json>{[^}]*}))")
+_WORD = re.compile(r"\w+")
+
+
+def _normalize(text: str) -> str:
+    # The words of the text in lower case, separated by a space.
+    return " ".join(_WORD.findall(text.casefold()))
+
+
+def read_rasa_nlu(path: str) -> Tuple[Dict[str, List[str]], Dict[str, List[str]], Dict[str, List[str]]]:
+    """ Reads a rasa 2 nlu training data file, this requires PyYAML.
+
+    :param path: the path of the file, for example "data/nlu.yml"
+    :return: the examples of each intent, the synonyms of each value and the values of each lookup table
+    """
+    try:
+        import yaml
+    except ImportError as e:
+        raise ImportError("Reading the rasa files requires PyYAML: pip install mmcc-framework[yaml]") from e
+    with open(path, encoding="utf-8") as file:
+        data = yaml.safe_load(file) or {}
+    examples, synonyms, lookups = {}, {}, {}
+    for item in data.get("nlu") or []:
+        lines = [line.strip()[1:].strip() for line in (item.get("examples") or "").splitlines()
+                 if line.strip().startswith("-")]
+        if "intent" in item:
+            examples.setdefault(item["intent"], []).extend(lines)
+        elif "synonym" in item:
+            synonyms.setdefault(item["synonym"], []).extend(lines)
+        elif "lookup" in item:
+            lookups.setdefault(item["lookup"], []).extend(lines)
+    return examples, synonyms, lookups
+
+
+def plain_text(example: str) -> str:
+    """ Returns the text of a rasa training example without the annotations of the entities. """
+    return _ANNOTATION.sub(lambda annotation: annotation.group("text"), example)
+
+
+class RuleNlu(NluAdapter):
+    """ This adapter parses the utterances in the same process, using the training examples of rasa as rules.
+
+    The examples are compiled into three kinds of rules, tried in order:
+
+    - exact: the utterance is one of the examples, ignoring the case and the punctuation;
+    - template: the utterance is an example with an entity, where the text of the entity is replaced by one to
+      max_entity_words other words: "Ship to [London](address)" also matches "ship to New York";
+    - keyword: the utterance contains the value of an entity that appears in the examples of only one intent, for
+      example "the [grey](preference) ones" makes "grey, please" a state_preference.
+
+    An example that is in more than one intent is never used, and when two templates match the utterance, the keywords
+    are tried instead; the keywords are used only if they all give the same intent. If none of the rules is used, the
+    utterance is parsed by the fallback adapter, for example a RasaNlu, or if there is no fallback the result is
+    `{"intent": ""}`. The results have the same shape of the ones of RasaNlu.
+    The synonyms replace the values of the entities, like the EntitySynonymMapper of rasa, and the values of the lookup
+    tables are used as keywords for the entity with the same name.
+
+    Example:
+        `my_adapter = RuleNlu.from_rasa_file("rasa/data/nlu.yml", fallback=RasaNlu())`
+
+    :ivar fallback: the adapter used when no rule matches, or None
+    :ivar matched: the number of utterances matched by a rule
+    :ivar deferred: the number of utterances that did not match any rule
+    :ivar _exact: the result of each normalized example, or None if the example is in more than one intent
+    :ivar _templates: the regex of each template with its intent and the names of its entities, most specific first
+    :ivar _keywords: the entity and the value of each normalized keyword
+    :ivar _entity_intents: the intent of each entity that appears in only one intent, or None
+    :ivar _synonyms: the value that replaces each normalized synonym
+    :ivar _max_entity_words: the maximum number of words of the entities matched by templates and keywords
+    :ivar _lock: the lock used to update the counters
+    """
+
+    def __init__(self,
+                 examples: Dict[str, List[str]],
+                 synonyms: Optional[Dict[str, List[str]]] = None,
+                 lookups: Optional[Dict[str, List[str]]] = None,
+                 fallback: Optional[NluAdapter] = None,
+                 max_entity_words: int = 3) -> None:
+        """ Compiles the rules from the training examples.
+
+        :param examples: the examples of each intent, with the entities annotated like in rasa: [text](entity)
+        :param synonyms: the synonyms of each value, for example {"grey": ["gray", "silver"]}
+        :param lookups: the values of each entity that are not in the examples, for example {"preference": ["hat"]}
+        :param fallback: the adapter used when no rule matches, or None
+        :param max_entity_words: the maximum number of words of the entities matched by templates and keywords
+        """
+        if max_entity_words < 1:
+            raise ValueError("max_entity_words must be at least 1")
+        self.fallback = fallback
+        self.matched = 0
+        self.deferred = 0
+        self._max_entity_words = max_entity_words
+        self._synonyms = {_normalize(synonym): value
+                          for value, values in (synonyms or {}).items() for synonym in values}
+        self._exact = {}
+        self._keywords = {}
+        self._entity_intents = {}
+        self._lock = Lock()
+        templates = {}
+        for intent, intent_examples in examples.items():
+            for example in intent_examples:
+                self._compile_example(intent, example, templates)
+        for entity, values in (lookups or {}).items():
+            for value in values:
+                self._keywords.setdefault(_normalize(value), (entity, value))
+        # The templates with more literal words are more specific, and are tried first.
+        self._templates = [(regex, intent, entities) for regex, (intent, entities, _) in
+                           sorted(templates.items(), key=lambda item: -item[1][2]) if intent is not None]
+
+    @classmethod
+    def from_rasa_file(cls, path: str, fallback: Optional[NluAdapter] = None, **kwargs) -> 'RuleNlu':
+        """ Compiles the rules from a rasa 2 nlu training data file, this requires PyYAML.
+
+        The intents, the synonyms and the lookup tables are used, the regex features are ignored.
+
+        :param path: the path of the file, for example "data/nlu.yml"
+        :param fallback: the adapter used when no rule matches, or None
+        :param kwargs: the other arguments of the constructor
+        :return: the adapter with the rules of the file
+        """
+        examples, synonyms, lookups = read_rasa_nlu(path)
+        return cls(examples, synonyms, lookups, fallback, **kwargs)
+
+    def parse(self, utterance: str) -> Dict[str, Any]:
+        """ Returns the result of the first rule that matches the utterance, or the result of the fallback.
+
+        :param utterance: the text input from the user
+        :return: a dictionary containing the detected intent and corresponding entities if any exists.
+        """
+        result = self.match(utterance)
+        if result is not None:
+            return result
+        return self.fallback.parse(utterance) if self.fallback is not None else {"intent": ""}
+
+    async def parse_async(self, utterance: str) -> Dict[str, Any]:
+        """ Like parse, only the fallback is awaited. """
+        result = self.match(utterance)
+        if result is not None:
+            return result
+        return await self.fallback.parse_async(utterance) if self.fallback is not None else {"intent": ""}
+
+    def parse_batch(self, utterances: List[str]) -> List[Dict[str, Any]]:
+        """ Like parse for each utterance, the utterances that do not match are parsed together by the fallback. """
+        results = [self.match(utterance) for utterance in utterances]
+        missing = [index for index, result in enumerate(results) if result is None]
+        if missing:
+            if self.fallback is not None:
+                parsed = self.fallback.parse_batch([utterances[index] for index in missing])
+            else:
+                parsed = [{"intent": ""} for _ in missing]
+            for index, result in zip(missing, parsed):
+                results[index] = result
+        return results
+
+    def match(self, utterance: str) -> Optional[Dict[str, Any]]:
+        """ Returns the result of the first rule that matches the utterance, or None if no rule can be used.
+
+        :param utterance: the text input from the user
+        :return: a dictionary like the one of parse, or None
+        """
+        result = self._match(utterance)
+        with self._lock:
+            if result is None:
+                self.deferred += 1
+            else:
+                self.matched += 1
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        """ Returns the number of utterances matched by the rules and of the ones that did not match. """
+        return {"matched": self.matched, "deferred": self.deferred}
+
+    def _match(self, utterance):
+        normalized = _normalize(utterance)
+        if normalized in self._exact:
+            result = self._exact[normalized]
+            return None if result is None else RasaNlu.dict(result[0], result[1])
+
+        found = None
+        for regex, intent, entities in self._templates:
+            match = regex.fullmatch(utterance)
+            if match is None:
+                continue
+            if found is not None:
+                # Two templates match the utterance, the keywords are tried instead.
+                found = None
+                break
+            found = (intent, {entity: self._value(text) for entity, text in zip(entities, match.groups())})
+        if found is not None:
+            return RasaNlu.dict(*found)
+
+        words = normalized.split()
+        values = {}
+        intents = set()
+        for size in range(min(self._max_entity_words, len(words)), 0, -1):
+            for begin in range(len(words) - size + 1):
+                keyword = self._keywords.get(" ".join(words[begin:begin + size]))
+                if keyword is not None and keyword[0] in self._entity_intents:
+                    intents.add(self._entity_intents[keyword[0]])
+                    values.setdefault(keyword[0], keyword[1])
+        if len(intents) == 1 and None not in intents:
+            return RasaNlu.dict(intents.pop(), values)
+        return None
+
+    def _value(self, text):
+        # The value of an entity, after replacing the synonyms.
+        return self._synonyms.get(_normalize(text), text)
+
+    def _compile_example(self, intent, example, templates):
+        # Adds the rules of an example, templates maps each regex to its intent, entities and number of literal words.
+        entities = []
+        parts = []
+        literal_words = 0
+        position = 0
+        for annotation in _ANNOTATION.finditer(example):
+            literal = example[position:annotation.start()]
+            entity, value = self._parse_annotation(annotation)
+            entities.append((entity, value))
+            parts.extend(_WORD.findall(literal))
+            literal_words += len(_WORD.findall(literal))
+            parts.append(None)
+            position = annotation.end()
+            self._keywords.setdefault(_normalize(annotation.group("text")), (entity, value))
+            if self._entity_intents.get(entity, intent) != intent:
+                self._entity_intents[entity] = None
+            else:
+                self._entity_intents[entity] = intent
+        parts.extend(_WORD.findall(example[position:]))
+        literal_words += len(_WORD.findall(example[position:]))
+
+        text = _normalize(_ANNOTATION.sub(lambda a: " " + a.group("text") + " ", example))
+        result = (intent, dict(entities))
+        if text in self._exact and self._exact[text] != result:
+            self._exact[text] = None
+        else:
+            self._exact[text] = result
+
+        if entities and literal_words > 0:
+            pattern = self._template_pattern(parts)
+            names = [entity for entity, _ in entities]
+            previous = templates.get(pattern)
+            if previous is None:
+                templates[pattern] = (intent, names, literal_words)
+            elif previous[:2] != (intent, names):
+                templates[pattern] = (None, names, literal_words)
+
+    def _template_pattern(self, parts: Iterable[Optional[str]]) -> re.Pattern:
+        # The literal words are separated by any punctuation, each entity is a group of one or more words.
+        slot = r"(\w+(?:\s+\w+){0,%d}?)" % (self._max_entity_words - 1)
+        return re.compile(r"\W*" + r"\W*".join(slot if part is None else re.escape(part) for part in parts) + r"\W*",
+                          re.IGNORECASE)
+
+    def _parse_annotation(self, annotation) -> Tuple[str, str]:
+        # The name and the value of an annotated entity.
+        text = annotation.group("text")
+        if annotation.group("json") is not None:
+            description = json.loads(annotation.group("json"))
+            return description["entity"], description.get("value", self._value(text))
+        entity, _, value = annotation.group("short").partition(":")
+        return entity, value or self._value(text)
@@ -0,0 +1,591 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from threading import Lock, RLock
+from typing import Any, AsyncIterator, Callable, Container, Dict, Hashable, Iterator, List, Optional, Set, Tuple
+
+from mmcc_framework.framework import Framework
+from mmcc_framework.locks import KeyedLocks
+from mmcc_framework.persistence import atomic_write
+
+SESSION_OVERHEAD = 1024
+""" The estimated number of bytes used by a Framework in memory, besides its state (see Framework.state_size). """
+
+
+class SessionStore(object):
+    """ Keeps the Framework instances of the sessions of a server, using a bounded amount of memory.
+
+    The most recently used sessions are kept in memory. When there are more than max_sessions sessions in memory, or
+    their estimated size is more than max_bytes, the least recently used ones are evicted: their snapshot is written to
+    a file in spill_dir and they are removed from memory. When an evicted session is requested, it is created again with
+    the factory and restored from its file, transparently for the caller.
+    The size of a session is estimated with the length of its state encoded as json, plus SESSION_OVERHEAD; the process
+    and the shared kb are not included, since they are shared by all the sessions. The estimate is updated when the
+    session is added or restored, and after each input handled with using() (or checkout() and checkin()).
+    The sessions that are not used for some time can be removed with reap(), and the completed ones with release().
+    A session that is handling an input must be obtained with using() (or checkout() and checkin()), so that it is not
+    evicted or reaped while its state changes: the store may temporarily keep more sessions than its budget.
+    The files are read and written without the lock of the store, so the threads that use the sessions in memory do not
+    wait for them; in an event loop use using_async() (or checkout_async() and checkin_async()), that read and write
+    the files in the default executor of the loop.
+
+    Example:
+        my_store = SessionStore(create_framework, "sessions", max_sessions=1000)
+        my_store.put((uid, interaction), create_framework())
+        with my_store.using((uid, interaction)) as my_framework:
+            my_framework.handle_text_input("Hello")
+
+    :ivar hits: the number of sessions found in memory
+    :ivar misses: the number of sessions not found in memory, restored from the disk or not found at all
+    :ivar evictions: the number of sessions moved from memory to the disk
+    :ivar restores: the number of sessions moved from the disk to memory
+    :ivar reaped: the number of sessions removed by reap() and release()
+    :ivar _factory: a function that creates a Framework with the configuration used by the sessions
+    :ivar _spill_dir: the folder that contains the evicted sessions
+    :ivar _max_sessions: the maximum number of sessions in memory
+    :ivar _max_bytes: the maximum estimated size of the sessions in memory, or None
+    :ivar _memory: the sessions in memory, from the least to the most recently used
+    :ivar _spilling: the evicted sessions that are not written to the disk yet
+    :ivar _bytes: the estimated size of the sessions in memory
+    :ivar _completed_on_disk: the paths of the evicted sessions whose process is completed
+    :ivar _files: the lock of each file in spill_dir, held while the file is read, written or removed
+    :ivar _lock: the lock used to access the store, it is acquired after the lock of a file
+    """
+
+    def __init__(self,
+                 factory: Callable[[], Framework],
+                 spill_dir: str,
+                 max_sessions: int = 10000,
+                 max_bytes: Optional[int] = None) -> None:
+        """ Creates an empty store, the spill_dir folder is created if it does not exist.
+
+        :param factory: a function that creates a Framework with the configuration used by the sessions
+        :param spill_dir: the folder that contains the evicted sessions
+        :param max_sessions: the maximum number of sessions in memory
+        :param max_bytes: the maximum estimated size of the sessions in memory, or None for no limit
+        """
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.restores = 0
+        self.reaped = 0
+        self._factory = factory
+        self._spill_dir = spill_dir
+        self._max_sessions = max_sessions
+        self._max_bytes = max_bytes
+        self._memory: "OrderedDict[Hashable, _StoredSession]" = OrderedDict()
+        self._spilling: Dict[Hashable, _StoredSession] = {}
+        self._bytes = 0
+        self._completed_on_disk: Set[str] = set()
+        self._files = KeyedLocks()
+        self._lock = RLock()
+        os.makedirs(spill_dir, exist_ok=True)
+
+    def put(self, key: Hashable, framework: Framework) -> None:
+        """ Adds a session to the store, replacing the one with the same key if it exists.
+
+        :param key: the key of the session, for example a tuple with the user id and the interaction id; it must be
+                    possible to convert it to json
+        :param framework: the Framework of the session
+        """
+        self._write(self._put(key, framework))
+
+    async def put_async(self, key: Hashable, framework: Framework) -> None:
+        """ Like put, but the evicted sessions are written in the default executor of the running event loop. """
+        await self._write_async(self._put(key, framework))
+
+    def get(self, key: Hashable) -> Framework:
+        """ Returns the Framework of a session, restoring it from the disk if it was evicted.
+
+        The session can be evicted as soon as this returns, use using() to handle an input.
+
+        :param key: the key of the session
+        :return: the Framework of the session
+        :raises KeyError: if the session is not in the store
+        """
+        with self._lock:
+            stored = self._find(key)
+        if stored is None:
+            stored = self._restore(key, pin=False)
+        return stored.framework
+
+    def checkout(self, key: Hashable) -> Framework:
+        """ Like get, but the session is not evicted or reaped until checkin is called with the same key.
+
+        :param key: the key of the session
+        :return: the Framework of the session
+        :raises KeyError: if the session is not in the store
+        """
+        with self._lock:
+            stored = self._find(key)
+            if stored is not None:
+                stored.pins += 1
+                return stored.framework
+        return self._restore(key, pin=True).framework
+
+    async def checkout_async(self, key: Hashable) -> Framework:
+        """ Like checkout, but a session that was evicted is restored in the default executor of the running event loop.
+
+        :param key: the key of the session
+        :return: the Framework of the session
+        :raises KeyError: if the session is not in the store
+        """
+        with self._lock:
+            stored = self._find(key)
+            if stored is not None:
+                stored.pins += 1
+                return stored.framework
+        loop = asyncio.get_running_loop()
+        restoring = loop.run_in_executor(None, self._restore, key, True)
+        try:
+            return (await asyncio.shield(restoring)).framework
+        except asyncio.CancelledError:
+            # The restore goes on in its thread, the session is checked in when it is done.
+            restoring.add_done_callback(lambda done: done.exception() is None and self.checkin(key))
+            raise
+
+    def checkin(self, key: Hashable) -> None:
+        """ Allows again to evict a session obtained with checkout, when it is not used anymore.
+
+        :param key: the key of the session
+        """
+        self._write(self._checkin(key))
+
+    async def checkin_async(self, key: Hashable) -> None:
+        """ Like checkin, but the evicted sessions are written in the default executor of the running event loop. """
+        await self._write_async(self._checkin(key))
+
+    @contextmanager
+    def using(self, key: Hashable) -> Iterator[Framework]:
+        """ Returns the Framework of a session in a with statement, the session is not evicted or reaped until the end.
+
+        :param key: the key of the session
+        :raises KeyError: if the session is not in the store
+        """
+        framework = self.checkout(key)
+        try:
+            yield framework
+        finally:
+            self.checkin(key)
+
+    @asynccontextmanager
+    async def using_async(self, key: Hashable) -> AsyncIterator[Framework]:
+        """ Like using, in an async with statement: the files are read and written in the default executor of the
+        running event loop, so that the other coroutines are not blocked.
+
+        Example:
+            async with my_store.using_async((uid, interaction)) as my_framework:
+                await my_framework.handle_text_input_async("Hello")
+
+        :param key: the key of the session
+        :raises KeyError: if the session is not in the store
+        """
+        framework = await self.checkout_async(key)
+        try:
+            yield framework
+        finally:
+            await self.checkin_async(key)
+
+    def discard(self, key: Hashable) -> None:
+        """ Removes a session from the store, from memory and from the disk. Does nothing if it does not exist.
+
+        :param key: the key of the session
+        """
+        path = self._path(key)
+        with self._files.hold(path):
+            with self._lock:
+                self._forget(key)
+            _remove_file(path)
+
+    def release(self, key: Hashable) -> bool:
+        """ Removes a session if its process is completed and it is not in use, for example when its connection closed.
+
+        :param key: the key of the session
+        :return: true if the session was removed
+        """
+        path = self._path(key)
+        with self._files.hold(path):
+            with self._lock:
+                stored = self._memory.get(key, self._spilling.get(key))
+                if stored is not None and stored.pins > 0:
+                    # Another input is still using the session, it is removed later by reap().
+                    return False
+                completed = stored.framework.is_completed() if stored is not None \
+                    else path in self._completed_on_disk
+                if not completed:
+                    return False
+                self._forget(key)
+                self.reaped += 1
+            _remove_file(path)
+        return True
+
+    def reap(self, idle_ttl: float, completed_ttl: float, keep: Container[Hashable] = ()) -> int:
+        """ Removes the sessions that were not used for more than their time to live, from memory and from the disk.
+
+        The sessions whose process is completed use completed_ttl, the others use idle_ttl. The sessions evicted before
+        the store was created are considered not completed.
+
+        :param idle_ttl: the seconds after which a session that is not completed is removed
+        :param completed_ttl: the seconds after which a completed session is removed
+        :param keep: the keys of the sessions that must not be removed, for example because they are connected; the
+                     sessions in use (see checkout) are never removed
+        :return: the number of sessions removed
+        """
+        now = time.time()
+        removed = 0
+        with self._lock:
+            for key, stored in list(self._memory.items()):
+                ttl = completed_ttl if stored.framework.is_completed() else idle_ttl
+                if now - stored.last_used > ttl and key not in keep and stored.pins == 0:
+                    # The sessions in memory have no file.
+                    self._forget(key)
+                    removed += 1
+            completed_on_disk = set(self._completed_on_disk)
+
+        # The folder is scanned without the lock, each file is checked again with its lock before it is removed, since
+        # its session may have been restored (and maybe evicted again) in the meanwhile.
+        kept = {self._path(key) for key in keep}
+        candidates = []
+        for entry in os.scandir(self._spill_dir):
+            if not entry.name.endswith(".mmcc") or entry.path in kept:
+                continue
+            ttl = completed_ttl if entry.path in completed_on_disk else idle_ttl
+            try:
+                if now - entry.stat().st_mtime > ttl:
+                    candidates.append((entry.path, ttl))
+            except FileNotFoundError:
+                pass
+        for path, ttl in candidates:
+            with self._files.hold(path):
+                try:
+                    if now - os.stat(path).st_mtime <= ttl:
+                        continue
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+            with self._lock:
+                self._completed_on_disk.discard(path)
+            removed += 1
+
+        with self._lock:
+            self.reaped += removed
+        return removed
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            if key in self._memory or key in self._spilling:
+                return True
+        return os.path.exists(self._path(key))
+
+    def stats(self) -> Dict[str, Any]:
+        """ Returns a dictionary with the counters of this store and the sessions in memory and on the disk. """
+        disk_sessions = sum(1 for name in os.listdir(self._spill_dir) if name.endswith(".mmcc"))
+        with self._lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "restores": self.restores,
+                    "reaped": self.reaped,
+                    "memory_sessions": len(self._memory),
+                    "memory_bytes": self._bytes,
+                    "disk_sessions": disk_sessions}
+
+    def _put(self, key: Hashable, framework: Framework) -> List[Tuple[Hashable, "_StoredSession"]]:
+        """ Adds a session to memory and removes its file, returns the sessions to write, see _evict. """
+        size = _estimate_size(framework)
+        path = self._path(key)
+        with self._files.hold(path):
+            with self._lock:
+                self._forget(key)
+                self._add(key, framework, size)
+                evicted = self._evict()
+            _remove_file(path)
+        return evicted
+
+    def _checkin(self, key: Hashable) -> List[Tuple[Hashable, "_StoredSession"]]:
+        """ Unpins a session and updates its size, returns the sessions to write, see _evict. """
+        with self._lock:
+            stored = self._memory.get(key)
+        if stored is None:
+            return []
+        # The input just handled may have changed the size of the session, the session is still in use here.
+        size = _estimate_size(stored.framework)
+        with self._lock:
+            if self._memory.get(key) is not stored or stored.pins == 0:
+                return []
+            self._bytes += size - stored.size
+            stored.size = size
+            stored.pins -= 1
+            stored.last_used = time.time()
+            return self._evict()
+
+    def _find(self, key: Hashable) -> Optional["_StoredSession"]:
+        """ Returns a session as the most recently used if it is in memory, or None, must be called with the lock.
+
+        A session that is being written to the disk is taken back to memory.
+        """
+        stored = self._memory.get(key)
+        if stored is None:
+            stored = self._spilling.pop(key, None)
+            if stored is None:
+                return None
+            self._add(key, stored.framework, stored.size, stored)
+        self._memory.move_to_end(key)
+        stored.last_used = time.time()
+        self.hits += 1
+        return stored
+
+    def _restore(self, key: Hashable, pin: bool) -> "_StoredSession":
+        """ Reads a session from the disk and adds it to memory as the most recently used, pinned if pin is true.
+
+        Must be called without the lock: the file is read with its own lock, the lock of the store is held only to
+        update the sessions in memory.
+
+        :raises KeyError: if the session is not in the store
+        """
+        path = self._path(key)
+        with self._files.hold(path):
+            with self._lock:
+                # Another thread may have restored the session while this one waited for the file.
+                stored = self._find(key)
+                if stored is None:
+                    self.misses += 1
+                elif pin:
+                    stored.pins += 1
+            if stored is not None:
+                return stored
+            try:
+                with open(path, "rb") as session_file:
+                    snapshot = session_file.read()
+            except FileNotFoundError:
+                raise KeyError(key) from None
+            framework = self._factory()
+            framework.restore(snapshot)
+            size = _estimate_size(framework)
+            with self._lock:
+                stored = self._add(key, framework, size)
+                if pin:
+                    stored.pins += 1
+                self._completed_on_disk.discard(path)
+                self.restores += 1
+                evicted = self._evict()
+            os.remove(path)
+        self._write(evicted)
+        return stored
+
+    def _add(self,
+             key: Hashable,
+             framework: Framework,
+             size: int,
+             stored: Optional["_StoredSession"] = None) -> "_StoredSession":
+        """ Adds a session to memory as the most recently used, must be called with the lock. """
+        if stored is None:
+            stored = _StoredSession(framework, size)
+        self._memory[key] = stored
+        self._bytes += size
+        return stored
+
+    def _forget(self, key: Hashable) -> None:
+        """ Removes a session from memory and from the sessions to write, must be called with the lock.
+
+        The file of the session, if any, must be removed by the caller holding its lock.
+        """
+        stored = self._memory.pop(key, None)
+        if stored is not None:
+            self._bytes -= stored.size
+        self._spilling.pop(key, None)
+        self._completed_on_disk.discard(self._path(key))
+
+    def _evict(self) -> List[Tuple[Hashable, "_StoredSession"]]:
+        """ Removes the least recently used sessions from memory while over the budget, must be called with the lock.
+
+        The most recently used session and the sessions in use (see checkout) are never evicted. The evicted sessions
+        are kept in _spilling until they are written to the disk with _write, which the caller must call without the
+        lock.
+
+        :return: the keys and the evicted sessions
+        """
+        # The sessions in use are skipped, and put back in their place at the end.
+        skipped = []
+        evicted = []
+        while len(self._memory) > 1 and (len(self._memory) + len(skipped) > self._max_sessions or
+                                         (self._max_bytes is not None and self._bytes > self._max_bytes)):
+            key, stored = self._memory.popitem(last=False)
+            if stored.pins > 0:
+                skipped.append((key, stored))
+                continue
+            self._bytes -= stored.size
+            self._spilling[key] = stored
+            evicted.append((key, stored))
+        for key, stored in reversed(skipped):
+            self._memory[key] = stored
+            self._memory.move_to_end(key, last=False)
+        return evicted
+
+    def _write(self, evicted: List[Tuple[Hashable, "_StoredSession"]]) -> None:
+        """ Writes the evicted sessions to the disk, must be called without the lock.
+
+        The snapshot is taken with the lock, so that the session cannot be taken back and changed meanwhile; the file is
+        written holding only its own lock. A session taken back to memory while its file was written keeps its state in
+        memory, and the file is removed.
+        """
+        for key, stored in evicted:
+            path = self._path(key)
+            with self._files.hold(path):
+                with self._lock:
+                    if self._spilling.get(key) is not stored:
+                        continue
+                    snapshot = stored.framework.snapshot()
+                    completed = stored.framework.is_completed()
+                try:
+                    atomic_write(path, snapshot)
+                    # The modification time of the file is the last time the session was used, see reap().
+                    os.utime(path, (stored.last_used, stored.last_used))
+                except BaseException:
+                    with self._lock:
+                        # The session stays in memory, over the budget, until the next eviction.
+                        if self._spilling.get(key) is stored:
+                            del self._spilling[key]
+                            self._add(key, stored.framework, stored.size, stored)
+                            self._memory.move_to_end(key, last=False)
+                    _remove_file(path)
+                    raise
+                with self._lock:
+                    if self._spilling.get(key) is stored:
+                        del self._spilling[key]
+                        if completed:
+                            self._completed_on_disk.add(path)
+                        self.evictions += 1
+                        continue
+                _remove_file(path)
+
+    async def _write_async(self, evicted: List[Tuple[Hashable, "_StoredSession"]]) -> None:
+        """ Like _write, in the default executor of the running event loop; cancelling this does not stop writing. """
+        if evicted:
+            await asyncio.shield(asyncio.get_running_loop().run_in_executor(None, self._write, evicted))
+
+    def _path(self, key: Hashable) -> str:
+        """ Returns the path of the file that contains the session with the provided key when it is evicted. """
+        name = hashlib.sha256(json.dumps(key).encode("utf-8")).hexdigest()
+        return os.path.join(self._spill_dir, name + ".mmcc")
+
+
+class ResponseLog(object):
+    """ Remembers the last response of each session, to handle the inputs that carry the version the client has seen.
+
+    A client that sends the version of the last response it received can retry an input safely: if the input was
+    already handled, the same response is returned again instead of handling it twice. An input sent with an older
+    version, that is not the retry of the last one, is refused with a conflict. The inputs without version are always
+    handled. Only the responses of the most recently used max_size sessions are kept, a retry of an older one receives a
+    conflict.
+
+    Example:
+        my_log = ResponseLog(max_size=10000)
+        with my_locks.hold(key), my_store.using(key) as my_framework:
+            response, status = my_log.handle(key, my_framework, version, lambda f: f.handle_text_input("Hello"))
+
+    :ivar replayed: the number of retries that received the remembered response
+    :ivar conflicts: the number of inputs refused because the version was old
+    :ivar _max_size: the maximum number of responses remembered
+    :ivar _responses: the last response of each session, from the least to the most recently used
+    :ivar _lock: the lock used to access the responses
+    """
+
+    def __init__(self, max_size: int = 10000) -> None:
+        """ Creates an empty log.
+
+        :param max_size: the maximum number of responses remembered
+        """
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        self.replayed = 0
+        self.conflicts = 0
+        self._max_size = max_size
+        self._responses: OrderedDict = OrderedDict()
+        self._lock = Lock()
+
+    def remember(self, key: Hashable, response: Dict[str, Any]) -> None:
+        """ Remembers the response as the last one of the session, it must contain the version of the session. """
+        with self._lock:
+            self._responses[key] = response
+            self._responses.move_to_end(key)
+            while len(self._responses) > self._max_size:
+                self._responses.popitem(last=False)
+
+    def get(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        """ Returns the last response of the session, or None if it is not remembered. """
+        with self._lock:
+            return self._responses.get(key)
+
+    def handle(self,
+               key: Hashable,
+               framework: Framework,
+               expected: Any,
+               function: Callable[[Framework], Dict[str, Any]]) -> Tuple[Dict[str, Any], int]:
+        """ Handles an input with the function if the session has the expected version, and remembers the response.
+
+        Must be called while no other thread uses the framework, for example holding the lock of the session.
+
+        :param key: the key of the session
+        :param framework: the Framework of the session
+        :param expected: the version of the last response received by the client, or None to always handle the input
+        :param function: a function that handles the input with the framework and returns the response
+        :return: the response with the version of the session, and the http status: 200, 400 if expected is not an
+                 integer, or 409 if the session has changed since the expected version
+        """
+        if expected is not None and (not isinstance(expected, int) or isinstance(expected, bool)):
+            return {"error": "The version must be an integer."}, 400
+        if expected is not None and expected != framework.version:
+            last = self.get(key)
+            if last is not None and expected + 1 == framework.version == last["version"]:
+                with self._lock:
+                    self.replayed += 1
+                return last, 200
+            with self._lock:
+                self.conflicts += 1
+            return {"error": "The interaction has changed, reload it and try again.",
+                    "version": framework.version}, 409
+        response = function(framework)
+        response["version"] = framework.version
+        self.remember(key, response)
+        return response, 200
+
+    def stats(self) -> Dict[str, int]:
+        """ Returns a dictionary with the counters of this log and the number of responses remembered. """
+        with self._lock:
+            return {"replayed": self.replayed, "conflicts": self.conflicts, "responses": len(self._responses)}
+
+
+def _remove_file(path: str) -> None:
+    """ Removes a file, if it exists. """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _estimate_size(framework: Framework) -> int:
+    """ Returns the estimated number of bytes used by the framework in memory. """
+    return framework.state_size() + SESSION_OVERHEAD
+
+
+class _StoredSession(object):
+    """ A session in the memory of a SessionStore.
+
+    :ivar framework: the Framework of the session
+    :ivar size: the estimated size of the session
+    :ivar last_used: the last time the session was added or returned by the store
+    :ivar pins: the number of checkouts without a checkin, the session is not evicted or reaped while it is positive
+    """
+
+    __slots__ = ("framework", "size", "last_used", "pins")
+
+    def __init__(self, framework: Framework, size: int) -> None:
+        self.framework = framework
+        self.size = size
+        self.last_used = time.time()
+        self.pins = 0
@@ -0,0 +1,225 @@
+""" An intent classifier that runs in the same process, this module requires NumPy: pip install mmcc-framework[numpy].
+
+A model can be trained from a rasa nlu file and saved with:
+`python -m mmcc_framework.tfidf_nlu rasa/data/nlu.yml my_model.npz`.
+"""
+import argparse
+import math
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from mmcc_framework.nlu_adapters import NluAdapter
+from mmcc_framework.rule_nlu import plain_text, read_rasa_nlu
+
+_WORD = re.compile(r"\w+")
+_MODEL_VERSION = 1
+_BATCH_CHUNK = 1024
+
+
+def _ngrams(text: str, ngram_range: Tuple[int, int]) -> List[str]:
+    # The character n-grams of each word, padded with a space on both sides, like the char_wb analyzer of rasa.
+    grams = []
+    low, high = ngram_range
+    for word in _WORD.findall(text.casefold()):
+        word = f" {word} "
+        for size in range(low, min(high, len(word)) + 1):
+            grams.extend(word[begin:begin + size] for begin in range(len(word) - size + 1))
+    return grams
+
+
+class TfidfNlu(NluAdapter):
+    """ This adapter classifies the intent of the utterances with a TF-IDF model of the character n-grams.
+
+    Each intent is represented by the normalized mean of the TF-IDF vectors of its examples, and the intent of an
+    utterance is the one with the highest cosine similarity, obtained with one matrix-vector product (one matrix product
+    for a batch). If the similarity is lower than threshold, the utterance is parsed by the fallback adapter, or if there
+    is no fallback the result is `{"intent": ""}`.
+    The entities are not extracted, use this adapter as the fallback of a RuleNlu to obtain the entities of the known
+    sentences.
+
+    Example:
+        `my_adapter = TfidfNlu.train_rasa_file("rasa/data/nlu.yml")`, or
+        `my_adapter = TfidfNlu.load("my_model.npz", fallback=RasaNlu())` to load a model saved with save.
+
+    :ivar intents: the intents that can be recognized
+    :ivar threshold: the minimum similarity of a recognized intent
+    :ivar fallback: the adapter used when the similarity is lower than threshold, or None
+    :ivar ngram_range: the minimum and maximum length of the n-grams
+    :ivar _vocabulary: the column of each n-gram
+    :ivar _idf: the inverse document frequency of each n-gram
+    :ivar _centroids: the normalized vectors of the intents, one for each row
+    """
+
+    def __init__(self,
+                 intents: List[str],
+                 vocabulary: Dict[str, int],
+                 idf: np.ndarray,
+                 centroids: np.ndarray,
+                 ngram_range: Tuple[int, int] = (1, 4),
+                 threshold: float = 0.3,
+                 fallback: Optional[NluAdapter] = None) -> None:
+        """ Initializes this adapter with a trained model, use train or load to obtain one.
+
+        :param intents: the intents that can be recognized
+        :param vocabulary: the column of each n-gram
+        :param idf: the inverse document frequency of each n-gram
+        :param centroids: the normalized vectors of the intents, one for each row
+        :param ngram_range: the minimum and maximum length of the n-grams
+        :param threshold: the minimum similarity of a recognized intent
+        :param fallback: the adapter used when the similarity is lower than threshold, or None
+        """
+        if centroids.shape != (len(intents), len(vocabulary)) or idf.shape != (len(vocabulary),):
+            raise ValueError("The shapes of the model do not match the intents and the vocabulary")
+        self.intents = list(intents)
+        self.threshold = threshold
+        self.fallback = fallback
+        self.ngram_range = (int(ngram_range[0]), int(ngram_range[1]))
+        self._vocabulary = vocabulary
+        self._idf = idf.astype(np.float32)
+        self._centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+
+    @classmethod
+    def train(cls, examples: Dict[str, List[str]], ngram_range: Tuple[int, int] = (1, 4), **kwargs) -> 'TfidfNlu':
+        """ Trains a model from the examples of each intent.
+
+        :param examples: the examples of each intent, the annotations of the entities are removed like in rasa
+        :param ngram_range: the minimum and maximum length of the n-grams
+        :param kwargs: the other arguments of the constructor
+        :return: the adapter with the trained model
+        """
+        intents = [intent for intent, texts in examples.items() if texts]
+        documents = [(row, _ngrams(plain_text(text), ngram_range))
+                     for row, intent in enumerate(intents) for text in examples[intent]]
+        vocabulary = {}
+        for _, grams in documents:
+            for gram in grams:
+                vocabulary.setdefault(gram, len(vocabulary))
+        frequency = np.zeros(len(vocabulary))
+        for _, grams in documents:
+            frequency[[vocabulary[gram] for gram in set(grams)]] += 1
+        idf = (np.log((1 + len(documents)) / (1 + frequency)) + 1).astype(np.float32)
+
+        model = cls(intents, vocabulary, idf, np.zeros((len(intents), len(vocabulary)), np.float32), ngram_range,
+                    **kwargs)
+        vectors = model._vectorize([grams for _, grams in documents])
+        rows = np.array([row for row, _ in documents])
+        centroids = np.zeros((len(intents), len(vocabulary)), np.float32)
+        np.add.at(centroids, rows, vectors)
+        model._centroids = centroids / np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+        return model
+
+    @classmethod
+    def train_rasa_file(cls, path: str, **kwargs) -> 'TfidfNlu':
+        """ Trains a model from the intents of a rasa 2 nlu training data file, this requires PyYAML.
+
+        :param path: the path of the file, for example "data/nlu.yml"
+        :param kwargs: the other arguments of train
+        :return: the adapter with the trained model
+        """
+        return cls.train(read_rasa_nlu(path)[0], **kwargs)
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> 'TfidfNlu':
+        """ Loads a model saved with save.
+
+        :param path: the path of the model file
+        :param kwargs: the other arguments of the constructor, they replace the ones saved in the file
+        :return: the adapter with the loaded model
+        """
+        with np.load(path, allow_pickle=False) as data:
+            if int(data["version"]) != _MODEL_VERSION:
+                raise ValueError(f"Unsupported model version {int(data['version'])} in {path}")
+            arguments = {"ngram_range": tuple(data["ngram_range"]), "threshold": float(data["threshold"])}
+            arguments.update(kwargs)
+            vocabulary = {str(gram): column for column, gram in enumerate(data["vocabulary"])}
+            return cls([str(intent) for intent in data["intents"]], vocabulary, data["idf"], data["centroids"],
+                       **arguments)
+
+    def save(self, path: str) -> None:
+        """ Saves the model in a file that can be loaded with load, the fallback is not saved.
+
+        :param path: the path of the model file, numpy adds the extension .npz if it is missing
+        """
+        vocabulary = sorted(self._vocabulary, key=self._vocabulary.get)
+        np.savez_compressed(path, version=_MODEL_VERSION, intents=np.array(self.intents, dtype=str),
+                            vocabulary=np.array(vocabulary, dtype=str), idf=self._idf, centroids=self._centroids,
+                            ngram_range=np.array(self.ngram_range), threshold=self.threshold)
+
+    def parse(self, utterance: str) -> Dict[str, Any]:
+        """ Returns the intent with the highest similarity, or the result of the fallback if it is lower than threshold.
+
+        :param utterance: the text input from the user
+        :return: a dictionary containing the detected intent
+        """
+        columns = [self._vocabulary[gram] for gram in _ngrams(utterance, self.ngram_range) if gram in self._vocabulary]
+        if columns:
+            columns, counts = np.unique(columns, return_counts=True)
+            weights = (1 + np.log(counts)) * self._idf[columns]
+            scores = self._centroids[:, columns] @ weights
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold * math.sqrt(float(weights @ weights)):
+                return {"intent": self.intents[best]}
+        return self.fallback.parse(utterance) if self.fallback is not None else {"intent": ""}
+
+    def parse_batch(self, utterances: List[str]) -> List[Dict[str, Any]]:
+        """ Like parse for each utterance, the utterances are classified with one matrix product. """
+        intents, scores = self.classify_batch(utterances)
+        results = [{"intent": intent} if score >= self.threshold else None for intent, score in zip(intents, scores)]
+        missing = [index for index, result in enumerate(results) if result is None]
+        if missing:
+            if self.fallback is not None:
+                parsed = self.fallback.parse_batch([utterances[index] for index in missing])
+            else:
+                parsed = [{"intent": ""} for _ in missing]
+            for index, result in zip(missing, parsed):
+                results[index] = result
+        return results
+
+    def classify_batch(self, utterances: List[str]) -> Tuple[List[str], np.ndarray]:
+        """ Returns the intent with the highest similarity for each utterance, and the similarity.
+
+        :param utterances: the text inputs to classify
+        :return: the list of intents and the array of similarities, in the same order of the utterances
+        """
+        best = np.zeros(len(utterances), np.intp)
+        similarities = np.zeros(len(utterances), np.float32)
+        # The dense vectors of a chunk of utterances are kept in memory together.
+        for begin in range(0, len(utterances), _BATCH_CHUNK):
+            chunk = utterances[begin:begin + _BATCH_CHUNK]
+            scores = self._vectorize([_ngrams(utterance, self.ngram_range) for utterance in chunk]) @ self._centroids.T
+            best[begin:begin + len(chunk)] = np.argmax(scores, axis=1)
+            similarities[begin:begin + len(chunk)] = scores[np.arange(len(chunk)), best[begin:begin + len(chunk)]]
+        return [self.intents[index] for index in best], similarities
+
+    def _vectorize(self, documents: List[List[str]]) -> np.ndarray:
+        # The normalized TF-IDF vectors of the n-grams of the documents, one for each row.
+        rows, columns = [], []
+        for row, grams in enumerate(documents):
+            known = [self._vocabulary[gram] for gram in grams if gram in self._vocabulary]
+            rows.extend([row] * len(known))
+            columns.extend(known)
+        counts = np.zeros((len(documents), len(self._vocabulary)), np.float32)
+        np.add.at(counts, (np.array(rows, dtype=np.intp), np.array(columns, dtype=np.intp)), 1)
+        vectors = np.log(counts, out=np.zeros_like(counts), where=counts > 0)
+        vectors[counts > 0] += 1
+        vectors *= self._idf
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Trains a TfidfNlu model from a rasa nlu file and saves it.")
+    parser.add_argument("nlu", help="the rasa nlu training data file, for example data/nlu.yml")
+    parser.add_argument("model", help="the model file to write, for example model.npz")
+    parser.add_argument("--min-ngram", type=int, default=1, help="the minimum length of the n-grams")
+    parser.add_argument("--max-ngram", type=int, default=4, help="the maximum length of the n-grams")
+    parser.add_argument("--threshold", type=float, default=0.3, help="the minimum similarity of a recognized intent")
+    args = parser.parse_args()
+    model = TfidfNlu.train_rasa_file(args.nlu, ngram_range=(args.min_ngram, args.max_ngram), threshold=args.threshold)
+    model.save(args.model)
+    print(f"{len(model.intents)} intents, {len(model._vocabulary)} n-grams saved in {args.model}")
+
+
+if __name__ == "__main__":
+    main()
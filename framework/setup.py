@@ -13,6 +13,10 @@ setuptools.setup(
     long_description_content_type="text/markdown",
     url='https://github.com/giubots/MultimodalChatbotCreator',
     packages=setuptools.find_packages(),
+    extras_require={
+        'yaml': ['PyYAML>=5.1'],
+        'numpy': ['numpy>=1.17'],
+    },
     classifiers=[
         'Development Status :: 3 - Alpha',
         'Intended Audience :: Developers',
@@ -0,0 +1,179 @@
+import asyncio
+import random
+import string
+from unittest import TestCase, mock
+
+from mmcc_framework import entities
+from mmcc_framework.entities import AhoCorasick, BkTree, FuzzyEntityMatcher, KbEntityExtractor, Mention, edit_distance
+from mmcc_framework.kb import SharedKb
+from mmcc_framework.nlu_adapters import NluAdapter
+
+
+class _FixedNlu(NluAdapter):
+    def __init__(self, result) -> None:
+        self.result = result
+
+    def parse(self, utterance):
+        return dict(self.result)
+
+
+class TestAhoCorasick(TestCase):
+    def test_find_all(self):
+        automaton = AhoCorasick([("he", 1), ("she", 2), ("his", 3), ("hers", 4), ("", 5)])
+        self.assertEqual(len(automaton), 4)
+        self.assertEqual(automaton.find_all("ushers"), [(1, 4, 2), (2, 4, 1), (2, 6, 4)])
+        self.assertEqual(automaton.find_all("ahishers"), [(1, 4, 3), (3, 6, 2), (4, 6, 1), (4, 8, 4)])
+        self.assertEqual(automaton.find_all(""), [])
+
+    def test_same_as_naive(self):
+        random.seed(1)
+        words = ["".join(random.choice("abc") for _ in range(random.randint(1, 4))) for _ in range(50)]
+        automaton = AhoCorasick([(word, word) for word in words])
+        text = "".join(random.choice("abc") for _ in range(300))
+        expected = sorted((start, start + len(word), word) for word in set(words) for start in range(len(text))
+                          if text.startswith(word, start))
+        self.assertEqual(sorted(set(automaton.find_all(text))), expected)
+
+
+class TestKbEntityExtractor(TestCase):
+    def setUp(self) -> None:
+        self.kb = SharedKb({"items": ["cap", "baseball cap", "sweatshirt"],
+                            "colors": ["grey", "black"],
+                            "sizes": ["S", "M", "small"],
+                            "other": "not a list"})
+        self.nlu = KbEntityExtractor(_FixedNlu({"intent": "state_preference"}), self.kb,
+                                     {"items": "preference", "colors": "color", "sizes": "size", "missing": "x"})
+
+    def test_find(self):
+        self.assertEqual(self.nlu.find("A Baseball Cap, size S in grey. It's small"),
+                         [Mention(2, 14, "preference", "baseball cap"),
+                          Mention(21, 22, "size", "S"),
+                          Mention(26, 30, "color", "grey"),
+                          Mention(37, 42, "size", "small")])
+        self.assertEqual(self.nlu.find("capsule, greyish, it's"), [], "Only whole words are found")
+
+    def test_parse(self):
+        self.assertEqual(self.nlu.parse("the black cap, size M and the grey"),
+                         {"intent": "state_preference", "preference": "cap", "color": "black", "size": "M"})
+        self.nlu.adapter = _FixedNlu({"intent": "state_preference", "preference": "hat"})
+        self.assertEqual(self.nlu.parse("a cap"), {"intent": "state_preference", "preference": "hat"},
+                         "The entities of the adapter are kept")
+
+    def test_batch_and_async(self):
+        self.assertEqual(self.nlu.parse_batch(["a cap", "nothing"]),
+                         [{"intent": "state_preference", "preference": "cap"}, {"intent": "state_preference"}])
+        self.assertEqual(asyncio.run(self.nlu.parse_async("in black")), {"intent": "state_preference",
+                                                                          "color": "black"})
+
+    def test_kb_changes(self):
+        automaton = self.nlu._automaton()
+        view = self.kb.view()
+        view["last_address"] = "Main street"
+        self.kb.commit(view)
+        self.assertIs(self.nlu._automaton(), automaton, "The automaton is kept if the lists do not change")
+        view["items"] = self.kb["items"] + ["hoodie"]
+        self.kb.commit(view)
+        self.assertEqual(self.nlu.find("a hoodie"), [Mention(2, 8, "preference", "hoodie")])
+        self.assertIsNot(self.nlu._automaton(), automaton)
+
+    def test_kb_getter(self):
+        kbs = [{"items": ["cap"]}]
+        nlu = KbEntityExtractor(_FixedNlu({"intent": ""}), lambda: kbs[0], {"items": "preference"})
+        self.assertEqual(nlu.parse("cap"), {"intent": "", "preference": "cap"})
+        kbs[0] = {"items": ["hat"]}
+        self.assertEqual(nlu.parse("cap or hat"), {"intent": "", "preference": "hat"})
+
+    def test_large_catalog(self):
+        items = [f"sku {index:05d}" for index in range(30000)]
+        nlu = KbEntityExtractor(_FixedNlu({"intent": ""}), {"items": items}, {"items": "preference"})
+        self.assertEqual(nlu.parse("I want SKU 12345 and sku 00001"), {"intent": "", "preference": "sku 12345"})
+        self.assertEqual(len(nlu.find("I want SKU 12345 and sku 00001")), 2)
+
+
+class TestBkTree(TestCase):
+    @staticmethod
+    def naive_distance(first, second):
+        previous = list(range(len(second) + 1))
+        for row, char in enumerate(first, 1):
+            current = [row]
+            for column, other in enumerate(second, 1):
+                current.append(min(previous[column] + 1, current[column - 1] + 1,
+                                   previous[column - 1] + (char != other)))
+            previous = current
+        return previous[-1]
+
+    def test_edit_distance(self):
+        self.assertEqual(edit_distance("kitten", "sitting"), 3)
+        self.assertEqual(edit_distance("", "abc"), 3)
+        self.assertEqual(edit_distance("abc", "abc"), 0)
+        random.seed(2)
+        for _ in range(500):
+            first = "".join(random.choice("abc") for _ in range(random.randint(0, 70)))
+            second = "".join(random.choice("abc") for _ in range(random.randint(0, 20)))
+            self.assertEqual(edit_distance(first, second), self.naive_distance(first, second), (first, second))
+
+    def test_search(self):
+        random.seed(4)
+        words = list({"".join(random.choice(string.ascii_lowercase[:6]) for _ in range(random.randint(3, 8)))
+                      for _ in range(3000)})
+        tree = BkTree([(word, index) for index, word in enumerate(words)])
+        tree.add(words[0], "again")
+        self.assertEqual(len(tree), len(words))
+        for query in ["abcde", "fff", words[10] + "a"]:
+            expected = sorted((edit_distance(query, word), word) for word in words if edit_distance(query, word) <= 1)
+            self.assertEqual([result[:2] for result in tree.search(query, 1)], expected)
+        self.assertEqual(tree.search(words[0], 0), [(0, words[0], [0, "again"])])
+        self.assertEqual(BkTree().search("a", 3), [])
+
+    def test_search_sub_linear(self):
+        random.seed(5)
+        words = list({"".join(random.choice(string.ascii_lowercase) for _ in range(random.randint(5, 12)))
+                      for _ in range(5000)})
+        tree = BkTree([(word, word) for word in words])
+        with mock.patch.object(entities, "edit_distance", wraps=edit_distance) as counter:
+            self.assertEqual(tree.search(words[7][:-1], 1)[0][1], words[7])
+        self.assertLess(counter.call_count, len(words) / 3, "Only a part of the tree is visited")
+
+
+class TestFuzzyEntityMatcher(TestCase):
+    def setUp(self) -> None:
+        self.kb = SharedKb({"items": ["Sweatshirt", "cap", "skateboard"],
+                            "colors": ["grey", "gray", "black", "violet"],
+                            "sizes": ["S", "M"]})
+        self.inner = _FixedNlu({})
+        self.nlu = FuzzyEntityMatcher(self.inner, self.kb, {"items": "preference", "colors": "preference",
+                                                            "sizes": "preference"})
+
+    def parse(self, value):
+        self.inner.result = {"intent": "state_preference", "preference": value}
+        return self.nlu.parse("")["preference"]
+
+    def test_correct(self):
+        self.assertEqual(self.parse("swetshirt"), "Sweatshirt")
+        self.assertEqual(self.parse("SKATEBORD"), "skateboard")
+        self.assertEqual(self.parse("s"), "S", "The case is corrected")
+        self.assertEqual(self.parse("violett"), "violet")
+        self.assertEqual(self.nlu.corrected, 4)
+
+    def test_not_correct(self):
+        self.assertEqual(self.parse("cop"), "cop", "The short values are not replaced")
+        self.assertEqual(self.parse("xyzzy"), "xyzzy")
+        self.assertEqual(self.parse("grxy"), "grxy", "Two values are equally close")
+        self.inner.result = {"intent": "state_preference"}
+        self.assertEqual(self.nlu.parse(""), {"intent": "state_preference"})
+
+    def test_kb_changes(self):
+        trees = self.nlu._index.get()
+        view = self.kb.view()
+        view["last_address"] = "Main street"
+        self.kb.commit(view)
+        self.assertIs(self.nlu._index.get(), trees, "The trees are kept if the lists do not change")
+        view["items"] = self.kb["items"] + ["hoodie"]
+        self.kb.commit(view)
+        self.assertEqual(self.parse("hoddie"), "hoodie")
+
+    def test_batch_and_async(self):
+        self.inner.result = {"preference": "blakc"}
+        self.assertEqual(self.nlu.parse_batch(["", ""]), [{"preference": "black"}] * 2)
+        self.assertEqual(asyncio.run(self.nlu.parse_async("")), {"preference": "black"})
+        self.assertEqual(self.inner.result, {"preference": "blakc"}, "The result of the adapter is not modified")
@@ -1,6 +1,8 @@
+import asyncio
 from unittest import TestCase
 
 from mmcc_framework.framework import *
+from mmcc_framework.kb import KbView, SharedKb
 from mmcc_framework.nlu_adapters import NoNluAdapter
 
 
@@ -156,6 +158,33 @@ class TestFrameworkBehaviourPAR(TestCase):
             self.assertEqual(self.my_framework._ctx[CTX_COMPLETED], step[2], f"Step index when test failed: {index}")
 
 
+class TestFrameworkBehaviourWidePAR(TestCase):
+    @staticmethod
+    def callback_getter(_):
+        return lambda d, k, c: Response(k, c, True, choice=d["choice"] if "choice" in d else "")
+
+    def setUp(self) -> None:
+        self.branches = [f"task{i}" for i in range(70)]
+        self.my_framework = Framework(
+            Process(first_activity_id="start",
+                    activities=[Activity("start", "gateway", ActivityType.START),
+                                Activity("gateway", "end", ActivityType.PARALLEL, self.branches),
+                                *[Activity(b, None, ActivityType.TASK) for b in self.branches],
+                                Activity("end", None, ActivityType.END)]),
+            {}, {}, self.callback_getter, NoNluAdapter([]), lambda k: None)
+
+    def test_completed(self):
+        self.my_framework.handle_data_input({})
+        for index, branch in enumerate(reversed(self.branches)):
+            self.assertEqual(self.my_framework._ctx[CTX_COMPLETED], [], f"Not completed at index {index}")
+            self.my_framework.handle_data_input({"choice": branch})
+            self.my_framework.handle_data_input({})
+        self.assertEqual(self.my_framework._ctx[CTX_COMPLETED], ["gateway"], "Completed when all are chosen")
+        self.my_framework.handle_data_input({"choice": None})
+        self.assertEqual(self.my_framework._ctx[CTX_COMPLETED], [], "Cleared when the gateway is exited")
+        self.assertEqual(self.my_framework._current.id, "end")
+
+
 class TestFrameworkBehaviourXOR(TestCase):
     @staticmethod
     def callback_getter(_):
@@ -237,6 +266,80 @@ class TestFrameworkBehaviourXOR(TestCase):
                                                                      f"expected: {step[1]}")
             self.assertEqual(self.my_framework._ctx[CTX_COMPLETED], step[2], f"Step index when test failed: {index}")
 
+    def test_invalid_choice(self):
+        self.my_framework.handle_data_input({"data": "value"})
+        with self.assertRaises(CallbackException, msg="Raise if the choice is not one of the gateway choices"):
+            self.my_framework.handle_data_input({"choice": "C"})
+        self.assertEqual(self.my_framework._current.id, "gateway", "The state is not changed by an invalid choice")
+        self.assertEqual(len(self.my_framework._stack), 0, "The stack is not changed by an invalid choice")
+
+
+class TestFrameworkAsync(TestCase):
+    @staticmethod
+    def callback_getter(activity_id):
+        async def coroutine_callback(d, k, c):
+            await asyncio.sleep(0)
+            return Response(k, c, True, choice=d["choice"] if "choice" in d else "")
+
+        if activity_id in ["gateway", "A"]:
+            return coroutine_callback
+        return lambda d, k, c: Response(k, c, True, choice=d["choice"] if "choice" in d else "")
+
+    def setUp(self) -> None:
+        self.my_framework = Framework(
+            Process(first_activity_id="start",
+                    activities=[Activity("start", "gateway", ActivityType.START),
+                                Activity("gateway", "end", ActivityType.XOR, ["A", "B"]),
+                                Activity("A", None, ActivityType.TASK),
+                                Activity("B", None, ActivityType.TASK),
+                                Activity("end", None, ActivityType.END)]),
+            {"my_key": "a value"},
+            {},
+            self.callback_getter,
+            NoNluAdapter(["choice"]),
+            lambda k: None)
+
+    def test_path(self):
+        async def run():
+            first = await self.my_framework.handle_data_input_async({"data": "value"})
+            second = await self.my_framework.handle_text_input_async("A ")
+            third = await self.my_framework.handle_data_input_async({"data": "value"})
+            return first, second, third
+
+        first, second, third = asyncio.run(run())
+        self.assertEqual(self.my_framework._current.id, "end")
+        self.assertEqual(self.my_framework.version, 3)
+        self.assertEqual(self.my_framework._ctx[CTX_COMPLETED], [])
+        self.assertEqual(third, Response({}, {}, True).to_dict())
+
+    def test_same_as_sync(self):
+        sync_framework = Framework(self.my_framework._process, {"my_key": "a value"}, {},
+                                   lambda _: lambda d, k, c: Response(k, c, True, choice=d.get("choice", "")),
+                                   NoNluAdapter(["choice"]), lambda k: None)
+        inputs = [{"data": "value"}, {"choice": "B"}, {"data": "value"}]
+        expected = [sync_framework.handle_data_input(data) for data in inputs]
+
+        async def run():
+            return [await self.my_framework.handle_data_input_async(data) for data in inputs]
+
+        self.assertEqual(asyncio.run(run()), expected)
+
+    def test_invalid_choice(self):
+        asyncio.run(self.my_framework.handle_data_input_async({"data": "value"}))
+        with self.assertRaises(CallbackException):
+            asyncio.run(self.my_framework.handle_data_input_async({"choice": "C"}))
+        self.assertEqual(self.my_framework._current.id, "gateway")
+
+    def test_coroutine_callback_sync(self):
+        self.my_framework.handle_data_input({"data": "value"})
+        with self.assertRaises(CallbackException, msg="Coroutine callbacks require the async methods") as raised:
+            self.my_framework.handle_data_input({"choice": "A"})
+        self.assertEqual(raised.exception.cause, "gateway")
+        self.assertEqual(self.my_framework.version, 1, "The input that was not handled does not change the version")
+
+    def test_nlu_parse_async(self):
+        self.assertEqual(asyncio.run(NoNluAdapter(["a"]).parse_async("text")), {"a": "text"})
+
 
 class TestFramework(TestCase):
     @staticmethod
@@ -319,6 +422,85 @@ class TestFramework(TestCase):
         self.assertEqual(my_framework._on_save, self.my_save)
 
 
+class TestFrameworkSnapshot(TestCase):
+    @staticmethod
+    def callback_getter(_):
+        def callback(d, k, c):
+            if "key" in d:
+                k[d["key"]] = d["value"]
+            return Response(k, c, True, choice=d["choice"] if "choice" in d else "")
+
+        return callback
+
+    @staticmethod
+    def process():
+        return Process(first_activity_id="start",
+                       activities=[Activity("start", "gateway", ActivityType.START),
+                                   Activity("gateway", "end", ActivityType.PARALLEL, ["xor", "C"]),
+                                   Activity("xor", None, ActivityType.XOR, ["A", "B"]),
+                                   Activity("A", None, ActivityType.TASK),
+                                   Activity("B", None, ActivityType.TASK),
+                                   Activity("C", None, ActivityType.TASK),
+                                   Activity("end", None, ActivityType.END)])
+
+    def create(self, kb):
+        return Framework(self.process(), kb, {"ctx_key": "ctx value"}, self.callback_getter, NoNluAdapter([]),
+                         lambda k: None)
+
+    def test_snapshot_restore(self):
+        first = self.create({"my_key": "a value"})
+        for data in [{}, {"choice": "C"}, {"key": "new", "value": 1}, {"choice": "xor"}]:
+            first.handle_data_input(data)
+        my_snapshot = first.snapshot()
+        self.assertIsInstance(my_snapshot, bytes)
+
+        second = self.create({})
+        second.restore(my_snapshot)
+        self.assertEqual(second._current.id, "xor", "The current activity is restored")
+        self.assertEqual(list(second._stack), list(first._stack), "The stack is restored")
+        self.assertEqual(second._ctx, first._ctx, "The context is restored")
+        self.assertEqual(second._kb, {"my_key": "a value", "new": 1}, "The kb is restored")
+
+        for data in [{"choice": "A"}, {}, {"choice": None}]:
+            self.assertEqual(first.handle_data_input(data), second.handle_data_input(data))
+        self.assertEqual(second._current.id, "end", "The restored instance continues the process")
+
+    def test_snapshot_shared_kb(self):
+        my_kb = SharedKb({"my_key": "a value", "other": 2})
+        first = self.create(my_kb.view())
+        first.handle_data_input({})
+        first.handle_data_input({"choice": "C"})
+        first.handle_data_input({"key": "new", "value": 1})
+
+        second = self.create(my_kb.view())
+        second.restore(first.snapshot())
+        self.assertIsInstance(second._kb, KbView, "The kb is still a view")
+        self.assertEqual(second._kb.changes(), ({"new": 1}, set()), "Only the changes are restored")
+        self.assertEqual(dict(second._kb), {"my_key": "a value", "other": 2, "new": 1})
+
+    def test_version(self):
+        first = self.create({})
+        self.assertEqual(first.version, 0)
+        for data in [{}, {"choice": "C"}]:
+            first.handle_data_input(data)
+        self.assertEqual(first.version, 2, "The version changes after each input")
+
+        second = self.create({})
+        second.restore(first.snapshot())
+        self.assertEqual(second.version, 2, "The version is restored")
+        second.handle_data_input({"key": "new", "value": 1})
+        self.assertEqual(second.version, 3)
+
+    def test_restore_wrong(self):
+        my_framework = self.create({})
+        with self.assertRaises(ValueError, msg="Raise if the bytes are not a snapshot"):
+            my_framework.restore(b"not a snapshot")
+        other = Framework(Process([Activity("one", None, ActivityType.START)], "one"), {}, {},
+                          self.callback_getter, NoNluAdapter([]), lambda k: None)
+        with self.assertRaises(DescriptionException, msg="Raise if the process is different"):
+            my_framework.restore(other.snapshot())
+
+
 class TestResponse(TestCase):
     def setUp(self) -> None:
         self.my_kb = {"key": "value", "key2": "value2"}
@@ -443,6 +625,34 @@ class TestProcess(TestCase):
                 {"activities": [{"my_id": "one", "next_id": "two", "my_type": "task"}], "first_activity_id": "one",
                  "other": True})
 
+    def test_get(self):
+        my_activities = [Activity("one", "two", ActivityType.TASK),
+                         Activity("two", None, ActivityType.OR, choices=["one"])]
+        my_process = Process(my_activities, "one")
+        self.assertEqual(my_process.get("two"), my_activities[1], "The activity is found by id")
+        with self.assertRaises(DescriptionException, msg="Raise if the id has no corresponding activity"):
+            my_process.get("three")
+
+    def test_next_of_and_choice_of(self):
+        my_activities = [Activity("one", "two", ActivityType.TASK),
+                         Activity("two", None, ActivityType.OR, choices=["one"])]
+        my_process = Process(my_activities, "one")
+        self.assertIs(my_process.next_of(my_activities[0]), my_activities[1], "The next activity is resolved")
+        self.assertIsNone(my_process.next_of(my_activities[1]), "A None next id is resolved to None")
+        self.assertIs(my_process.choice_of(my_activities[1], "one"), my_activities[0], "The choice is resolved")
+        self.assertIsNone(my_process.choice_of(my_activities[1], "two"), "A wrong choice is resolved to None")
+        self.assertIsNone(my_process.choice_of(my_activities[0], "two"), "A task has no choices")
+
+    def test_choice_bits(self):
+        gateway = Activity("gateway", None, ActivityType.PARALLEL, ["A", "B", "C"])
+        my_process = Process([gateway,
+                              Activity("A", None, ActivityType.TASK),
+                              Activity("B", None, ActivityType.TASK),
+                              Activity("C", None, ActivityType.TASK)], "gateway")
+        self.assertEqual([my_process.choice_bit(gateway, c) for c in gateway.choices], [1, 2, 4], "A bit per choice")
+        self.assertEqual(my_process.choices_mask(gateway), 7, "The mask has the bits of all the choices")
+        self.assertEqual(my_process.choices_in(gateway, 5), ["A", "C"], "The choices are found from the mask")
+
     def test_check_first_with_more_correspondences(self):
         with self.assertRaises(DescriptionException, msg="Raise if first activity id has more correspondences"):
             Process([Activity("one", None, ActivityType.TASK),
@@ -482,6 +692,39 @@ class TestProcess(TestCase):
             Process([Activity("one", None, ActivityType.OR, ["two", "two"]),
                      Activity("two", None, ActivityType.TASK)], "one")
 
+    def test_reachability(self):
+        my_process = Process([Activity("start", "gateway", ActivityType.START),
+                              Activity("gateway", "end", ActivityType.PARALLEL, ["xor", "C"]),
+                              Activity("xor", None, ActivityType.XOR, ["A", "B"]),
+                              Activity("A", None, ActivityType.TASK),
+                              Activity("B", None, ActivityType.TASK),
+                              Activity("C", None, ActivityType.TASK),
+                              Activity("end", None, ActivityType.END)], "start")
+        report = my_process.analyze_reachability()
+        self.assertEqual(report.orphans, [], "All the activities are reachable")
+        self.assertEqual(report.dead_gateways, [], "All the gateways lead to an END")
+        self.assertTrue(report.is_clean())
+
+    def test_reachability_with_problems(self):
+        my_process = Process([Activity("start", "gateway", ActivityType.START),
+                              Activity("gateway", None, ActivityType.OR, ["A", "B"]),
+                              Activity("A", None, ActivityType.TASK),
+                              Activity("B", None, ActivityType.TASK),
+                              Activity("orphan", "end", ActivityType.TASK),
+                              Activity("end", None, ActivityType.END)], "start")
+        report = my_process.analyze_reachability()
+        self.assertEqual(report.orphans, ["orphan", "end"], "The activities that can not be reached are found")
+        self.assertEqual(report.dead_gateways, ["gateway"], "The gateways that do not lead to an END are found")
+        self.assertFalse(report.is_clean())
+
+    def test_reachability_nested_xor(self):
+        my_process = Process([Activity("start", "outer", ActivityType.START),
+                              Activity("outer", "end", ActivityType.XOR, ["inner"]),
+                              Activity("inner", None, ActivityType.XOR, ["A"]),
+                              Activity("A", None, ActivityType.TASK),
+                              Activity("end", None, ActivityType.END)], "start")
+        self.assertTrue(my_process.analyze_reachability().is_clean(), "A nested XOR resumes after the outer XOR")
+
 
 class TestActivity(TestCase):
     def setUp(self) -> None:
@@ -0,0 +1,133 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from mmcc_framework.framework import *
+from mmcc_framework.kb import KbView, SharedKb
+from mmcc_framework.nlu_adapters import NoNluAdapter
+from mmcc_framework.registry import FileRegistry
+
+
+class TestSharedKb(TestCase):
+    def setUp(self) -> None:
+        self.my_kb = SharedKb({"items": ["cap"], "address": "Old street", "other": 1})
+
+    def test_view_reads_shared(self):
+        my_view = self.my_kb.view()
+        self.assertIs(my_view["items"], self.my_kb["items"], "The values are not copied")
+        self.assertIn("address", my_view)
+        self.assertEqual(len(my_view), 3)
+        self.assertEqual(dict(my_view), {"items": ["cap"], "address": "Old street", "other": 1})
+
+    def test_view_writes_private(self):
+        first = self.my_kb.view()
+        second = self.my_kb.view()
+        first["address"] = "New street"
+        first["new"] = True
+        del first["other"]
+        self.assertEqual(first["address"], "New street", "The view reads its own changes")
+        self.assertNotIn("other", first, "The deleted key is not in the view")
+        self.assertEqual(sorted(first), ["address", "items", "new"])
+        self.assertEqual(second["address"], "Old street", "The other views do not see the changes")
+        self.assertIn("other", second)
+        self.assertEqual(first.changes(), ({"address": "New street", "new": True}, {"other"}))
+        with self.assertRaises(KeyError):
+            del first["missing"]
+
+    def test_commit(self):
+        first = self.my_kb.view()
+        second = self.my_kb.view()
+        first["address"] = "New street"
+        del first["other"]
+        self.my_kb.commit(first)
+        self.assertEqual(self.my_kb.version, 1, "The version is incremented")
+        self.assertEqual(first.changes(), ({}, set()), "The changes of the view are cleared")
+        self.assertEqual(second["address"], "New street", "The other views see the committed changes")
+        self.assertNotIn("other", second)
+        self.assertEqual(self.my_kb.to_dict(), {"items": ["cap"], "address": "New street"})
+
+    def test_commit_dict(self):
+        items = self.my_kb["items"]
+        changes = self.my_kb.commit({"items": items, "address": "New street", "new": True})
+        self.assertEqual(changes, ({"address": "New street", "new": True}, {"other"}), "Only the differences are applied")
+        self.assertEqual(self.my_kb.to_dict(), {"items": ["cap"], "address": "New street", "new": True})
+        self.assertIs(self.my_kb["items"], items)
+
+    def test_assign(self):
+        my_view = self.my_kb.view()
+        my_view.assign({"items": ["cap"], "address": "New street", "new": True})
+        self.assertEqual(my_view.changes(), ({"address": "New street", "new": True}, {"other"}))
+
+    def test_view_with_changes(self):
+        my_view = self.my_kb.view({"address": "New street"}, ["other"])
+        self.assertIsInstance(my_view, KbView)
+        self.assertEqual(dict(my_view), {"items": ["cap"], "address": "New street"})
+
+
+class TestFrameworkSharedKb(TestCase):
+    @staticmethod
+    def callback_getter(_):
+        def callback(d, k, c):
+            k["address"] = d["address"]
+            return Response(k, c, True)
+
+        return callback
+
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.process_path = os.path.join(self.dir.name, "my_process.json")
+        self.kb_path = os.path.join(self.dir.name, "my_kb.json")
+        with open(self.process_path, "w") as file:
+            json.dump({"activities": [{"my_id": "start", "next_id": "end", "my_type": "start"},
+                                      {"my_id": "end", "next_id": None, "my_type": "end"}],
+                       "first_activity_id": "start"}, file)
+        with open(self.kb_path, "w") as file:
+            json.dump({"address": "Old street", "items": ["cap"]}, file)
+        self.my_registry = FileRegistry(SharedKb, check_interval=0)
+
+    def tearDown(self) -> None:
+        PROCESS_REGISTRY.invalidate(self.process_path)
+        self.dir.cleanup()
+
+    def create(self):
+        return Framework.from_file(self.process_path, self.kb_path, {}, self.callback_getter, NoNluAdapter([]),
+                                   kb_registry=self.my_registry)
+
+    def test_save(self):
+        first = self.create()
+        second = self.create()
+        self.assertIs(first._kb._shared, second._kb._shared, "The instances share the same kb")
+
+        first.handle_data_input({"address": "New street"})
+        with open(self.kb_path) as file:
+            self.assertEqual(json.load(file), {"address": "New street", "items": ["cap"]}, "The kb is saved")
+        self.assertEqual(second._kb["address"], "New street", "The other instances see the saved changes")
+        self.assertIs(self.create()._kb._shared, first._kb._shared, "The saved kb is not loaded again")
+
+    def test_callback_returns_dict(self):
+        def callback_getter(_):
+            def callback(d, k, c):
+                # A new dictionary, with the values of the kb at the beginning of the turn.
+                return Response(dict(k, address=d["address"]), c, True)
+
+            return callback
+
+        with open(self.process_path, "w") as file:
+            json.dump({"activities": [{"my_id": "start", "next_id": "task", "my_type": "start"},
+                                      {"my_id": "task", "next_id": "end", "my_type": "task"},
+                                      {"my_id": "end", "next_id": None, "my_type": "end"}],
+                       "first_activity_id": "start"}, file)
+        first = Framework.from_file(self.process_path, self.kb_path, {}, callback_getter, NoNluAdapter([]),
+                                    kb_registry=self.my_registry)
+        first.handle_data_input({"address": "New street"})
+        self.assertIsInstance(first._kb, KbView, "The kb is still a view of the shared kb")
+        self.assertEqual(first._kb.changes(), ({"address": "New street"}, set()), "Only the differences are written")
+
+        second = self.create()
+        second._kb["items"] = ["hat"]
+        second._on_save(second._kb)
+        first.handle_data_input({"address": "Last street"})
+        with open(self.kb_path) as file:
+            self.assertEqual(json.load(file), {"address": "Last street", "items": ["hat"]},
+                             "The changes committed by the other instances are kept")
@@ -0,0 +1,255 @@
+import asyncio
+import gc
+import json
+import os
+import tempfile
+import time
+from threading import Thread
+from unittest import TestCase
+
+from mmcc_framework.framework import *
+from mmcc_framework.framework import FILE_LOCKS
+from mmcc_framework.locks import KeyedLocks, SerialExecutor
+from mmcc_framework.nlu_adapters import NoNluAdapter
+from mmcc_framework.registry import FileRegistry
+
+
+class _Counter(object):
+    """ The callbacks of a session that counts its turns, and detects the turns that overlap. """
+
+    def __init__(self, pause):
+        self.pause = pause
+        self.running = set()
+        self.overlaps = 0
+        self.max_running = 0
+
+    def enter(self, ctx):
+        key = ctx["key"]
+        if key in self.running:
+            self.overlaps += 1
+        self.running.add(key)
+        self.max_running = max(self.max_running, len(self.running))
+        return ctx.get("count", 0)
+
+    def leave(self, ctx, count):
+        self.running.discard(ctx["key"])
+        ctx["count"] = count + 1
+        return Response({}, ctx, False, payload={"count": count + 1})
+
+    async def async_callback(self, data, kb, ctx):
+        count = self.enter(ctx)
+        await asyncio.sleep(0)
+        return self.leave(ctx, count)
+
+    def sync_callback(self, data, kb, ctx):
+        count = self.enter(ctx)
+        time.sleep(self.pause)
+        return self.leave(ctx, count)
+
+
+def _framework(key, callback):
+    return Framework(Process([Activity("start", "count", ActivityType.START),
+                              Activity("count", "end", ActivityType.TASK),
+                              Activity("end", None, ActivityType.END)], "start"),
+                     {}, {"key": key}, lambda a: callback if a == "count" else lambda d, k, c: Response(k, c, True),
+                     NoNluAdapter([]), lambda k: None)
+
+
+class TestSerialExecutor(TestCase):
+    def test_stress(self):
+        counter = _Counter(0)
+        sessions = {key: _framework(key, counter.async_callback) for key in range(5)}
+        for framework in sessions.values():
+            framework.handle_data_input({})  # Leave the start activity.
+        my_executor = SerialExecutor()
+
+        async def connection(key):
+            turns = [my_executor.submit(key, sessions[key].handle_data_input_async, {}) for _ in range(50)]
+            return [result["payload"]["count"] for result in await asyncio.gather(*turns)]
+
+        async def run():
+            # Three connections for each session, all sending their turns at the same time.
+            return await asyncio.gather(*(connection(key) for key in sessions for _ in range(3)))
+
+        results = asyncio.run(run())
+        self.assertEqual(counter.overlaps, 0, "The turns of a session never overlap")
+        self.assertGreater(counter.max_running, 1, "The turns of different sessions run concurrently")
+        for framework in sessions.values():
+            self.assertEqual(framework._ctx["count"], 150, "No turn is lost")
+        for counts in results:
+            self.assertEqual(counts, sorted(counts), "The turns of a connection run in order")
+        self.assertEqual(my_executor.stats(), {"submitted": 750, "completed": 750, "failed": 0, "max_queued": 150,
+                                               "active_keys": 0})
+
+    def test_without_executor(self):
+        # The counter detects the turns that overlap when they are not serialized.
+        counter = _Counter(0)
+        framework = _framework("key", counter.async_callback)
+        framework.handle_data_input({})
+
+        async def run():
+            await asyncio.gather(*(framework.handle_data_input_async({}) for _ in range(10)))
+
+        asyncio.run(run())
+        self.assertGreater(counter.overlaps, 0)
+        self.assertLess(framework._ctx["count"], 10)
+
+    def test_errors_and_cancel(self):
+        my_executor = SerialExecutor()
+        order = []
+
+        async def append(item):
+            await asyncio.sleep(0)
+            order.append(item)
+            return item
+
+        async def fail():
+            raise ValueError("a turn failed")
+
+        async def run():
+            first = my_executor.submit("key", append, 1)
+            failing = my_executor.submit("key", fail)
+            cancelled = my_executor.submit("key", append, 2)
+            cancelled.cancel()
+            last = my_executor.submit("key", append, 3)
+            self.assertEqual(my_executor.pending("key"), 4)
+            self.assertEqual(await first, 1)
+            with self.assertRaises(ValueError):
+                await failing
+            self.assertEqual(await my_executor.run("key", append, 4), 4)
+            self.assertEqual(await last, 3)
+
+        asyncio.run(run())
+        self.assertEqual(order, [1, 3, 4], "A failure does not stop the queue, a cancelled function is not called")
+        self.assertEqual(my_executor.stats()["failed"], 1)
+        self.assertEqual(my_executor.pending("key"), 0)
+
+    def test_tasks_kept(self):
+        my_executor = SerialExecutor()
+
+        async def run():
+            turn = my_executor.submit("key", asyncio.sleep, 0.01, "done")
+            self.assertEqual(len(my_executor._tasks), 1, "The task of the queue is referenced by the executor")
+            gc.collect()
+            self.assertEqual(await turn, "done")
+            await asyncio.sleep(0)
+            self.assertEqual(len(my_executor._tasks), 0, "The task is forgotten when the queue is empty")
+
+        asyncio.run(run())
+
+
+class TestKeyedLocks(TestCase):
+    def test_stress(self):
+        counter = _Counter(0.0005)
+        sessions = {key: _framework(key, counter.sync_callback) for key in range(2)}
+        for framework in sessions.values():
+            framework.handle_data_input({})
+        my_locks = KeyedLocks()
+        results = []
+
+        def client(key):
+            counts = []
+            for _ in range(25):
+                with my_locks.hold(key):
+                    counts.append(sessions[key].handle_data_input({})["payload"]["count"])
+            results.append(counts)
+
+        threads = [Thread(target=client, args=(key,)) for key in sessions for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(counter.overlaps, 0, "The requests of a session never overlap")
+        self.assertGreater(counter.max_running, 1, "The requests of different sessions run in parallel")
+        for framework in sessions.values():
+            self.assertEqual(framework._ctx["count"], 100, "No request is lost")
+        for counts in results:
+            self.assertEqual(counts, sorted(counts))
+        self.assertEqual(len(my_locks), 0, "The locks that are not used are removed")
+
+
+class TestKeyedLocksContention(TestCase):
+    def test_stats(self):
+        my_locks = KeyedLocks()
+        with my_locks.hold("a"):
+            with my_locks.hold("b"):
+                pass
+        self.assertEqual(my_locks.stats()["contended"], 0, "Different keys do not contend")
+
+        lock = my_locks.lock("a")
+        lock.acquire()
+        waiter = Thread(target=self._hold, args=(my_locks, "a"))
+        waiter.start()
+        time.sleep(0.05)
+        lock.release()
+        waiter.join()
+        stats = my_locks.stats()
+        self.assertEqual(stats["acquisitions"], 4)
+        self.assertEqual(stats["contended"], 1)
+        self.assertGreater(stats["max_wait"], 0.01)
+        self.assertEqual(stats["contention_rate"], 0.25)
+        self.assertEqual(stats["keys"], 0)
+
+    @staticmethod
+    def _hold(my_locks, key):
+        with my_locks.hold(key):
+            pass
+
+    def test_from_file(self):
+        with tempfile.TemporaryDirectory() as folder:
+            process_path = os.path.join(folder, "process.json")
+            with open(process_path, "w") as file:
+                json.dump({"activities": [{"my_id": "start", "next_id": "end", "my_type": "start"},
+                                          {"my_id": "end", "next_id": None, "my_type": "end"}],
+                           "first_activity_id": "start"}, file)
+            for name in ["one.json", "two.json"]:
+                with open(os.path.join(folder, name), "w") as file:
+                    json.dump({"end": name}, file)
+
+            before = FILE_LOCKS.stats()["acquisitions"]
+            for name in ["one.json", "two.json"]:
+                my_framework = Framework.from_file(process_path, os.path.join(folder, name), {},
+                                                   lambda _: lambda d, k, c: Response(k, c, True), NoNluAdapter([]),
+                                                   kb_registry=FileRegistry(SharedKb))
+                self.assertEqual(my_framework.handle_data_input({})["utterance"], name)
+            self.assertEqual(FILE_LOCKS.stats()["acquisitions"], before + 2, "Each kb file is written with its lock")
+            self.assertEqual(len(FILE_LOCKS), 0)
+
+
+class TestSerialExecutorPipeline(TestCase):
+    def test_pipeline(self):
+        my_executor = SerialExecutor()
+        handled = []
+
+        async def messages():
+            for number in range(20):
+                yield number
+
+        async def handle(prefix, message):
+            await asyncio.sleep(0)
+            handled.append(f"{prefix}{message}")
+
+        asyncio.run(my_executor.pipeline("key", messages(), handle, "m", max_pending=3))
+        self.assertEqual(handled, [f"m{number}" for number in range(20)], "The messages are handled in order")
+        self.assertLessEqual(my_executor.max_queued, 3)
+
+    def test_failed_turn(self):
+        my_executor = SerialExecutor()
+
+        async def messages():
+            yield "ok"
+            yield "fail"
+            # The client waits for the reply, and sends nothing else.
+            await asyncio.sleep(60)
+            yield "never"
+
+        async def handle(message):
+            if message == "fail":
+                raise KeyError("unknown interaction")
+
+        async def run():
+            await asyncio.wait_for(my_executor.pipeline("key", messages(), handle), 5)
+
+        with self.assertRaises(KeyError, msg="The error is raised without waiting for the next message"):
+            asyncio.run(run())
+        self.assertEqual(my_executor.stats()["failed"], 1)
@@ -0,0 +1,336 @@
+import asyncio
+import json
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPException
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from unittest import TestCase
+
+from mmcc_framework.framework import Activity, ActivityType, Framework, Process, Response
+from mmcc_framework.nlu_adapters import CachingNluAdapter, NluAdapter, NluChain, NluTier, NoNluAdapter, RasaNlu
+
+
+class _RasaStub(BaseHTTPRequestHandler):
+    """ Answers like the rasa parse endpoint: the intent is the text, and "none" gives no intent. """
+    protocol_version = "HTTP/1.1"
+
+    def setup(self) -> None:
+        super().setup()
+        # The headers and the body are written separately, avoid waiting for the delayed ack.
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.server.lock:
+            self.server.connections += 1
+            self.server.open += 1
+            self.server.max_open = max(self.server.max_open, self.server.open)
+
+    def finish(self) -> None:
+        super().finish()
+        with self.server.lock:
+            self.server.open -= 1
+
+    def do_POST(self):
+        text = json.loads(self.rfile.read(int(self.headers["Content-Length"])))["text"]
+        if text == "error":
+            status, body = 500, b"error"
+        else:
+            status = 200
+            name = None if text == "none" else text
+            body = json.dumps({"intent": {"name": name}, "entities": [{"entity": "text", "value": text}]}).encode()
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        if self.server.close_each:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+        if self.server.drop_each:
+            # Close without telling the client, like a server that drops the idle connections.
+            self.close_connection = True
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+class TestRasaNlu(TestCase):
+    def setUp(self) -> None:
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _RasaStub)
+        self.server.daemon_threads = True
+        self.server.lock = Lock()
+        self.server.connections = 0
+        self.server.open = 0
+        self.server.max_open = 0
+        self.server.close_each = False
+        self.server.drop_each = False
+        Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        self.nlu = RasaNlu("127.0.0.1", self.server.server_address[1], timeout=5, max_connections=4)
+
+    def tearDown(self) -> None:
+        self.nlu.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_parse(self):
+        self.assertEqual(self.nlu.parse("greet"), {"intent": "greet", "text": "greet"})
+        self.assertEqual(self.nlu.parse("none"), {"intent": ""})
+
+    def test_keep_alive(self):
+        for index in range(50):
+            self.assertEqual(self.nlu.parse(f"intent{index}")["intent"], f"intent{index}")
+        self.assertEqual(self.server.connections, 1, "A single connection is reused by sequential requests")
+        self.assertEqual(self.nlu.stats(), {"requests": 50, "connections": 1})
+
+    def test_bounded_connections(self):
+        texts = [f"intent{index}" for index in range(1000)]
+        with ThreadPoolExecutor(32) as executor:
+            results = list(executor.map(self.nlu.parse, texts))
+        self.assertEqual([result["intent"] for result in results], texts)
+        self.assertLessEqual(self.server.connections, 4, "No more than max_connections are opened")
+        self.assertLessEqual(self.server.max_open, 4)
+
+    def test_server_closes(self):
+        self.server.close_each = True
+        for index in range(5):
+            self.assertEqual(self.nlu.parse(f"intent{index}")["intent"], f"intent{index}")
+        self.assertEqual(self.server.connections, 5, "A connection closed by the server is not reused")
+
+    def test_reconnect(self):
+        self.server.drop_each = True
+        for index in range(5):
+            self.assertEqual(self.nlu.parse(f"intent{index}")["intent"], f"intent{index}")
+        self.assertEqual(self.nlu.stats()["connections"], 5, "A dropped connection is replaced")
+        self.assertEqual(self.server.connections, 5)
+
+    def test_failed_retry(self):
+        self.nlu.parse("first")
+        connections = []
+
+        def send(connection, url, body):
+            # Fails after connecting, like a server that resets the connections while it restarts.
+            connection.connect()
+            connections.append(connection)
+            raise ConnectionResetError("reset")
+
+        self.nlu._pool._send = send
+        with self.assertRaises(ConnectionResetError):
+            self.nlu.parse("second")
+        self.assertEqual(len(connections), 2, "The reused connection is replaced only once")
+        self.assertTrue(all(connection.sock is None for connection in connections), "The connections are closed")
+        del self.nlu._pool._send
+        self.assertEqual(self.nlu.parse("third")["intent"], "third")
+
+    def test_error_status(self):
+        with self.assertRaises(HTTPException):
+            self.nlu.parse("error")
+        self.assertEqual(self.nlu.parse("after")["intent"], "after", "The connection is still usable after an error")
+        self.assertEqual(self.server.connections, 1)
+
+    def test_unreachable(self):
+        self.tearDown()
+        nlu = RasaNlu("127.0.0.1", self.server.server_address[1], timeout=1)
+        with self.assertRaises(OSError):
+            nlu.parse("anything")
+        self.setUp()
+
+    def test_parse_batch(self):
+        texts = [f"intent{index}" for index in range(200)] + ["none"]
+        results = self.nlu.parse_batch(texts)
+        self.assertEqual([result["intent"] for result in results], texts[:-1] + [""])
+        self.assertLessEqual(self.server.connections, 4)
+        self.assertEqual(self.nlu.parse_batch([]), [])
+
+    def test_wrong_size(self):
+        with self.assertRaises(ValueError):
+            RasaNlu(max_connections=0)
+
+
+class TestNoNluAdapter(TestCase):
+    def test_parse(self):
+        self.assertEqual(NoNluAdapter(["a", "b"]).parse("text"), {"a": "text", "b": "text"})
+
+    def test_parse_batch(self):
+        nlu = NoNluAdapter(["a", "b"])
+        results = nlu.parse_batch(["x", "y"])
+        self.assertEqual(results, [nlu.parse("x"), nlu.parse("y")])
+        results[0]["a"] = "z"
+        self.assertEqual(results[1], {"a": "y", "b": "y"}, "Each result is a different dictionary")
+
+
+class _CountingNlu(NluAdapter):
+    def __init__(self) -> None:
+        self.calls = []
+
+    def parse(self, utterance):
+        self.calls.append(utterance)
+        return {"intent": utterance.strip().lower(), "entities": ["a"]}
+
+
+class TestCachingNluAdapter(TestCase):
+    def setUp(self) -> None:
+        self.inner = _CountingNlu()
+        self.nlu = CachingNluAdapter(self.inner, max_size=2)
+
+    def test_hits(self):
+        self.assertEqual(self.nlu.parse("Yes"), {"intent": "yes", "entities": ["a"]})
+        self.assertEqual(self.nlu.parse("  yes "), {"intent": "yes", "entities": ["a"]})
+        self.assertEqual(self.nlu.parse("YES"), {"intent": "yes", "entities": ["a"]})
+        self.assertEqual(self.inner.calls, ["Yes"], "Normalized utterances are parsed once")
+        stats = self.nlu.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["size"]), (2, 1, 1))
+        self.assertAlmostEqual(stats["hit_rate"], 2 / 3)
+
+    def test_copies(self):
+        self.nlu.parse("yes")["entities"].append("b")
+        self.assertEqual(self.nlu.parse("yes"), {"intent": "yes", "entities": ["a"]}, "The results can be modified")
+
+    def test_lru(self):
+        self.nlu.parse("a")
+        self.nlu.parse("b")
+        self.nlu.parse("a")
+        self.nlu.parse("c")
+        self.nlu.parse("a")
+        self.nlu.parse("b")
+        self.assertEqual(self.inner.calls, ["a", "b", "c", "b"], "The least recently used result is evicted")
+        self.assertEqual(self.nlu.evictions, 2)
+
+    def test_ttl(self):
+        nlu = CachingNluAdapter(self.inner, ttl=0.05)
+        nlu.parse("a")
+        nlu.parse("a")
+        time.sleep(0.1)
+        nlu.parse("a")
+        self.assertEqual(self.inner.calls, ["a", "a"])
+        self.assertEqual(nlu.expirations, 1)
+
+    def test_model_version(self):
+        self.nlu.parse("a")
+        self.nlu.model_version = "new"
+        self.nlu.parse("a")
+        self.assertEqual(len(self.inner.calls), 2, "The results of another model are not used")
+
+    def test_parse_batch_default(self):
+        self.assertEqual(self.inner.parse_batch(["a", "b"]), [self.inner.parse("a"), self.inner.parse("b")])
+
+    def test_parse_batch(self):
+        self.nlu.parse("a")
+        results = self.nlu.parse_batch(["A", "b", "B ", "c", "a"])
+        self.assertEqual([result["intent"] for result in results], ["a", "b", "b", "c", "a"])
+        self.assertEqual(self.inner.calls, ["a", "b", "c"], "Each missing utterance is parsed once")
+        self.assertEqual((self.nlu.hits, self.nlu.misses), (3, 3))
+        results[1]["entities"].append("b")
+        self.assertEqual(results[2]["entities"], ["a"], "Each result is a copy")
+
+    def test_async(self):
+        async def run():
+            return [await self.nlu.parse_async("a"), await self.nlu.parse_async("A")]
+
+        self.assertEqual(asyncio.run(run()), [{"intent": "a", "entities": ["a"]}] * 2)
+        self.assertEqual(self.inner.calls, ["a"])
+
+    def test_framework(self):
+        received = []
+
+        def callback(d, k, c):
+            received.append(d)
+            return Response(k, c, False)
+
+        my_framework = Framework(Process([Activity("start", None, ActivityType.START)], "start"), {}, {},
+                                 lambda _: callback, self.nlu, lambda k: None)
+        my_framework.handle_text_input("Hello")
+        my_framework.handle_text_input("hello")
+        self.assertEqual(received, [{"intent": "hello", "entities": ["a"]}] * 2)
+        self.assertEqual(self.inner.calls, ["Hello"], "The second turn does not use the adapter")
+
+
+class _ScriptedNlu(NluAdapter):
+    """ Returns the result, or raises the error, after waiting delay seconds. """
+
+    def __init__(self, result=None, error=None, delay=0.0) -> None:
+        self.result = result
+        self.error = error
+        self.delay = delay
+        self.calls = 0
+
+    def parse(self, utterance):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return dict(self.result)
+
+    async def parse_async(self, utterance):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return dict(self.result)
+
+
+class TestNluChain(TestCase):
+    def setUp(self) -> None:
+        self.rules = _ScriptedNlu({"intent": ""})
+        self.rasa = _ScriptedNlu({"intent": "from_rasa"})
+        self.last = _ScriptedNlu({"intent": "from_last"})
+        self.chain = NluChain([NluTier(self.rules, name="rules"),
+                               NluTier(self.rasa, timeout=0.2, max_failures=2, cool_down=0.3, name="rasa"),
+                               NluTier(self.last, name="last")])
+
+    def tearDown(self) -> None:
+        self.chain.close()
+
+    def test_order(self):
+        self.assertEqual(self.chain.parse("a"), {"intent": "from_rasa"})
+        self.rules.result = {"intent": "from_rules"}
+        self.assertEqual(self.chain.parse("a"), {"intent": "from_rules"})
+        self.assertEqual(self.chain.stats()["answered"], {"rules": 1, "rasa": 1, "last": 0})
+
+    def test_errors_and_circuit_breaker(self):
+        self.rasa.error = ConnectionRefusedError()
+        self.assertEqual(self.chain.parse("a"), {"intent": "from_last"})
+        self.assertEqual(self.chain.parse("a"), {"intent": "from_last"})
+        self.assertEqual(self.chain.stats()["open"], ["rasa"])
+        self.assertEqual(self.chain.parse("a"), {"intent": "from_last"})
+        self.assertEqual(self.rasa.calls, 2, "The open tier is not used")
+        self.assertEqual(self.chain.stats()["skipped"]["rasa"], 1)
+
+        time.sleep(0.35)
+        self.assertEqual(self.chain.parse("a"), {"intent": "from_last"})
+        self.assertEqual(self.rasa.calls, 3, "One utterance tests the tier after the cool down")
+        self.assertEqual(self.chain.stats()["open"], ["rasa"], "The tier failed again")
+
+        time.sleep(0.35)
+        self.rasa.error = None
+        self.assertEqual(self.chain.parse("a"), {"intent": "from_rasa"})
+        self.assertEqual(self.chain.stats()["open"], [])
+        self.assertEqual(self.chain.failures["rasa"], 3)
+
+    def test_timeout(self):
+        self.rasa.delay = 1
+        begin = time.monotonic()
+        self.assertEqual(self.chain.parse("a"), {"intent": "from_last"})
+        self.assertLess(time.monotonic() - begin, 0.5)
+        self.assertEqual(self.chain.timeouts["rasa"], 1)
+
+    def test_budget(self):
+        self.rasa.delay = 1
+        self.chain.budget = 0.1
+        begin = time.monotonic()
+        self.assertEqual(self.chain.parse("a"), {"intent": ""}, "The budget is over before the last tier")
+        self.assertLess(time.monotonic() - begin, 0.5)
+        self.assertEqual(self.chain.unanswered, 1)
+        self.assertEqual(self.last.calls, 0)
+
+    def test_async(self):
+        async def run():
+            first = await self.chain.parse_async("a")
+            self.rasa.delay = 1
+            second = await self.chain.parse_async("a")
+            return first, second
+
+        self.assertEqual(asyncio.run(run()), ({"intent": "from_rasa"}, {"intent": "from_last"}))
+        self.assertEqual(self.chain.timeouts["rasa"], 1)
+
+    def test_names(self):
+        with self.assertRaises(ValueError):
+            NluChain([NoNluAdapter([]), NoNluAdapter([])])
+        self.assertEqual(NluChain([NoNluAdapter(["intent"])]).parse("hi"), {"intent": "hi"})
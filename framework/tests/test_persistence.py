@@ -0,0 +1,181 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from mmcc_framework.framework import *
+from mmcc_framework.kb import SharedKb
+from mmcc_framework.nlu_adapters import NoNluAdapter
+from mmcc_framework.persistence import KbJournal, WriteBehindSaver, atomic_write
+from mmcc_framework.registry import FileRegistry
+
+
+class TestAtomicWrite(TestCase):
+    def test_atomic_write(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "my_file.json")
+            atomic_write(path, b"first")
+            atomic_write(path, b"second")
+            with open(path, "rb") as file:
+                self.assertEqual(file.read(), b"second", "The file contains the last data")
+            self.assertEqual(os.listdir(folder), ["my_file.json"], "No temporary file is left")
+
+
+class TestWriteBehindSaver(TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "my_file.json")
+        self.my_saver = WriteBehindSaver(delay=0.2, close_at_exit=False)
+
+    def tearDown(self) -> None:
+        self.my_saver.close()
+        self.dir.cleanup()
+
+    def test_coalesce(self):
+        produced = []
+        for i in range(10):
+            self.my_saver.save(self.path, lambda i=i: produced.append(i) or str(i).encode())
+        self.assertTrue(self.my_saver.flush(5))
+        self.assertEqual(produced, [9], "Only the last save is produced")
+        self.assertEqual((self.my_saver.requested, self.my_saver.written), (10, 1))
+        with open(self.path, "rb") as file:
+            self.assertEqual(file.read(), b"9")
+
+    def test_on_written(self):
+        written = []
+        self.my_saver.save(self.path, lambda: b"data", on_written=written.append)
+        self.my_saver.flush()
+        self.assertEqual(written, [b"data"], "The callback receives the written data")
+
+    def test_flush_raises(self):
+        def fail():
+            raise ValueError()
+
+        self.my_saver.save(self.path, fail)
+        with self.assertRaises(ValueError, msg="The errors of the writes are raised by flush"):
+            self.my_saver.flush()
+        self.assertTrue(self.my_saver.flush(), "The errors are raised only once")
+
+    def test_close(self):
+        self.my_saver.save(self.path, lambda: b"data")
+        self.assertTrue(self.my_saver.close())
+        self.assertTrue(os.path.exists(self.path), "The pending saves are written when closing")
+        with self.assertRaises(RuntimeError, msg="Raise if saving after closing"):
+            self.my_saver.save(self.path, lambda: b"data")
+
+
+class TestKbJournal(TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "my_kb.json")
+        with open(self.path, "w") as file:
+            json.dump({"address": "Old street", "items": ["cap"]}, file)
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def read(self, path):
+        with open(path, "rb") as file:
+            return file.read()
+
+    def test_record(self):
+        my_journal = KbJournal(self.path, saver=WriteBehindSaver(close_at_exit=False))
+        my_view = my_journal.kb.view()
+        my_view["address"] = "New street"
+        del my_view["items"]
+        my_journal.record(my_view)
+
+        self.assertEqual(json.loads(self.read(self.path)), {"address": "Old street", "items": ["cap"]},
+                         "The snapshot is not written")
+        self.assertEqual(self.read(my_journal.journal_path), b'{"set":{"address":"New street"},"del":["items"]}\n',
+                         "The changes are appended to the journal")
+        self.assertEqual(my_journal.records, 1)
+        self.assertEqual(KbJournal(self.path).kb.to_dict(), {"address": "New street"}, "The journal is replayed")
+
+    def test_record_dict(self):
+        my_journal = KbJournal(self.path, saver=WriteBehindSaver(close_at_exit=False))
+        my_journal.record({"only": "this"})
+        self.assertEqual(KbJournal(self.path).kb.to_dict(), {"only": "this"}, "A dictionary replaces the kb")
+
+    def test_compaction(self):
+        my_journal = KbJournal(self.path, compact_every=3, saver=WriteBehindSaver(delay=0, close_at_exit=False))
+        for i in range(3):
+            my_view = my_journal.kb.view()
+            my_view["address"] = f"Street {i}"
+            my_journal.record(my_view)
+        my_journal._saver.flush()
+
+        self.assertEqual(json.loads(self.read(self.path))["address"], "Street 2", "The snapshot is written")
+        self.assertEqual(self.read(my_journal.journal_path), b"", "The journal is emptied")
+        self.assertEqual(my_journal.records, 0)
+
+        my_view = my_journal.kb.view()
+        my_view["address"] = "Last street"
+        my_journal.record(my_view)
+        my_journal.close()
+        self.assertEqual(json.loads(self.read(self.path))["address"], "Last street", "The journal is compacted")
+        self.assertEqual(self.read(my_journal.journal_path), b"")
+
+    def test_incomplete_record(self):
+        with open(self.path + ".journal", "wb") as file:
+            file.write(b'{"set":{"address":"New street"},"del":[]}\n{"set":{"addr')
+        my_journal = KbJournal(self.path, saver=WriteBehindSaver(close_at_exit=False))
+        self.assertEqual(my_journal.kb["address"], "New street", "The complete records are replayed")
+        self.assertEqual(my_journal.records, 1)
+        self.assertEqual(self.read(my_journal.journal_path), b'{"set":{"address":"New street"},"del":[]}\n',
+                         "The incomplete record is removed")
+
+
+class TestFrameworkWriteBehind(TestCase):
+    @staticmethod
+    def callback_getter(_):
+        def callback(d, k, c):
+            k["address"] = d["address"]
+            return Response(k, c, True)
+
+        return callback
+
+    def test_save(self):
+        with tempfile.TemporaryDirectory() as folder:
+            process_path = os.path.join(folder, "my_process.json")
+            kb_path = os.path.join(folder, "my_kb.json")
+            with open(process_path, "w") as file:
+                json.dump({"activities": [{"my_id": "start", "next_id": "end", "my_type": "start"},
+                                          {"my_id": "end", "next_id": None, "my_type": "end"}],
+                           "first_activity_id": "start"}, file)
+            with open(kb_path, "w") as file:
+                json.dump({"address": "Old street"}, file)
+
+            my_saver = WriteBehindSaver(close_at_exit=False)
+            my_registry = FileRegistry(SharedKb, check_interval=0)
+            for address in ["First street", "Second street"]:
+                Framework.from_file(process_path, kb_path, {}, self.callback_getter, NoNluAdapter([]),
+                                    kb_registry=my_registry, saver=my_saver).handle_data_input({"address": address})
+            my_saver.close()
+            PROCESS_REGISTRY.invalidate(process_path)
+
+            with open(kb_path) as file:
+                self.assertEqual(json.load(file), {"address": "Second street"}, "The last kb is saved")
+            self.assertEqual(my_registry.get(kb_path)["address"], "Second street", "The shared kb is not reloaded")
+
+    def test_journal(self):
+        with tempfile.TemporaryDirectory() as folder:
+            process_path = os.path.join(folder, "my_process.json")
+            kb_path = os.path.join(folder, "my_kb.json")
+            with open(process_path, "w") as file:
+                json.dump({"activities": [{"my_id": "start", "next_id": "end", "my_type": "start"},
+                                          {"my_id": "end", "next_id": None, "my_type": "end"}],
+                           "first_activity_id": "start"}, file)
+            with open(kb_path, "w") as file:
+                json.dump({"address": "Old street"}, file)
+
+            my_journal = KbJournal(kb_path, saver=WriteBehindSaver(close_at_exit=False))
+            Framework.from_file(process_path, kb_path, {}, self.callback_getter, NoNluAdapter([]),
+                                journal=my_journal).handle_data_input({"address": "New street"})
+            with self.assertRaises(ValueError, msg="Raise if the journal is not of the kb"):
+                Framework.from_file(process_path, process_path, {}, self.callback_getter, NoNluAdapter([]),
+                                    journal=my_journal)
+            PROCESS_REGISTRY.invalidate(process_path)
+
+            self.assertEqual(my_journal.records, 1, "The completion is recorded in the journal")
+            self.assertEqual(KbJournal(kb_path).kb["address"], "New street")
@@ -0,0 +1,137 @@
+import json
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from mmcc_framework.framework import *
+from mmcc_framework.persistence import atomic_write
+from mmcc_framework.nlu_adapters import NoNluAdapter
+from mmcc_framework.registry import FileRegistry
+
+
+class TestFileRegistry(TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "my_file.json")
+        self.write({"key": "value"})
+        self.built = []
+        self.my_registry = FileRegistry(self.factory, check_interval=0)
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def factory(self, dictionary):
+        self.built.append(dictionary)
+        return dictionary
+
+    def write(self, contents, mtime=None):
+        with open(self.path, "w") as file:
+            json.dump(contents, file)
+        if mtime is not None:
+            os.utime(self.path, ns=(mtime, mtime))
+
+    def test_get(self):
+        first = self.my_registry.get(self.path)
+        self.assertEqual(first, {"key": "value"}, "The object is built from the file")
+        self.assertIs(self.my_registry.get(self.path), first, "The same object is returned")
+        self.assertEqual(len(self.built), 1, "The file is parsed only once")
+
+    def test_get_changed(self):
+        first = self.my_registry.get(self.path)
+        self.write({"key": "other value"}, mtime=1)
+        second = self.my_registry.get(self.path)
+        self.assertEqual(second, {"key": "other value"}, "The object is rebuilt when the file changes")
+        self.assertIsNot(second, first)
+
+    def test_get_touched(self):
+        first = self.my_registry.get(self.path)
+        self.write({"key": "value"}, mtime=1)
+        self.assertIs(self.my_registry.get(self.path), first, "The object is kept when the content does not change")
+        self.assertEqual(len(self.built), 1, "The file is parsed only once")
+
+    def test_check_interval(self):
+        my_registry = FileRegistry(self.factory, check_interval=3600)
+        first = my_registry.get(self.path)
+        self.write({"key": "other value"}, mtime=1)
+        self.assertIs(my_registry.get(self.path), first, "The file is not checked before the interval elapses")
+
+    def test_invalidate(self):
+        first = self.my_registry.get(self.path)
+        digest = self.my_registry.digest(self.path)
+        self.assertIsNotNone(digest, "The digest of a read file is known")
+        self.my_registry.invalidate(self.path)
+        self.assertIsNone(self.my_registry.digest(self.path), "The digest is removed with the file")
+        self.assertIsNot(self.my_registry.get(self.path), first, "The object is rebuilt after invalidate")
+        self.assertEqual(self.my_registry.digest(self.path), digest, "The digest depends on the content")
+
+
+class TestFrameworkFromFile(TestCase):
+    @staticmethod
+    def callback_getter(_):
+        return lambda d, k, c: Response(k, c, True)
+
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.process_path = os.path.join(self.dir.name, "my_process.json")
+        self.kb_path = os.path.join(self.dir.name, "my_kb.json")
+        with open(self.process_path, "w") as file:
+            json.dump({"activities": [{"my_id": "start", "next_id": "end", "my_type": "start"},
+                                      {"my_id": "end", "next_id": None, "my_type": "end"}],
+                       "first_activity_id": "start"}, file)
+        with open(self.kb_path, "w") as file:
+            json.dump({"end": "Bye"}, file)
+
+    def tearDown(self) -> None:
+        PROCESS_REGISTRY.invalidate(self.process_path)
+        self.dir.cleanup()
+
+    def test_shared_process(self):
+        first = Framework.from_file(self.process_path, self.kb_path, {}, self.callback_getter, NoNluAdapter([]))
+        second = Framework.from_file(self.process_path, self.kb_path, {}, self.callback_getter, NoNluAdapter([]))
+        self.assertIs(first._process, second._process, "The instances share the same process")
+        self.assertEqual(first.handle_data_input({})["utterance"], "Bye")
+
+    def test_process_digest(self):
+        my_framework = Framework.from_file(self.process_path, self.kb_path, {}, self.callback_getter,
+                                           NoNluAdapter([]))
+        self.assertEqual(my_framework._process.digest, Process.from_dict(my_framework._process.to_dict()).digest,
+                         "Equivalent processes have the same digest")
+
+
+class TestFileRegistryWrite(TestCase):
+    def test_get_while_writing(self):
+        with tempfile.TemporaryDirectory() as folder:
+            process_path = os.path.join(folder, "process.json")
+            kb_path = os.path.join(folder, "kb.json")
+            with open(process_path, "w") as file:
+                json.dump({"activities": [{"my_id": "start", "next_id": "end", "my_type": "start"},
+                                          {"my_id": "end", "next_id": None, "my_type": "end"}],
+                           "first_activity_id": "start"}, file)
+            with open(kb_path, "w") as file:
+                json.dump({"count": 0}, file)
+            my_registry = FileRegistry(SharedKb, check_interval=0)
+
+            def callback(d, k, c):
+                k["count"] += 1
+                return Response(k, c, True)
+
+            def create():
+                return Framework.from_file(process_path, kb_path, {}, lambda _: callback, NoNluAdapter([]),
+                                           kb_registry=my_registry)
+
+            shared = my_registry.get(kb_path)
+            during_write = []
+            original_write = atomic_write
+
+            def write_and_get(path, data):
+                original_write(path, data)
+                # A session created after the file is replaced, before the registry is updated.
+                during_write.append(my_registry.get(kb_path))
+
+            with mock.patch("mmcc_framework.framework.atomic_write", write_and_get):
+                create().handle_data_input({})
+            self.assertIs(during_write[0], shared, "The kb written by this process is not loaded again")
+            create().handle_data_input({})
+            self.assertEqual(shared["count"], 2, "The sessions commit to the same kb")
+            with open(kb_path) as file:
+                self.assertEqual(json.load(file)["count"], 2)
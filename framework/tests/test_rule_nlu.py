@@ -0,0 +1,81 @@
+import asyncio
+import os
+from unittest import TestCase, skipUnless
+
+from mmcc_framework.nlu_adapters import NluAdapter
+from mmcc_framework.rule_nlu import RuleNlu
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+NLU_FILE = os.path.join(os.path.dirname(__file__), "..", "..", "demo", "rasa", "data", "nlu.yml")
+
+
+class _FixedNlu(NluAdapter):
+    def __init__(self) -> None:
+        self.calls = []
+
+    def parse(self, utterance):
+        self.calls.append(utterance)
+        return {"intent": "from_fallback"}
+
+
+class TestRuleNlu(TestCase):
+    def setUp(self) -> None:
+        self.fallback = _FixedNlu()
+        self.nlu = RuleNlu({"greet": ["hello", "hello there", "good afternoon"],
+                            "goodbye": ["bye", "good afternoon"],
+                            "give_address": ["Ship to [London](address)", "I live in [Rome](address)"],
+                            "state_preference": ["The [grey](preference) ones", "The [cap](preference)"],
+                            "change_something": ["The [size](change)", "Change the [color](change)"]},
+                           synonyms={"grey": ["gray"]},
+                           lookups={"preference": ["hat"]},
+                           fallback=self.fallback)
+
+    def test_exact(self):
+        self.assertEqual(self.nlu.parse("Hello there!"), {"intent": "greet"})
+        self.assertEqual(self.nlu.parse("the CAP"), {"intent": "state_preference", "preference": "cap"})
+        self.assertEqual(self.fallback.calls, [])
+
+    def test_ambiguous_exact(self):
+        self.assertEqual(self.nlu.parse("good afternoon"), {"intent": "from_fallback"})
+
+    def test_template(self):
+        self.assertEqual(self.nlu.parse("ship to New York"), {"intent": "give_address", "address": "New York"})
+        self.assertEqual(self.nlu.parse("I live in Gray"), {"intent": "give_address", "address": "grey"},
+                         "The synonyms are replaced")
+        self.assertEqual(self.nlu.parse("Ship to a place with too many words"), {"intent": "from_fallback"})
+
+    def test_keyword(self):
+        self.assertEqual(self.nlu.parse("a hat, please"), {"intent": "state_preference", "preference": "hat"})
+        self.assertEqual(self.nlu.parse("the color"), {"intent": "change_something", "change": "color"},
+                         "The keywords are used when two templates match")
+        self.assertEqual(self.nlu.parse("the hat or the size"), {"intent": "from_fallback"})
+
+    def test_no_fallback(self):
+        self.nlu.fallback = None
+        self.assertEqual(self.nlu.parse("something else"), {"intent": ""})
+        self.assertEqual(self.nlu.stats(), {"matched": 0, "deferred": 1})
+
+    def test_batch_and_async(self):
+        utterances = ["hello", "something else", "bye"]
+        self.assertEqual(self.nlu.parse_batch(utterances),
+                         [{"intent": "greet"}, {"intent": "from_fallback"}, {"intent": "goodbye"}])
+        self.assertEqual(asyncio.run(self.nlu.parse_async("something else")), {"intent": "from_fallback"})
+        self.assertEqual(self.fallback.calls, ["something else", "something else"])
+
+    def test_annotations(self):
+        nlu = RuleNlu({"pay": ["use [card](method:credit_card) to pay",
+                               'use [cash]{"entity": "method", "value": "money"} please']})
+        self.assertEqual(nlu.parse("use card to pay"), {"intent": "pay", "method": "credit_card"})
+        self.assertEqual(nlu.parse("use cash please"), {"intent": "pay", "method": "money"})
+
+    @skipUnless(yaml, "PyYAML is not installed")
+    def test_from_rasa_file(self):
+        nlu = RuleNlu.from_rasa_file(NLU_FILE)
+        self.assertEqual(nlu.parse("hello there"), {"intent": "greet"})
+        self.assertEqual(nlu.parse("Use 1234 to pay"), {"intent": "payment_details", "details": "1234"})
+        self.assertEqual(nlu.parse("I would like the skateboard"),
+                         {"intent": "state_preference", "preference": "skateboard"})
@@ -0,0 +1,266 @@
+import asyncio
+import os
+import tempfile
+import time
+from threading import Thread, current_thread, main_thread
+from unittest import TestCase
+from unittest.mock import patch
+
+from mmcc_framework.framework import *
+from mmcc_framework.nlu_adapters import NoNluAdapter
+from mmcc_framework.persistence import atomic_write
+from mmcc_framework.sessions import SESSION_OVERHEAD, ResponseLog, SessionStore
+
+
+def record(function, threads):
+    """ Returns a function that calls function, after appending the current thread to threads. """
+    def recorded(*args):
+        threads.append(current_thread())
+        return function(*args)
+    return recorded
+
+
+class TestSessionStore(TestCase):
+    @staticmethod
+    def callback_getter(_):
+        return lambda d, k, c: Response(k, c, True)
+
+    @classmethod
+    def factory(cls):
+        return Framework(Process([Activity("start", "task", ActivityType.START),
+                                  Activity("task", "end", ActivityType.TASK),
+                                  Activity("end", None, ActivityType.END)], "start"),
+                         {"end": "Bye"}, {}, cls.callback_getter, NoNluAdapter([]), lambda k: None)
+
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.my_store = SessionStore(self.factory, self.dir.name, max_sessions=2)
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_put_get(self):
+        my_framework = self.factory()
+        self.my_store.put(("uid", "one"), my_framework)
+        self.assertIs(self.my_store.get(("uid", "one")), my_framework, "The session is kept in memory")
+        self.assertIn(("uid", "one"), self.my_store)
+        self.assertNotIn(("uid", "two"), self.my_store)
+        with self.assertRaises(KeyError, msg="Raise if the session does not exist"):
+            self.my_store.get(("uid", "two"))
+        self.assertEqual(self.my_store.stats()["hits"], 1)
+        self.assertEqual(self.my_store.stats()["misses"], 1)
+
+    def test_eviction(self):
+        for i in range(3):
+            self.my_store.put(("uid", str(i)), self.factory())
+        self.my_store.get(("uid", "0")).handle_data_input({})
+        stats = self.my_store.stats()
+        self.assertEqual(stats["evictions"], 2, "The least recently used sessions are evicted")
+        self.assertEqual(stats["restores"], 1, "The evicted session is restored")
+        self.assertEqual(stats["memory_sessions"], 2, "The sessions in memory are bounded")
+        self.assertEqual(stats["disk_sessions"], 1)
+
+        self.my_store.get(("uid", "1"))
+        restored = self.my_store.get(("uid", "0"))
+        self.assertEqual(restored._current.id, "task", "The state of the evicted session is kept")
+        self.assertEqual(restored.handle_data_input({})["utterance"], "Bye")
+
+    def test_in_use_not_evicted(self):
+        async def slow_callback(d, k, c):
+            c["written"] = True
+            await asyncio.sleep(0)
+            return Response(k, c, True)
+
+        def factory():
+            return Framework(Process([Activity("start", "a", ActivityType.START),
+                                      Activity("a", "end", ActivityType.TASK),
+                                      Activity("end", None, ActivityType.END)], "start"),
+                             {}, {}, lambda a: slow_callback if a == "a" else lambda d, k, c: Response(k, c, True),
+                             NoNluAdapter([]), lambda k: None)
+
+        my_store = SessionStore(factory, self.dir.name, max_sessions=1)
+        my_store.put("A", factory())
+        my_store.get("A").handle_data_input({})
+
+        async def run():
+            with my_store.using("A") as my_framework:
+                turn = asyncio.ensure_future(my_framework.handle_data_input_async({}))
+                await asyncio.sleep(0)
+                my_store.put("B", factory())  # Over the budget while the turn of A is running.
+                self.assertEqual(my_store.stats()["evictions"], 0, "The session in use is not evicted")
+                await turn
+
+        asyncio.run(run())
+        self.assertEqual(my_store.stats()["evictions"], 1, "The session is evicted after its turn")
+        my_framework = my_store.get("A")
+        self.assertEqual(my_framework._current.id, "end", "The state at the end of the turn is kept")
+        self.assertTrue(my_framework._ctx["written"])
+
+        with my_store.using("A"):
+            self.assertEqual(my_store.reap(0, 0), 1, "Only the session that is not in use is reaped")
+        self.assertIn("A", my_store)
+
+    def test_async_io(self):
+        threads = []
+
+        def factory():
+            threads.append(current_thread())
+            return self.factory()
+
+        my_store = SessionStore(factory, self.dir.name, max_sessions=1)
+        my_store.put("A", self.factory())
+        my_store.put("B", self.factory())
+
+        async def run():
+            async with my_store.using_async("A") as my_framework:
+                my_framework.handle_data_input({})
+            async with my_store.using_async("A") as my_framework:
+                self.assertEqual(my_framework._current.id, "task")
+
+        with patch("mmcc_framework.sessions.atomic_write", record(atomic_write, threads)):
+            asyncio.run(run())
+        self.assertEqual(len(threads), 2, "A session was restored and one was written")
+        self.assertNotIn(main_thread(), threads, "The files are read and written in the executor")
+        self.assertEqual(my_store.stats()["evictions"], 2)
+
+    def test_taken_back(self):
+        my_store = SessionStore(self.factory, self.dir.name, max_sessions=1)
+        my_store.put("A", self.factory())
+        evicted = my_store._put("B", self.factory())
+        self.assertEqual([key for key, _ in evicted], ["A"])
+        my_framework = my_store.get("A")
+        my_framework.handle_data_input({})
+        my_store._write(evicted)
+        self.assertEqual(my_store.stats()["disk_sessions"], 0, "A session taken back while evicted is not written")
+        self.assertIs(my_store.get("A"), my_framework)
+        self.assertEqual(my_store.stats()["restores"], 0)
+
+    def test_max_bytes(self):
+        my_store = SessionStore(self.factory, self.dir.name, max_bytes=1)
+        my_store.put("one", self.factory())
+        my_store.put("two", self.factory())
+        self.assertEqual(my_store.stats()["memory_sessions"], 1, "The sessions over the budget are evicted")
+        self.assertIn("one", my_store)
+
+    def test_size_updated(self):
+        my_store = SessionStore(self.factory, self.dir.name, max_bytes=2 * SESSION_OVERHEAD + 10000)
+        my_store.put("one", self.factory())
+        my_store.put("two", self.factory())
+        self.assertEqual(my_store.stats()["memory_sessions"], 2)
+        with my_store.using("one") as my_framework:
+            my_framework._ctx["text"] = "x" * 100000
+        self.assertGreater(my_store.stats()["memory_bytes"], 100000, "The size is estimated without compression")
+        self.assertEqual(my_store.stats()["memory_sessions"], 1, "A session that grows in a turn causes an eviction")
+        self.assertEqual(my_store.stats()["evictions"], 1)
+
+    def test_discard(self):
+        for i in range(3):
+            self.my_store.put(("uid", str(i)), self.factory())
+        self.my_store.discard(("uid", "0"))
+        self.my_store.discard(("uid", "2"))
+        self.assertNotIn(("uid", "0"), self.my_store, "A session is removed from the disk")
+        self.assertNotIn(("uid", "2"), self.my_store, "A session is removed from memory")
+        self.assertEqual(self.my_store.stats()["disk_sessions"], 0)
+
+    def test_reap(self):
+        for i in range(3):
+            self.my_store.put(("uid", str(i)), self.factory())
+        completed = self.my_store.get(("uid", "2"))
+        completed.handle_data_input({})
+        completed.handle_data_input({})
+        self.assertTrue(completed.is_completed())
+
+        self.assertEqual(self.my_store.reap(3600, 3600), 0, "The recent sessions are kept")
+        self.assertEqual(self.my_store.reap(3600, 0), 1, "The completed session is removed")
+        self.assertNotIn(("uid", "2"), self.my_store)
+
+        self.my_store._memory[("uid", "1")].last_used -= 100
+        path = self.my_store._path(("uid", "0"))
+        os.utime(path, (time.time() - 100, time.time() - 100))
+        self.assertEqual(self.my_store.reap(50, 50, keep={("uid", "1")}), 1, "The idle session on the disk is removed")
+        self.assertNotIn(("uid", "0"), self.my_store)
+        self.assertIn(("uid", "1"), self.my_store, "The sessions to keep are not removed")
+        self.assertEqual(self.my_store.stats()["reaped"], 2)
+
+    def test_release(self):
+        self.my_store.put("one", self.factory())
+        self.assertFalse(self.my_store.release("one"), "A session that is not completed is kept")
+        self.my_store.get("one").handle_data_input({})
+        self.my_store.get("one").handle_data_input({})
+        self.assertTrue(self.my_store.release("one"), "A completed session is removed")
+        self.assertNotIn("one", self.my_store)
+
+    def test_release_in_use(self):
+        self.my_store.put("one", self.factory())
+        with self.my_store.using("one") as my_framework:
+            my_framework.handle_data_input({})
+            my_framework.handle_data_input({})
+            self.assertFalse(self.my_store.release("one"), "A session in use is not removed")
+        self.assertTrue(self.my_store.release("one"))
+
+    def test_reap_without_lock(self):
+        for i in range(3):
+            self.my_store.put(("uid", str(i)), self.factory())
+        acquired = []
+        original = os.scandir
+
+        def scandir(path):
+            # Another thread can use the store while the folder is scanned, and restores the session on the disk.
+            thread = Thread(target=lambda: acquired.append(self.my_store.get(("uid", "0")) is not None))
+            thread.start()
+            thread.join(5)
+            return original(path)
+
+        with patch("mmcc_framework.sessions.os.scandir", scandir):
+            self.assertEqual(self.my_store.reap(0, 0), 2, "The sessions in memory are removed")
+        self.assertEqual(acquired, [True])
+        self.assertIn(("uid", "0"), self.my_store, "The session restored during the scan is not removed")
+
+
+class TestResponseLog(TestCase):
+    def setUp(self) -> None:
+        self.my_framework = TestSessionStore.factory()
+        self.my_log = ResponseLog(max_size=2)
+
+    def handle(self, expected):
+        return self.my_log.handle("key", self.my_framework, expected, lambda f: f.handle_data_input({}))
+
+    def test_handle(self):
+        response, status = self.handle(0)
+        self.assertEqual(status, 200)
+        self.assertEqual(response["version"], 1)
+        self.assertEqual(self.my_log.get("key"), response)
+        response, status = self.handle(None)
+        self.assertEqual(status, 200, "The inputs without version are always handled")
+        self.assertEqual(response["version"], 2)
+
+    def test_retry(self):
+        first, _ = self.handle(0)
+        self.assertEqual(self.handle(0), (first, 200), "A retry receives the same response")
+        self.assertEqual(self.my_framework.version, 1, "A retry is not handled again")
+        self.assertEqual(self.my_log.stats()["replayed"], 1)
+
+    def test_conflict(self):
+        self.handle(0)
+        self.handle(1)
+        response, status = self.handle(0)
+        self.assertEqual(status, 409, "An old version that is not the last one is refused")
+        self.assertEqual(response["version"], 2)
+        self.my_log = ResponseLog()
+        self.assertEqual(self.handle(1)[1], 409, "A retry whose response is not remembered is refused")
+        self.assertEqual(self.my_framework.version, 2)
+
+    def test_invalid_version(self):
+        for expected in ["0", 0.0, True, [0]]:
+            response, status = self.handle(expected)
+            self.assertEqual(status, 400)
+            self.assertIn("error", response)
+        self.assertEqual(self.my_framework.version, 0, "The input with an invalid version is not handled")
+
+    def test_max_size(self):
+        for key in ["a", "b", "c"]:
+            self.my_log.remember(key, {"version": 1})
+        self.assertIsNone(self.my_log.get("a"), "The least recently used response is forgotten")
+        self.assertEqual(self.my_log.stats()["responses"], 2)
+        with self.assertRaises(ValueError):
+            ResponseLog(max_size=0)
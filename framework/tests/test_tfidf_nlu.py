@@ -0,0 +1,57 @@
+import os
+import tempfile
+from unittest import TestCase, skipUnless
+
+from mmcc_framework.nlu_adapters import NluAdapter
+
+try:
+    import numpy
+    from mmcc_framework.tfidf_nlu import TfidfNlu
+except ImportError:
+    numpy = None
+
+EXAMPLES = {"greet": ["hello", "hello there", "hi", "good morning"],
+            "goodbye": ["bye", "goodbye", "see you later", "bye bye"],
+            "state_preference": ["I would like the [sweatshirt](preference)", "I prefer the [grey](preference) ones"],
+            "empty": []}
+
+
+class _FixedNlu(NluAdapter):
+    def parse(self, utterance):
+        return {"intent": "from_fallback"}
+
+
+@skipUnless(numpy, "NumPy is not installed")
+class TestTfidfNlu(TestCase):
+    def setUp(self) -> None:
+        self.nlu = TfidfNlu.train(EXAMPLES)
+
+    def test_parse(self):
+        self.assertEqual(self.nlu.intents, ["greet", "goodbye", "state_preference"])
+        self.assertEqual(self.nlu.parse("Hello!"), {"intent": "greet"})
+        self.assertEqual(self.nlu.parse("byebye"), {"intent": "goodbye"})
+        self.assertEqual(self.nlu.parse("I'd like the sweatshirts"), {"intent": "state_preference"})
+        self.assertEqual(self.nlu.parse("qqq"), {"intent": ""})
+        self.assertEqual(self.nlu.parse(""), {"intent": ""})
+
+    def test_fallback(self):
+        self.nlu.fallback = _FixedNlu()
+        self.assertEqual(self.nlu.parse("qqq"), {"intent": "from_fallback"})
+        self.assertEqual(self.nlu.parse_batch(["qqq", "hi"]), [{"intent": "from_fallback"}, {"intent": "greet"}])
+
+    def test_batch(self):
+        utterances = ["hello there", "see you", "the grey ones please", "qqq", "", "good morning to you"] * 300
+        self.assertEqual(self.nlu.parse_batch(utterances), [self.nlu.parse(utterance) for utterance in utterances])
+        self.assertEqual(self.nlu.parse_batch([]), [])
+
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "model.npz")
+            self.nlu.save(path)
+            loaded = TfidfNlu.load(path)
+            strict = TfidfNlu.load(path, threshold=0.99)
+        utterances = ["hello there", "see you", "the grey ones please", "qqq"]
+        self.assertEqual(loaded.parse_batch(utterances), self.nlu.parse_batch(utterances))
+        numpy.testing.assert_allclose(loaded.classify_batch(utterances)[1], self.nlu.classify_batch(utterances)[1])
+        self.assertEqual(loaded.ngram_range, (1, 4))
+        self.assertEqual(strict.parse("see you"), {"intent": ""})